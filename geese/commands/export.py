@@ -1,92 +1,184 @@
-import csv
-import json
 import os
-from yaml import YAMLError, safe_dump
+from yaml import YAMLError
 import geese.constants.exit_codes as ec
 import argparse
 import sys
 from geese.utils.operations import validate_args, validate_knowledge
+from geese.utils.archive import write_archive
+from geese.utils.artifact_store import ArtifactStore
+from geese.utils.files import atomic_write
+from geese.utils.codec import json_dumps, json_load, load_file
+from geese.utils.export_manifest import export_manifest
+from geese.utils.export_writer import ExportWriter
+from geese.knowledge.versioning import changed_objects
 from geese.constants.common_arguments import add_arguments
-from geese.constants.configs import colors, export_cmd, tuning
-# Check for a "get diff" api call
-
-def _create_dir(export_dir, grp, namespace=None):
-    dur = os.path.join(export_dir, namespace, grp, "configs") if namespace else os.path.join(export_dir, grp, "configs")
-    if not os.path.exists(dur):
-        os.makedirs(dur)
-    return dur
-
-def _write_file(self, export_dir, export_file, data, args):
-    if not args.lookup_only:
-        with open(os.path.join(export_dir, export_file), "w") as of:
-            self._display(f"Writing Exported File {export_file}", colors.get("info", "blue"))
-            if export_file.endswith(".json"):
-                of.write(json.dumps(data, indent=4))
-            else:
-                safe_dump(data, of)
-
-def _build_lookup_item(type, data, wg="default", ns="no_namespace"):
-    # Should have 3 columns. type,id,name,description
-    if type in ["system_auth"]:
-        return []
-    default_id = "id_not_found"
-    default_name = "name_not_found"
-    default_description = "description_not_found"
-    default_parent = "cribl"
-    item = {"type": type, "id": default_id, "name": default_name, "parent": default_parent, "description": default_description, "worker_group": wg, "namespace": ns}
-    if type in ["routes"]:
-        item = [{"type": type, "id": data.get("id", default_id), "name": data.get("name", default_name), "parent": default_parent, "description": data.get("description", default_description), "worker_group": wg, "namespace": ns}]
-        for rts in data.get("routes", []):
-            item.append({"type": f"{type}_route", "id": rts.get("id", default_id), "name": rts.get("name", default_name), "parent": data.get("id", default_id), "description": data.get("description", default_description), "worker_group": wg, "namespace": ns})
-    else:
-        item["id"] = data.get("id", default_id)
-        item["name"] = data.get("name", default_name)
-        item["description"] = data.get("description", default_description)
-        if type in ["pipelines"]:
-            item["name"] = item["id"]
-            item = [item]
-            for i, f in enumerate(data.get('conf', {}).get('functions', [])):
-                item.append({"type": f"{type}_function", "id": f'{i}_{f.get("id", default_id)}', "name": f.get("name", default_name), "parent": item[0].get("id", default_id), "description": f.get("description", default_description), "worker_group": wg, "namespace": ns})
-    return item
-
-def _write_lookup(self, export_dir, export_file, data, args):
-    lookup_items = []
-    lookup_header = ["type", "id", "name", "parent", "description", "worker_group", "namespace"]
-    for o in data:
-        wg = o.get("group", "no_group_found")
-        obj = o.get("data", [])
-        ns = o.get("namespace", "no_namespace_found")
-        if not args.split and not args.use_namespace:
-            for k in obj:
-                for i in obj[k]:
-                    r = _build_lookup_item(k, obj[k][i], wg=wg, ns=ns)
-                    if type(r) is list:
-                        [lookup_items.append(rd) for rd in r]
-                    else:
-                        lookup_items.append(r)
-        elif args.split:
-            t = o.get("object_type", "unknown")
-            for i in obj:
-                r =_build_lookup_item(t, obj[i], wg=wg, ns=ns)
-                if type(r) is list:
-                    [lookup_items.append(rd) for rd in r]
-                else:
-                    lookup_items.append(r)
+from geese.constants.configs import colors, export_cmd, tuning, global_cache_folder
+
+
+def _read_export(path):
+    return load_file(path)
+
+
+def _export_items(data):
+    # Exported files key items by id; items without an id are kept in lists.
+    items = []
+    for v in data.values():
+        if type(v) is list:
+            items.extend(v)
+        else:
+            items.append(v)
+    return items
+
+
+def _previous_items(args, namespace, group, types):
+    """
+    Reads the items of `types` for one group back from the files written by the previous export,
+    including the ones export --dedupe stored in the shared group, or returns None when they cannot be found.
+    """
+    found = _read_previous(args, namespace, group, types)
+    if found is None:
+        return None
+    shared = _read_previous(args, namespace, export_cmd["dedupe_group"], types) or {}
+    for t, items in shared.items():
+        for item in items:
+            if isinstance(item, dict) and group in item.get("worker_groups", []):
+                found[t].append({k: v for k, v in item.items() if k != "worker_groups"})
+    return found
+
+
+def _read_previous(args, namespace, group, types):
+    try:
+        if args.split:
+            base = os.path.join(args.directory, namespace, group, "configs") if args.use_namespace \
+                else os.path.join(args.directory, group, "configs")
+            if not os.path.isdir(base):
+                return None
+            found = {}
+            for t in types:
+                # Object types without items are not written in split mode.
+                path = os.path.join(base, f"{t}.{args.file}")
+                found[t] = _export_items(_read_export(path)["data"]) if os.path.exists(path) else []
+            return found
+        if args.use_namespace:
+            data = _read_export(os.path.join(args.directory, namespace, "configs", args.file))["data"].get(group, {})
         else:
-            for lwg in obj:
-                for t in obj[lwg]:
-                    for i in obj[lwg][t]:
-                        r = _build_lookup_item(t, obj[lwg][t][i], wg=lwg, ns=ns)
-                        if type(r) is list:
-                            [lookup_items.append(rd) for rd in r]
-                        else:
-                            lookup_items.append(r)
-    with open(os.path.join(export_dir, export_file), "w", newline='') as of:
-        self._display(f"\tWriting Lookup File {export_file}", colors.get("info", "blue"))
-        writer = csv.DictWriter(of, fieldnames=lookup_header)
-        writer.writeheader()
-        writer.writerows(lookup_items)
-        # of.write(data)
+            data = _read_export(os.path.join(args.directory, group, "configs", args.file))["data"]
+        return {t: _export_items(data.get(t, {})) for t in types}
+    except (OSError, KeyError, TypeError, ValueError, YAMLError):
+        return None
+
+
+def _incremental_plan(self, args, ko):
+    """
+    Compares each group's configVersion with the one recorded by the previous export in the same directory,
+    and reuses the on-disk objects of the groups that have not changed.
+    """
+    state_file = os.path.join(args.directory, export_cmd["state_file"])
+    previous = {}
+    if os.path.exists(state_file):
+        try:
+            with open(state_file, "r") as f:
+                previous = json_load(f)
+        except (OSError, ValueError) as e:
+            self._display(f"Ignoring unreadable export state {state_file}: {e}", colors.get("warning", "yellow"))
+    layout = {"split": args.split, "use_namespace": args.use_namespace, "file": args.file}
+    if args.dedupe:
+        layout["dedupe"] = True
+    state = {"layout": layout, "groups": {}}
+    if len([s for s in self.sources if s["enabled"]]) > 1 and not args.use_namespace:
+        self._display("Incremental export needs --use-namespace with several sources, exporting everything.",
+                      colors.get("warning", "yellow"))
+        return state
+    # Search objects are not part of a group's committed config, always fetch them.
+    versioned = [t for t in ko if t not in export_cmd["unversioned_objects"] and not t.startswith("srch_")]
+    unchanged = 0
+    for source in self.sources:
+        if not source["enabled"] or (args.namespace and source["namespace"] not in f"{args.namespace}".split(",")):
+            continue
+        versions = self.group_versions(source)
+        for label, key, group in self._source_targets(source):
+            version = versions.get(key, None)
+            if version is None:
+                continue
+            state_key = f"{source['url']}|{source.get('namespace', '')}|{key}"
+            state["groups"][state_key] = {"configVersion": version, "objects": sorted(ko)}
+            last = previous.get("groups", {}).get(state_key, {})
+            if (previous.get("layout", None) != layout or last.get("configVersion", None) != version
+                    or not set(versioned) <= set(last.get("objects", []))):
+                continue
+            items = _previous_items(args, source.get("namespace", None), key, versioned)
+            if items is not None:
+                self.reuse(source, key, items)
+                unchanged += 1
+    self._display(f"Incremental export: {unchanged} of {len(state['groups'])} groups unchanged since the last export",
+                  colors.get("info", "blue"))
+    return state
+
+
+def _merge_ids(previous, fetched, missing):
+    # Keep the previous export's order, swapping in the refetched items and dropping the deleted ones.
+    fetched = {i.get("id", None): i for i in fetched}
+    merged = [fetched.pop(i.get("id", None), i) for i in previous if i.get("id", None) not in missing]
+    return merged + list(fetched.values())
+
+
+def _since_plan(self, args, ko):
+    """
+    Asks the leader which config files of each group changed since commit `args.since`, refetches only the
+    object types (or, for pipelines, the ids) stored in them, and reuses the rest of the previous export.
+    """
+    if len([s for s in self.sources if s["enabled"]]) > 1 and not args.use_namespace:
+        self._display("Export --since needs --use-namespace with several sources, exporting everything.",
+                      colors.get("warning", "yellow"))
+        return
+    versioned = [t for t in ko if t not in export_cmd["unversioned_objects"] and not t.startswith("srch_")]
+    planned = 0
+    for source in self.sources:
+        if not source["enabled"] or (args.namespace and source["namespace"] not in f"{args.namespace}".split(",")):
+            continue
+        for label, key, group in self._source_targets(source):
+            if self.is_reused(source, key):
+                continue
+            paths = self.changed_files(source, group, args.since)
+            if paths is None:
+                self._display(f"Could not list changes since {args.since} for [{key}], exporting it in full.",
+                              colors.get("warning", "yellow"))
+                continue
+            changed, unmapped = changed_objects(paths, group)
+            if len(unmapped) > 0:
+                self._display(f"Changes to {', '.join(unmapped[:3])} in [{key}] do not map to an object type, "
+                              f"exporting it in full.", colors.get("warning", "yellow"))
+                continue
+            previous = _previous_items(args, source.get("namespace", None), key, versioned)
+            if previous is None:
+                self._display(f"No previous export of [{key}] in {args.directory}, exporting it in full.",
+                              colors.get("warning", "yellow"))
+                continue
+            items = {}
+            refetched = []
+            for t in versioned:
+                if t not in changed:
+                    items[t] = previous[t]
+                    continue
+                refetched.append(t if changed[t] is None else f"{t} ({', '.join(sorted(changed[t]))})")
+                if changed[t] is not None:
+                    try:
+                        fetched, missing = self.get_ids(t, source, group, changed[t])
+                        items[t] = _merge_ids(previous[t], fetched, missing)
+                    except Exception as e:
+                        self._display(f"Could not fetch {t} by id ({e}), exporting the whole type.",
+                                      colors.get("warning", "yellow"))
+            self.reuse(source, key, items)
+            planned += 1
+            self._display(f"Export since {args.since}: {len(paths)} changed files in [{key}], refetching "
+                          f"{', '.join(refetched) or 'nothing'}", colors.get("info", "blue"))
+    self._dbg(action="export_since", since=args.since, groups=planned)
+
+
+def _save_state(args, state):
+    atomic_write(os.path.join(args.directory, export_cmd["state_file"]),
+                 json_dumps(state, indent=2, sort_keys=True).encode("utf-8"))
+
 
 def _export_leader(self, args):
     self._logger.debug("action=export_leader")
@@ -94,88 +186,39 @@ def _export_leader(self, args):
         self._display("Exporting Cribl Configurations", colors.get("info", "blue"))
         ko = validate_args(self, args)
         self._dbg(action="exporting_objects", objects=ko)
-        exported_objects = self.get(ko, args.namespace)
+        state = _incremental_plan(self, args, ko) if args.incremental and not args.lookup_only else None
+        if args.since and not args.lookup_only:
+            _since_plan(self, args, ko)
+        store = ArtifactStore(os.path.join(args.directory, export_cmd["artifact_store"])) if args.artifact_store \
+            else None
+        export_manifest.configure(args.directory, export_cmd["manifest_file"], self.sources, store=store)
+        writer = ExportWriter(args, self._display)
+        try:
+            self.get(ko, args.namespace, sink=writer.add)
+        except BaseException:
+            writer.discard()
+            raise
         self._display("Exporting Knowledge Objects", colors.get("info", "blue"))
-        all_objects = {}
-        for obj in exported_objects:
-            if obj not in all_objects and args.use_namespace:
-                all_objects[obj] = {}
-            for record in list(exported_objects[obj].keys()):
-                oo = exported_objects[obj][record].copy()
-                if len(oo) > 0:
-                    if not args.use_namespace and record not in all_objects:
-                        all_objects[record] = {}
-                    elif record not in all_objects and args.use_namespace:
-                        all_objects[obj][record] = {}
-                    if args.use_namespace:
-                        c_obj = all_objects[obj][record]
-                    else:
-                        c_obj = all_objects[record]
-                    for oop in oo:
-                        if len(oo[oop]) > 0:
-                            if oop not in c_obj:
-                                c_obj[oop] = {}
-                            for item in oo[oop]:
-                                id_id = None
-                                for my_id in ["id", "keyId", "tenantId"]:
-                                    if my_id in item:
-                                        id_id = item[my_id]
-                                if id_id is not None:
-                                    if id_id not in c_obj[oop]:
-                                        c_obj[oop][id_id] = item
-                                    else:
-                                        c_obj[oop][f"{obj}-{id_id}"] = item
-                                else:
-                                    self._display(f"Could not find ID field in item: {item}", colors.get("warning", "yellow"))
-                                    k = f"{obj}-unknown_id"
-                                    if k not in c_obj[oop]:
-                                        c_obj[oop][k] = []
-                                    c_obj[oop][k].append(item)
-        if not os.path.exists(args.directory):
-            os.makedirs(args.directory)
-        lookup_data = []
-        if args.split:
-            for obj in all_objects:
-                for wg in all_objects[obj]:
-                    if args.use_namespace:
-                        for ns in all_objects[obj][wg]:
-                            filename = f"{ns}.{args.file}"
-                            data = {
-                                "namespace": obj,
-                                "group": wg,
-                                "object_type": ns,
-                                "data": all_objects[obj][wg][ns].copy()
-                            }
-                            dur = _create_dir(args.directory, wg, obj)
-                            lookup_data.append(data)
-                            _write_file(self, dur, filename, data, args)
-                    else:
-                        filename = f"{wg}.{args.file}"
-                        data = {
-                            "group": obj,
-                            "object_type": wg,
-                            "data": all_objects[obj][wg].copy()
-                        }
-                        dur = _create_dir(args.directory, obj)
-                        lookup_data.append(data)
-                        _write_file(self, dur, filename, data, args)
-        else:
-            for obj in all_objects:
-                data = {
-                    "data": all_objects[obj].copy()
-                }
-                if args.use_namespace:
-                    data["namespace"] = obj
-                else:
-                    data["group"] = obj
-                dur = _create_dir(args.directory, obj)
-                lookup_data.append(data)
-                _write_file(self, dur, args.file, data, args)
-        # self._display(exported_objects, colors.get("info", "green"))
-        if args.id_lookup:
-            l_file = args.id_lookup
-            self._display(f"Saving Lookup IDs to {l_file}", colors.get("info", "blue"))
-            _write_lookup(self, args.directory, l_file, lookup_data, args)
+        writer.close()
+        counts = export_manifest.close(prune=args.prune)
+        self._display(f"Export files: {counts['written']} written, {counts['unchanged']} unchanged, "
+                      + (f"{counts['removed']} removed" if args.prune
+                         else f"{counts['stale']} stale (use --prune to remove)"), colors.get("info", "blue"))
+        if counts["kept"] > 0:
+            self._display(f"Export files: kept {counts['kept']} files of the previous export whose download failed",
+                          colors.get("warning", "yellow"))
+        for obj_type, size in sorted(counts["reused_bytes"].items()):
+            self._display(f"Unchanged {obj_type} not downloaded again: {round(size / 1048576, 2)} MB saved",
+                          colors.get("info", "blue"))
+        if counts["gc_blobs"] > 0:
+            self._display(f"Artifact store: removed {counts['gc_blobs']} unreferenced files "
+                          f"({round(counts['gc_bytes'] / 1048576, 2)} MB)", colors.get("info", "blue"))
+        if args.archive:
+            archive, count, size = write_archive(args.directory, args.archive)
+            self._display(f"Archived {count} files to {archive} ({round(size / 1048576, 2)} MB)",
+                          colors.get("info", "blue"))
+        if state is not None:
+            _save_state(args, state)
         self._display("Export Complete", colors.get("success", "green"))
     except YAMLError as err:
         self._logger.error("YAMLError: {}".format(err))
@@ -191,11 +234,61 @@ parser = argparse.ArgumentParser(
     description='Export Cribl Configurations from a leader',
     formatter_class=argparse.ArgumentDefaultsHelpFormatter
 )
-add_arguments(parser, ["global", "objects"])
+add_arguments(parser, ["global", "objects", "transport"])
 parser.add_argument("--id-lookup",
                     help="Pass a filename to save the ids with readable names.",
                     default=None)
 parser.add_argument("--lookup-only",
                     help="Do not export objects, but only ID lookup.",
                     action="store_true")
+parser.add_argument("--workers",
+                    help="Export (source, group, object type) combinations on this many threads.",
+                    type=int,
+                    default=export_cmd["workers"])
+parser.add_argument("--incremental",
+                    help="Skip groups whose configVersion has not changed since the last export to this directory, "
+                         "reusing the files already on disk.",
+                    action="store_true")
+parser.add_argument("--since",
+                    help="Only refetch the objects stored in config files changed since this commit, reusing the "
+                         "previous export in this directory for everything else.",
+                    default=None)
+parser.add_argument("--dedupe",
+                    help=f"Write objects that are identical in several groups once, to the "
+                         f"'{export_cmd['dedupe_group']}' group with a worker_groups list.",
+                    action="store_true")
+parser.add_argument("--artifact-store",
+                    help=f"Keep packs, lookups and certificates once per content in "
+                         f"'{export_cmd['artifact_store']}' and hard link them into each group's directory.",
+                    action="store_true")
+parser.add_argument("--prune",
+                    help="Remove files left by a previous export for objects no longer on the leader.",
+                    action="store_true")
+parser.add_argument("--lookup-page-size",
+                    help="Rows requested per page when downloading lookup content.",
+                    type=int,
+                    default=export_cmd["lookup_page_size"])
+parser.add_argument("--lookup-page-workers",
+                    help="Number of lookup content pages fetched in parallel.",
+                    type=int,
+                    default=export_cmd["lookup_page_workers"])
+parser.add_argument("--gzip-lookups",
+                    help="Save lookup content as gzip-compressed CSV files.",
+                    action="store_true")
+parser.add_argument("--pack-manifest",
+                    help="Write a manifest.json with the size and sha256 of each downloaded pack.",
+                    action="store_true")
+parser.add_argument("--refresh-packs",
+                    help="Download every pack, even when its listing is unchanged since the last export.",
+                    action="store_true")
+parser.add_argument("--refresh-lookups",
+                    help="Download the content of every lookup, even when its listing is unchanged since the last "
+                         "export.",
+                    action="store_true")
+parser.add_argument("--response-cache",
+                    help="Keep listing responses on disk and revalidate them with conditional GETs on the next export.",
+                    action="store_true")
+parser.add_argument("--cache-dir",
+                    help="Directory for the on-disk response cache.",
+                    default=os.path.join(global_cache_folder, "responses"))
 parser.set_defaults(handler=_export_leader, cmd="export")
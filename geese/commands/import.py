@@ -1,13 +1,16 @@
-import json
-import os
-import yaml
 from yaml import YAMLError
 import geese.constants.exit_codes as ec
 import argparse
 import sys
 from geese.constants.common_arguments import add_arguments
-from geese.constants.configs import colors
-from geese.utils.operations import validate_args, load_configurations, filter_groups
+from geese.constants.configs import colors, export_cmd
+from geese.utils.codec import json_dumps, yaml_dump
+from geese.utils.operations import validate_args, load_configurations, filter_groups, results_file
+
+
+def _import_order(groups):
+    # Objects export --dedupe shared between groups go first, as they did in each group's own export.
+    return sorted(groups, key=lambda g: g != export_cmd["dedupe_group"])
 
 
 def _import_configurations(self, args):
@@ -27,14 +30,14 @@ def _import_configurations(self, args):
             sys.exit(ec.ALL_IS_WELL)
         else:
             self._display(f"Importing Configs to {self.destination['url']}", colors.get("info", "blue"))
-            for grp in filtered_objects:
+            for grp in _import_order(filtered_objects):
                 all_good, results[grp] = self.perform_import(filtered_objects[grp])
         if args.save:
-            with open(os.path.join(args.directory, f"{args.save_file}"), "w") as of:
+            with open(results_file(args), "w") as of:
                 if args.save_file.endswith(".json"):
-                    of.write(json.dumps(results))
+                    of.write(json_dumps(results))
                 else:
-                    yaml.safe_dump(results, of)
+                    yaml_dump(results, of)
     except YAMLError as err:
         self._logger.error("YAMLError: {}".format(err))
         self._display("YAML Error: {}".format(err), "red")
@@ -49,6 +52,8 @@ parser = argparse.ArgumentParser(
     description='Import Cribl Configurations to a leader',
     formatter_class=argparse.ArgumentDefaultsHelpFormatter
 )
-add_arguments(parser, ["global", "import", "commit", "objects"])
+add_arguments(parser, ["global", "import", "commit", "objects", "transport"])
 parser.add_argument( "--no-delete-pack", help="Do not delete the temporary pack", action="store_true")
+parser.add_argument("--gzip-uploads", help="Gzip-compress lookup files on upload (Content-Encoding: gzip)",
+                    action="store_true")
 parser.set_defaults(handler=_import_configurations, cmd="import")
@@ -1,13 +1,12 @@
-import json
-import os
-from yaml import YAMLError, safe_dump
+from yaml import YAMLError
 import geese.constants.exit_codes as ec
 import argparse
 import sys
 from geese.constants.common_arguments import add_arguments
 from geese.constants.configs import colors
+from geese.utils.codec import json_dumps, yaml_dump
 from geese.utils.operations import validate_args, load_configurations, \
-    filter_groups
+    filter_groups, results_file
 
 
 def _simulate(self, args):
@@ -18,14 +17,18 @@ def _simulate(self, args):
         all_objects = load_configurations(self, args, ko)
         filtered_objects = filter_groups(self, all_objects)
         self._display(f"Filtered Objects to validate", colors.get("info", "blue"))
-        #  TODO: FAILS TO SIMULATE
-        all_good, results = self.simulate(filtered_objects)
+        results = {}
+        all_good = True
+        for grp in filtered_objects:
+            group_good, results[grp] = self.simulate(filtered_objects[grp])
+            all_good = all_good and group_good
+        self._logger.debug(f"action=simulate_import groups={len(results)} all_good={all_good}")
         if args.save:
-            with open(os.path.join(args.directory, f"{args.save_file}"), "w") as of:
+            with open(results_file(args), "w") as of:
                 if args.save_file.endswith(".json"):
-                    of.write(json.dumps(results))
+                    of.write(json_dumps(results))
                 else:
-                    safe_dump(results, of)
+                    yaml_dump(results, of)
         # self._display(exported_objects, colors.get("info", "green"))
     except YAMLError as err:
         self._logger.error("YAMLError: {}".format(err))
@@ -1,15 +1,14 @@
-import json
 import os
-import yaml
-from yaml import YAMLError, safe_dump
+from yaml import YAMLError
 import geese.constants.exit_codes as ec
 import argparse
 import sys
 from geese.constants.common_arguments import add_arguments
 from geese.constants.configs import colors
 from geese.constants.api_specs import api_specs
+from geese.utils.codec import json_dumps, yaml_dump, yaml_load
 from geese.utils.operations import  validate_args, load_configurations, \
-    filter_groups
+    filter_groups, results_file
 
 
 def _validate(self, args):
@@ -27,18 +26,18 @@ def _validate(self, args):
                                 f"{args.api_version}.yaml")
         self._display(f"Loading Spec {args.api_version}", colors.get("info", "blue"))
         with open(api_spec, "r") as of:
-            spec = yaml.safe_load(of)
+            spec = yaml_load(of)
             self.load_spec(spec)
             self.spec_file = api_spec
         self._display(f"Loading Spec {args.api_version}: Complete", colors.get("info", "blue"))
         self._display(f"Validating Cribl Working Group Configs: {', '.join(list(filtered_objects.keys()))}", colors.get("info", "blue"))
         all_good, results = self.validate(filtered_objects)
         if args.save:
-            with open(os.path.join(args.directory, f"{args.save_file}"), "w") as of:
+            with open(results_file(args), "w") as of:
                 if args.save_file.endswith(".json"):
-                    of.write(json.dumps(results))
+                    of.write(json_dumps(results))
                 else:
-                    safe_dump(results, of)
+                    yaml_dump(results, of)
         self._display("Validation Complete", colors.get("info", "green"))
     except YAMLError as err:
         self._logger.error("YAMLError: {}".format(err))
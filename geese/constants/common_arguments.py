@@ -22,6 +22,14 @@ global_arguments = {
     "--config": {
         "help": "Path to the configuration file",
         "default": "./config.yaml"
+    },
+    "--no-token-cache": {
+        "help": "Log in to every leader instead of reusing cached auth tokens",
+        "action": 'store_true'
+    },
+    "--no-fast-codecs": {
+        "help": "Read and write YAML and JSON with the pure Python codecs instead of libyaml and orjson",
+        "action": 'store_true'
     }
 }
 
@@ -44,6 +52,15 @@ selective_arguments = {
             "help": "Save the results of the validation to this directory",
             "default": export_cmd["directory"]
         },
+        "--no-listing-cache": {
+            "help": "Re-list the destination objects for every item instead of once per group and object type",
+            "action": "store_true"
+        },
+        "--fanout-workers": {
+            "help": "Import an item listing several worker_groups into this many groups at a time",
+            "type": int,
+            "default": import_cmd["fanout_workers"]
+        },
     },
     "commit": {
         "--commit-message": {
@@ -58,6 +75,18 @@ selective_arguments = {
             "action": "store_true"
         }
     },
+    "transport": {
+        "--async-io": {
+            "help": "Run leader requests concurrently from an asyncio event loop",
+            "action": "store_true"
+        },
+        "--max-in-flight": {
+            "help": "Maximum number of concurrent leader requests when using --async-io "
+                    "(default: the pool_size of the leaders, which is raised to match when smaller)",
+            "type": int,
+            "default": None
+        },
+    },
     "objects": {
         "--list-objects": {
             "help": "Show all objects available to the command",
@@ -100,6 +129,11 @@ selective_arguments = {
             "help": "Filename to read from or write to.",
             "default": export_cmd["file"]
         },
+        "--archive": {
+            "help": "Export archive (.tar.zst, .tar.gz or .tar) to write after exporting, or to read configurations, "
+                    "packs and lookups from instead of --directory.",
+            "default": None
+        },
     }
 }
 
@@ -2,6 +2,9 @@ import os
 
 global_log_folder = ".logs"
 global_log_filename = "geese.log"
+global_cache_folder = ".cache"
+# Per-user cache for credentials (auth tokens), kept out of the working directory so it is never committed.
+user_cache_folder = os.path.join(os.environ.get("XDG_CACHE_HOME", None) or os.path.expanduser("~/.cache"), "geese")
 colors = {
     "error": "red",
     "warn": "yellow",
@@ -15,11 +18,20 @@ import_cmd = {
     "resolve_conflict": "update",
     "directory": os.path.join(root_folder),
     "file": "objects.yaml",
-    "save_file": "results.yaml"
+    "save_file": "results.yaml",
+    "fanout_workers": 4
 }
 export_cmd = {
     "directory": os.path.join(root_folder),
-    "file": "objects.yaml"
+    "file": "objects.yaml",
+    "lookup_page_size": 10000,
+    "lookup_page_workers": 1,
+    "workers": 1,
+    "state_file": ".geese_export_state.json",
+    "manifest_file": ".geese_export_manifest.json",
+    "dedupe_group": "_shared",
+    "artifact_store": ".geese-artifacts",
+    "unversioned_objects": ["groups"]
 }
 simulate_cmd = {
     "directory": os.path.join(root_folder),
@@ -1,5 +1,7 @@
 import re
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from copy import deepcopy
 from geese.knowledge import Outputs, Pipelines, Certificates, Secrets, Keys, AuthConfig, Routes, Inputs
 from geese.knowledge import CollectorJobs, GlobalVariables, Parsers, Regexes, GrokFiles, Schemas
@@ -8,19 +10,31 @@ from geese.knowledge import Mappings, Notifications, NotificationTargets, Parque
 from geese.knowledge import Authentication, Versioning, SrchRegexes, SrchGrok, SrchUsageGroups, SrchDatasetProviders
 from geese.knowledge import SrchDatasets, SrchSearches, SrchMacros, SrchParsers, SrchDashboards, SrchDashboardCategories
 from geese.utils.operations import validate_knowledge, validate
+from geese.utils.sessions import close_sessions
+from geese.utils.retry import get_stats as get_retry_stats
+from geese.utils.circuit import get_stats as get_breaker_stats
+from geese.utils.governor import get_stats as get_governor_stats
+from geese.utils.transport import AsyncTransport, set_transport, size_pools
+from geese.utils.listing_cache import listing_cache
+from geese.utils.response_cache import response_cache
+from geese.utils.token_cache import token_cache
+from geese.utils.archive import archive_files
+from geese.utils import codec
 from geese.KennyLoggins import KennyLoggins
 import os
 import sys
-import yaml
 import logging as logger
 from termcolor import colored
 import geese.constants.exit_codes as ec
 from deepmerge import always_merger
 import urllib3
-from geese.constants.configs import colors
+from geese.constants.configs import colors, user_cache_folder
 
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
+# Upper bound on leaders logged in to and probed concurrently at startup.
+bootstrap_workers = 16
+
 
 def display(message, color="blue"):
     print(colored(f"{message}", colors.get(color, "blue")))
@@ -33,7 +47,10 @@ class Goose(object):
 
     def __init__(self, cmd, args, **kwargs):
         kl = KennyLoggins()
+        self._output = threading.local()
+        self._reuse = {}
         self._cwd = os.getcwd()
+        codec.configure(not getattr(args, "no_fast_codecs", False))
         self._args = args
         self._cmd = cmd
         self._edir = os.path.dirname(__file__)
@@ -44,14 +61,14 @@ class Goose(object):
         # Set the logger to propagate errors to console.
         self._logger.propagate = args.propagate or False
         with open(self._get_asset_location(["constants", "base_config.yaml"]), "r") as f:
-            self.base_config = yaml.safe_load(f)
+            self.base_config = codec.yaml_load(f)
         self.sources = []
         self.destination = deepcopy(self.base_config["destination"])
         self.tuning_object = {}
         if args.config:
             try:
                 with open(args.config, "r") as f:
-                    yaml_config = yaml.safe_load(f)
+                    yaml_config = codec.yaml_load(f)
                     if "source" in yaml_config and yaml_config["source"] and len(yaml_config["source"]) > 0:
                         [self.sources.append(y) for y in
                          [self._create_source(x, i) for i, x in enumerate(yaml_config["source"])] if y is not None]
@@ -66,15 +83,22 @@ class Goose(object):
                 self._display_error("File Not Found", e, ec.FILE_NOT_FOUND)
         self._check_env_vars()
         self._log_level = default_log_level
-        if self.destination and self.destination["enabled"]:
-            self.destination["token"] = self._get_source_token(self.destination)
-        else:
+        if not getattr(args, "no_token_cache", False):
+            token_cache.configure(os.path.join(user_cache_folder, "tokens.json"))
+        if not (self.destination and self.destination["enabled"]):
             self.destination = None
-        for i, src in enumerate(self.sources):
-            if src["enabled"]:
-                src["token"] = self._get_source_token(src)
-                self.sources[i] = self._check_groups_config(src)
+        self._transport = None
+        if getattr(args, "async_io", False):
+            leaders = self.sources + ([self.destination] if self.destination else [])
+            max_in_flight = size_pools(leaders, getattr(args, "max_in_flight", None))
+            self._transport = set_transport(AsyncTransport(max_in_flight))
+        self._bootstrap()
         self._execute = args.handler
+        listing_cache.enabled = cmd in ["simulate", "import"] and not getattr(args, "no_listing_cache", False)
+        if getattr(args, "response_cache", False):
+            response_cache.configure(args.cache_dir)
+        if cmd in ["import", "validate", "simulate"] and getattr(args, "archive", None):
+            archive_files.configure(args.archive)
         self.use_namespace = args.use_namespace if len(self.sources) > 1 and hasattr(args, 'use_namespace') else False
         for ds in [Groups, Pipelines, Outputs, Inputs, CollectorJobs, GlobalVariables, Mappings, Parsers, Regexes,
                    GrokFiles, Schemas, ParquetSchemas, DatabaseConnections, Notifications,
@@ -84,6 +108,34 @@ class Goose(object):
                    SrchDatasetProviders]:
             self.objects[ds.obj_type] = ds
 
+    def _bootstrap(self):
+        """
+        Logs in to the destination and every enabled source, and discovers source worker groups, concurrently.
+        """
+        started = time.monotonic()
+        sources = {i: src for i, src in enumerate(self.sources) if src["enabled"]}
+        workers = max(1, min(len(sources) + 1, bootstrap_workers))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="geese-bootstrap") as executor:
+            destination = executor.submit(self._bootstrap_leader, self.destination, False) if self.destination else None
+            futures = {i: executor.submit(self._bootstrap_leader, src, True) for i, src in sources.items()}
+        if destination is not None:
+            self.destination = destination.result()
+        for i, future in futures.items():
+            self.sources[i] = future.result()
+        self._dbg(action="bootstrap", leaders=len(futures) + (1 if destination is not None else 0),
+                  seconds=round(time.monotonic() - started, 3))
+
+    def _bootstrap_leader(self, leader, is_source):
+        started = time.monotonic()
+        leader["token"] = self._get_source_token(leader)
+        authenticated = time.monotonic()
+        if is_source:
+            leader = self._check_groups_config(leader)
+        self._dbg(action="bootstrap_leader", url=leader["url"], namespace=leader.get("namespace", None),
+                  auth_seconds=round(authenticated - started, 3),
+                  groups_seconds=round(time.monotonic() - authenticated, 3))
+        return leader
+
     def _check_groups_config(self, svr):
         if "worker_groups" in svr:
             self._logger.info(f'msg="worker_groups_present result="will_not_override" groups="{",".join(svr["worker_groups"])}"')
@@ -95,10 +147,49 @@ class Goose(object):
             self._logger.debug(f"svr_groups={grps} svr_groups_len={len(grps)}")
             if len(grps) > 0:
                 svr["worker_groups"] = [g["id"] for g in grps if g.get("id", None) is not None]
+                svr["group_versions"] = {g["id"]: g.get("configVersion", None) for g in grps
+                                         if g.get("id", None) is not None}
             else:
                 svr["worker_groups"] = ["default"]
         return svr
 
+    def group_versions(self, source):
+        """
+        Returns {group id: configVersion} for a source, listing its groups if that was not done at startup.
+        """
+        if "group_versions" not in source:
+            grps = Groups(source, logger=self._logger, log_level=self._log_level, namespace=source.get("namespace"))
+            source["group_versions"] = {g["id"]: g.get("configVersion", None) for g in grps.export()
+                                        if g.get("id", None) is not None}
+        return source["group_versions"]
+
+    def reuse(self, source, group, items):
+        """
+        Serves the object types in `items` for this source and group from `items` instead of the leader.
+        """
+        self._reuse[(source.get("namespace", None), group)] = items
+
+    def is_reused(self, source, group):
+        return (source.get("namespace", None), group) in self._reuse
+
+    def changed_files(self, source, group, since):
+        """
+        Returns the config files of a group changed since commit `since`, or None when the leader cannot tell.
+        """
+        versioning = Versioning(source, self._args, self._logger, group=group, display=self._display)
+        return versioning.changed_files(since)
+
+    def get_ids(self, func, source, group, ids):
+        """
+        Fetches single items of object type `func` by id, returns (items, ids no longer on the leader).
+        """
+        self._display(f"Getting Source: {source['url']} ({func}: {', '.join(sorted(ids))}) [{group}]",
+                      colors.get("info", "blue"))
+        knowledge = self.objects[func](source, self._args, self._logger, group=group, display=self._display,
+                                       validate_spec=self.validate_spec, spec_file=self.spec_file)
+        items, missing = knowledge.export_ids(sorted(ids))
+        return [i for i in items if validate(func, i, self.tuning_object)], missing
+
     def _repl_env_vars(self, obj, os_env_keys):
         errors= []
         for k,v in obj.items():
@@ -146,9 +237,7 @@ class Goose(object):
             src_cribl_auth_token = None
             if source["is_cloud"] is False:
                 # call on-prem leader API for auth token
-                self._logger.debug("Artificial Sleep of 1 second.")
-                time.sleep(1)
-                src_cribl_auth_token, response = auth_obj.api_get_auth_data()
+                src_cribl_auth_token, response = auth_obj.get_token()
                 if src_cribl_auth_token is None:
                     raise Exception(f"Unable to retrieve on-prem token. {source['orig_url']} API response: {response}")
             else:
@@ -160,7 +249,7 @@ class Goose(object):
                         "Cribl.cloud client id and/or secret found in configuration, but value is empty. Ensure"
                         f" the values are present.\nServer Config:\n\t{source}")
                 else:
-                    src_cribl_auth_token, response = auth_obj.get_cloud_access_token()
+                    src_cribl_auth_token, response = auth_obj.get_token()
                     if src_cribl_auth_token is None:
                         raise Exception(
                             f"Unable to retrieve access token from cribl.cloud instance {source['orig_url']}. Response: {response}")
@@ -188,7 +277,11 @@ class Goose(object):
         return os.path.join(self._edir, *path)
 
     def _display(self, message, color=None, **kwargs):
-        print(colored(f"{message}", color, **kwargs))
+        lines = getattr(self._output, "lines", None)
+        if lines is not None:
+            lines.append((message, color, kwargs))
+        else:
+            print(colored(f"{message}", color, **kwargs))
         self._logger.info(f"action=display_message message=\"{message}\"")
 
     def _display_error(self, msg, err, exit_code=-1):
@@ -237,8 +330,51 @@ class Goose(object):
             ]
             self._display('\n\t'.join(msgs), colors["error"])
             sys.exit(ec.INVALID_COMMAND_PARAMETERS)
+        finally:
+            self._run_summary()
+            close_sessions()
+
+    def _run_summary(self):
+        if response_cache.enabled:
+            stats = response_cache.stats
+            self._inform(action="run_summary", cache="response", **stats)
+            self._display(f"Response cache: {stats['revalidated']} served from disk (304), "
+                          f"{stats['unchanged']} unchanged, {stats['changed']} changed, {stats['new']} new, "
+                          f"{round(stats['bytes_saved'] / 1048576, 2)} MB not downloaded",
+                          colors.get("info", "blue"))
+        if listing_cache.enabled:
+            self._inform(action="run_summary", cache="listing", **listing_cache.stats)
+            self._display(f"Listing cache: {listing_cache.stats['misses']} listings fetched, "
+                          f"{listing_cache.stats['hits'] + listing_cache.stats['coalesced']} served from cache",
+                          colors.get("info", "blue"))
+        for leader, counters in get_breaker_stats().items():
+            self._inform(action="run_summary", leader=leader, **counters)
+            if counters["opened"] > 0:
+                self._display(f"Circuit breaker for {leader} opened {counters['opened']} time(s), "
+                              f"{counters['short_circuited']} request(s) failed fast"
+                              f"{' and it is still open' if counters['open'] else ''}",
+                              colors.get("error", "red"))
+        for leader, counters in get_governor_stats().items():
+            self._inform(action="run_summary", leader=leader, **counters)
+            if counters["decreases"] > 0:
+                self._display(f"Concurrency against {leader} backed off {counters['decreases']} time(s) "
+                              f"({counters['throttled']} throttled responses), peak {counters['peak_limit']}, "
+                              f"final {counters['limit']} requests in flight",
+                              colors.get("warning", "yellow"))
+        for leader, counters in get_retry_stats().items():
+            self._inform(action="run_summary", leader=leader, **counters)
+            if counters["retries"] > 0:
+                self._display(f"Retries against {leader}: {counters['retries']} "
+                              f"(recovered: {counters['recovered']}, exhausted: {counters['exhausted']})",
+                              colors.get("warning", "yellow"))
+
+    def get(self, knowledge=None, restrict_sources=None, sink=None):
+        """
+        Exports `knowledge` from the sources, keyed by namespace, group and object type.
 
-    def get(self, knowledge=None, restrict_sources=None):
+        When `sink` is given, each batch is passed to `sink(namespace, group, object type, items)` as soon as it
+        is ready, in the same order as a serial export, instead of being kept in the returned dict.
+        """
         try:
             valid_source = [s["namespace"] for s in self.sources]
             if restrict_sources:
@@ -248,33 +384,124 @@ class Goose(object):
                 knowledge = []
             self._logger.debug(f"action=get_knowledge valid_sources={','.join(valid_source)}")
             ret_objs = {}
+            selected = []
             for s in self.sources:
                 if s["namespace"] not in valid_source:
                     self._display(f"Ignoring Source: {s['namespace']}", colors.get("error", "red"))
                 else:
-                    ret_objs[s["namespace"]] = self._get_source(knowledge, s)
+                    selected.append(s)
+            workers = getattr(self._args, "workers", 1) or 1
+            if self._transport is not None:
+                source_objs = self._transport.run(self._aget_sources(knowledge, selected))
+                for i, s in enumerate(selected):
+                    if sink is None:
+                        ret_objs[s["namespace"]] = source_objs[i]
+                        continue
+                    for key, kos in source_objs[i].items():
+                        for func, data in kos.items():
+                            sink(s["namespace"], key, func, data)
+            elif workers > 1:
+                source_objs = self._get_sources_pooled(knowledge, selected, workers, sink=sink)
+                for i, s in enumerate(selected):
+                    ret_objs[s["namespace"]] = source_objs[i]
+            else:
+                for s in selected:
+                    ret_objs[s["namespace"]] = self._get_source(knowledge, s, sink=sink)
             return ret_objs
         except Exception as e:
             self._display_error(f"Get Error: {knowledge}", e)
 
-    def _get_source(self, knowledge, source):
-        kos = {}
-        self._display(f"Gathering Knowledge Objects: {source.get('namespace')}", colors.get("info", "blue"))
+    def _source_knowledge(self, knowledge):
+        return [x for x in knowledge if x in self.objects and validate_knowledge(x, self.tuning_object)]
+
+    @staticmethod
+    def _source_targets(source):
+        # (display label, result key, group passed to the knowledge object)
+        targets = []
         if "worker_groups" in source:
             for group in source["worker_groups"]:
-                self._display(f"\tWorker Group: {group}", colors.get("info", "blue"))
-                kos[group] = {x: self._get(x, source, group=group) for x in knowledge if
-                              x in self.objects and validate_knowledge(x, self.tuning_object)}
+                targets.append((f"Worker Group: {group}", group, group))
         if "fleets" in source:
             for fleet in source["fleets"]:
-                self._display(f"\tFleet: {fleet}", colors.get("info", "blue"))
-                if fleet in kos:
-                    fleet = f"fleet-{fleet}"
-                kos[fleet] = {x: self._get(x, source, group=fleet) for x in knowledge if
-                              x in self.objects and validate_knowledge(x, self.tuning_object)}
+                key = f"fleet-{fleet}" if fleet in [t[1] for t in targets] else fleet
+                targets.append((f"Fleet: {fleet}", key, key))
         if "worker_groups" not in source and "fleets" not in source:
-            kos["default"] = {x: self._get(x, source) for x in knowledge if
-                              x in self.objects and validate_knowledge(x, self.tuning_object)}
+            targets.append((None, "default", None))
+        return targets
+
+    def _get_source(self, knowledge, source, sink=None):
+        kos = {}
+        self._display(f"Gathering Knowledge Objects: {source.get('namespace')}", colors.get("info", "blue"))
+        funcs = self._source_knowledge(knowledge)
+        for label, key, group in self._source_targets(source):
+            if label:
+                self._display(f"\t{label}", colors.get("info", "blue"))
+            if sink is None:
+                kos[key] = {x: self._get(x, source, group=group) for x in funcs}
+                continue
+            for x in funcs:
+                sink(source.get("namespace"), key, x, self._get(x, source, group=group))
+        return kos
+
+    def _get_sources_pooled(self, knowledge, sources, workers, sink=None):
+        """
+        Fans (source, group, object type) exports out over a pool of `workers` threads.
+
+        The console output of each task is buffered and printed in the same order as a serial export,
+        as soon as the task and all the tasks before it have finished.
+        """
+        funcs = self._source_knowledge(knowledge)
+        tasks = []
+        for i, source in enumerate(sources):
+            for label, key, group in self._source_targets(source):
+                for func in funcs:
+                    tasks.append((i, label, key, func, source, group))
+        results = [{} for _ in sources]
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="geese-export") as executor:
+            futures = [executor.submit(self._buffered, self._get, func, source, group=group)
+                       for i, label, key, func, source, group in tasks]
+            shown = set()
+            for n, (i, label, key, func, source, group) in enumerate(tasks):
+                if i not in shown:
+                    self._display(f"Gathering Knowledge Objects: {source.get('namespace')}",
+                                  colors.get("info", "blue"))
+                    shown.add(i)
+                if label and (i, key) not in shown:
+                    self._display(f"\t{label}", colors.get("info", "blue"))
+                    shown.add((i, key))
+                data, output = futures[n].result()
+                # Let go of the finished task so its items are not held until the whole export is done.
+                futures[n] = None
+                for message, color, kwargs in output:
+                    print(colored(f"{message}", color, **kwargs))
+                if sink is None:
+                    results[i].setdefault(key, {})[func] = data
+                else:
+                    sink(source.get("namespace"), key, func, data)
+        return results
+
+    def _buffered(self, func, *args, **kwargs):
+        self._output.lines = []
+        try:
+            return func(*args, **kwargs), self._output.lines
+        finally:
+            self._output.lines = None
+
+    async def _aget_sources(self, knowledge, sources):
+        return await self._transport.gather(*[self._aget_source(knowledge, s) for s in sources])
+
+    async def _aget_source(self, knowledge, source):
+        kos = {}
+        self._display(f"Gathering Knowledge Objects: {source.get('namespace')}", colors.get("info", "blue"))
+        funcs = self._source_knowledge(knowledge)
+        targets = self._source_targets(source)
+        for label, key, group in targets:
+            if label:
+                self._display(f"\t{label}", colors.get("info", "blue"))
+        data = iter(await self._transport.gather(*[self._aget(x, source, group=group)
+                                                   for label, key, group in targets for x in funcs]))
+        for label, key, group in targets:
+            kos[key] = {x: next(data) for x in funcs}
         return kos
 
     @staticmethod
@@ -289,7 +516,7 @@ class Goose(object):
             obj_type = conf_obj.get_ot()
             self._display(f"\t\tPerforming Operation: '{operation}' on '{obj_type}'", colors.get("info", "blue"))
             if operation == "export":
-                return conf_obj.export()
+                return conf_obj.inventory() if getattr(self._args, "lookup_only", False) else conf_obj.export()
             elif operation == "import":
                 return conf_obj.update(item)
             elif operation == "simulate":
@@ -305,6 +532,11 @@ class Goose(object):
     def _get(self, func, source, group=None, fleet=None):
         try:
             data = []
+            reused = self._reuse.get((source.get("namespace", None), group), {})
+            if func in reused:
+                self._display(f"Reusing previous export: {source['url']} ({func}) [{group}]",
+                              colors.get("info", "blue"))
+                return reused[func]
             if func in list(self.objects.keys()):
                 self._display(f"Getting Source: {source['url']} ({func}) [{group}]", colors.get("info", "blue"))
                 [data.append(g) for g in self._perform_operation(self.objects[func], "export", source,
@@ -316,6 +548,48 @@ class Goose(object):
             self._display_error(f"_get Error: {e}", e)
             return []
 
+    async def _aperform_operation(self, cls, operation, leader, group=None, fleet=None, item=None):
+        obj_type = "base"
+        try:
+            conf_obj = cls(leader, self._args, self._logger, group=group, fleet=fleet,
+                           display=self._display, validate_spec=self.validate_spec, spec_file=self.spec_file)
+            obj_type = conf_obj.get_ot()
+            self._display(f"\t\tPerforming Operation: '{operation}' on '{obj_type}'", colors.get("info", "blue"))
+            if operation == "export":
+                if getattr(self._args, "lookup_only", False):
+                    return await conf_obj.ainventory()
+                return await conf_obj.aexport()
+            elif operation == "import":
+                return await conf_obj.aupdate(item)
+            elif operation == "simulate":
+                return await conf_obj.asimulate(item)
+            elif operation == "validate":
+                return conf_obj.validate(item)
+            else:
+                self._display(f"Unhandled Item: {operation} for '{obj_type}'", colors.get("warning"))
+                return {}
+        except Exception as e:
+            self._display_error(f"Error while Executing {operation} on {obj_type}", e)
+
+    async def _aget(self, func, source, group=None, fleet=None):
+        try:
+            data = []
+            reused = self._reuse.get((source.get("namespace", None), group), {})
+            if func in reused:
+                self._display(f"Reusing previous export: {source['url']} ({func}) [{group}]",
+                              colors.get("info", "blue"))
+                return reused[func]
+            if func in list(self.objects.keys()):
+                self._display(f"Getting Source: {source['url']} ({func}) [{group}]", colors.get("info", "blue"))
+                [data.append(g) for g in await self._aperform_operation(self.objects[func], "export", source,
+                                                                        group=group, fleet=fleet) if
+                 validate(func, g, self.tuning_object)]
+                self._display(f"\tFound {len(data)} items in group [{group}]", colors.get("info", "blue"))
+            return data
+        except Exception as e:
+            self._display_error(f"_aget Error: {e}", e)
+            return []
+
     def _process_items(self, ns, item):
         if self._args.use_namespace:
             item["id"] = f"{ns}-{item['id']}"
@@ -486,6 +760,10 @@ class Goose(object):
         try:
             if self.destination is None:
                 raise Exception("Destination Leader to import is not defined")
+            if self._transport is not None:
+                results, updated_worker_groups = self._transport.run(self._aperform_import(items))
+                self._commit_groups(updated_worker_groups, results)
+                return True, {k: results[k] for k in results if len(results[k]) > 0}
             destination_groups_only = ["routes", "outputs", "inputs", "pipelines"]
             updated_worker_groups = []
             results = {}
@@ -505,17 +783,10 @@ class Goose(object):
                     import_result = {}
                     if "worker_groups" in individual_item:
                         self._display(f"\t\tItem Groups: {individual_item['worker_groups']}", colors["info"])
-                        import_result["groups"] = {}
                         item_groups = [group for group in individual_item["worker_groups"]]
                         del individual_item["worker_groups"]
-                        for group in item_groups:
-                            self._display(f"\t Importing item '{item_id}' to group '{group}'")
-                            import_result["groups"][group] = self._perform_operation(self.objects[func],
-                                                                                     "import",
-                                                                                     self.destination,
-                                                                                     group=group,
-                                                                                     item=individual_item)
-                            updated_worker_groups.append(group)
+                        import_result["groups"] = self._import_groups(func, item_id, individual_item, item_groups)
+                        updated_worker_groups += item_groups
                     elif "conf" in individual_item and "worker_groups" in individual_item["conf"]:
                         self._display(f'\t\tConf Item Groups: {individual_item["conf"]["worker_groups"]}', colors["info"])
                         import_result["groups"] = {}
@@ -547,20 +818,99 @@ class Goose(object):
                             updated_worker_groups.append(group)
                     results[func].append(import_result)
             self._dbg(action="checking for commit", item_keys=list(items.keys()))
-            if self._args.commit:
-                for wg in list(set(updated_worker_groups)):
-                    vers = Versioning(self.destination, self._args, self._logger, group=wg, fleet=None,
-                                      display=self._display)
-                    deploy = self._args.deploy and not vers.is_free()
-                    if self._args.deploy and vers.is_free():
-                        self._display("\tCannot Deploy on Free version, will just commit.", colors.get("warning", "yellow"))
-                    self._dbg(action="committing_version", group=wg, leader=self.destination["url"])
-                    results["commit"] = vers.commit(self._args.commit_message, deploy=deploy, effective=True)
+            self._commit_groups(updated_worker_groups, results)
             return True, {k: results[k] for k in results if len(results[k]) > 0}
         except Exception as e:
             self._display_error("Import Error", e)
             return False, {}
 
+    def _import_groups(self, func, item_id, item, groups):
+        """
+        Imports one item into each of `groups`, up to `--fanout-workers` groups at a time. Each group gets its
+        own copy of the item, and the console output is printed in group order.
+        """
+        workers = min(len(groups), getattr(self._args, "fanout_workers", 1) or 1)
+        if workers <= 1:
+            return {group: self._import_group(func, item_id, item, group) for group in groups}
+        results = {}
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="geese-fanout") as executor:
+            futures = [executor.submit(self._buffered, self._import_group, func, item_id, deepcopy(item), group)
+                       for group in groups]
+            for group, future in zip(groups, futures):
+                results[group], output = future.result()
+                for message, color, kwargs in output:
+                    print(colored(f"{message}", color, **kwargs))
+        return results
+
+    def _import_group(self, func, item_id, item, group):
+        self._display(f"\t Importing item '{item_id}' to group '{group}'")
+        return self._perform_operation(self.objects[func], "import", self.destination, group=group, item=item)
+
+    def _commit_groups(self, updated_worker_groups, results):
+        if self._args.commit:
+            for wg in list(set(updated_worker_groups)):
+                vers = Versioning(self.destination, self._args, self._logger, group=wg, fleet=None,
+                                  display=self._display)
+                deploy = self._args.deploy and not vers.is_free()
+                if self._args.deploy and vers.is_free():
+                    self._display("\tCannot Deploy on Free version, will just commit.", colors.get("warning", "yellow"))
+                self._dbg(action="committing_version", group=wg, leader=self.destination["url"])
+                results["commit"] = vers.commit(self._args.commit_message, deploy=deploy, effective=True)
+
+    async def _aperform_import(self, items):
+        # Items of one type are applied in order within a group (routes are read-modify-write),
+        # while the groups themselves are imported concurrently.
+        destination_groups_only = ["routes", "outputs", "inputs", "pipelines"]
+        updated_worker_groups = []
+        results = {}
+        self._dbg(action="importing_items", item_keys=list(items.keys()), destination=self.destination,
+                  transport="async")
+        for func in [i for i in items if i in list(self.objects.keys())]:
+            if len(items[func]) > 0:
+                self._display(f"Importing {func} configurations: {len(items[func])}", colors["info"])
+            if func not in results:
+                results[func] = []
+            lanes = {}
+            for individual in items[func]:
+                individual_item = items[func][individual] if isinstance(individual, str) else individual
+                item_id = individual_item["id"] if "id" in individual_item else "UnKnown ID Param"
+                import_result = {}
+                targets = []
+                if "worker_groups" in individual_item:
+                    self._display(f"\t\tItem Groups: {individual_item['worker_groups']}", colors["info"])
+                    import_result["groups"] = {}
+                    targets += [("groups", group) for group in individual_item["worker_groups"]]
+                    del individual_item["worker_groups"]
+                elif "conf" in individual_item and "worker_groups" in individual_item["conf"]:
+                    self._display(f'\t\tConf Item Groups: {individual_item["conf"]["worker_groups"]}', colors["info"])
+                    import_result["groups"] = {}
+                    targets += [("groups", group) for group in individual_item["conf"]["worker_groups"]]
+                elif func not in destination_groups_only:
+                    targets.append((None, None))
+                else:
+                    self._display(f"\t\tUnknown Issue with item '{item_id}': {','.join(list(individual_item.keys()))}",
+                                  colors.get("warning", "yellow"))
+                if "worker_groups" in self.destination:
+                    import_result["dest_groups"] = {}
+                    targets += [("dest_groups", group) for group in self.destination["worker_groups"]]
+                for slot, group in targets:
+                    lanes.setdefault(group if group is not None else "default", []).append(
+                        (import_result, slot, group, individual_item, item_id))
+                    updated_worker_groups.append(group if group is not None else "default")
+                results[func].append(import_result)
+            await self._transport.gather(*[self._aimport_lane(func, lane) for lane in lanes.values()])
+        return results, updated_worker_groups
+
+    async def _aimport_lane(self, func, lane):
+        for import_result, slot, group, individual_item, item_id in lane:
+            self._display(f"\t Importing item '{item_id}' to group '{group}'")
+            result = await self._aperform_operation(self.objects[func], "import", self.destination,
+                                                    group=group, item=individual_item)
+            if slot is None:
+                import_result.update(result if isinstance(result, dict) else {})
+            else:
+                import_result[slot][group] = result
+
     def _inform(self, **kwargs):
         st = f"{kwargs}"
         if type(kwargs) is dict:
@@ -1,6 +1,7 @@
 import os
 
 from geese.knowledge.base import BaseKnowledge
+from geese.utils.token_cache import token_cache, token_expiry, credential_key
 
 
 class Authentication(BaseKnowledge):
@@ -55,3 +56,30 @@ class Authentication(BaseKnowledge):
                 return None, response.json()
         except Exception as e:
             self._display_error("Unhandled get_cloud_access_token Exception", e)
+
+    def _credential_key(self):
+        if self.leader.get("is_cloud", False) is False:
+            return credential_key(self.leader, self._get_auth_env("username"), self._get_auth_env("password"))
+        return credential_key(self.leader, self._get_auth_env("client_id"), self._get_auth_env("client_secret"))
+
+    def login(self):
+        if self.leader.get("is_cloud", False) is False:
+            return self.api_get_auth_data()
+        return self.get_cloud_access_token()
+
+    def get_token(self, use_cache=True):
+        """
+        Returns a (token, login response) tuple, reusing a cached, unexpired token when allowed.
+        The response is None when the token came from the cache.
+        """
+        key = self._credential_key()
+        if use_cache:
+            token = token_cache.get(key)
+            if token is not None:
+                self._log("info", action="get_token", url=self.url, cached=True)
+                return token, None
+        token, response = self.login()
+        if token is not None:
+            token_cache.put(key, token, token_expiry(token, response))
+        self._log("info", action="get_token", url=self.url, cached=False, success=token is not None)
+        return token, response
@@ -1,13 +1,25 @@
 import copy
 import os
 import sys
-import requests
 import json
+import time
+import requests
+from urllib.parse import quote
 
 from jsonschema.exceptions import ValidationError
 from openapi_schema_validator import validate
 from deepdiff import DeepDiff
 from termcolor import colored
+from geese.utils.archive import archive_files
+from geese.utils.files import gzip_file
+from geese.utils.sessions import get_session
+from geese.utils.retry import RetryPolicy, record as record_retry
+from geese.utils.circuit import CircuitOpenError, get_breaker, is_failure
+from geese.utils.governor import free_on_close, get_governor
+from geese.utils.transport import get_transport
+from geese.utils.listing_cache import listing_cache
+from geese.utils.response_cache import response_cache
+from geese.utils.token_cache import token_cache
 
 
 class BaseKnowledge:
@@ -75,10 +87,13 @@ class BaseKnowledge:
         dur = os.path.join(base_dir, grp, ko_type)
         if self.args.use_namespace:
             dur = os.path.join(base_dir, self.leader["namespace"], grp, ko_type)
-        if not os.path.exists(dur):
-            os.makedirs(dur)
+        os.makedirs(dur, exist_ok=True)
         return dur
 
+    def _export_source(self):
+        # (namespace, group, object type) of the files saved by an export, as recorded in the export manifest.
+        return self.leader.get("namespace", None), self.group if self.group else "default", self.obj_type
+
     def _display_error(self, msg, err, exit_code=False):
         emsg, fname, fnum, etype = self.get_exception_info(err)
         erre = [
@@ -126,6 +141,34 @@ class BaseKnowledge:
         self._log("debug", action="Export", message="base_implementation")
         return []
 
+    def inventory(self):
+        """
+        Lists the items for `export --lookup-only`, which only needs their ids, names and descriptions.
+        Object types that download files or make extra calls per item override this with a listing only.
+        """
+        return self.export()
+
+    def export_ids(self, ids):
+        """
+        Fetches single items by id instead of listing the whole object type.
+
+        :param ids: Item ids to fetch
+        :return: Tuple of ([items found], [ids the leader no longer has])
+        """
+        items = []
+        missing = []
+        for item_id in ids:
+            result = self.get(self._endpoint_by_id(quote(f"{item_id}", safe="")))
+            if result.status_code == 404:
+                missing.append(item_id)
+            elif result.status_code == 200:
+                items.extend(result.json().get("items", []))
+            else:
+                raise IOError(f"Could not fetch {self.obj_type} {item_id}: {result.status_code} {result.text}")
+        self._log("info", action=f"export_{self.obj_type}_ids", source_url=self.url, source_group=self.group,
+                  count=len(items), missing=len(missing))
+        return items, missing
+
     def _load_spec(self, spec_name=None):
         s = None
         if spec_name:
@@ -174,8 +217,120 @@ class BaseKnowledge:
     def _build_endpoint(self, endpoint):
         return f"{self.url}/{endpoint if endpoint is not None else ''}"
 
+    def _request(self, method, url, **kwargs):
+        response = None
+        try:
+            response = self._send(method, url, **kwargs)
+            return response
+        finally:
+            if method != "GET" and listing_cache.enabled:
+                listing_cache.written(self.url, url, method, data=kwargs.get("data", None), response=response)
+
+    def _send(self, method, url, **kwargs):
+        session = get_session(url, pool_size=self.leader.get("pool_size", None))
+        policy = RetryPolicy.for_leader(self.leader)
+        body = kwargs.get("data", None)
+        body_start = body.tell() if hasattr(body, "seek") and hasattr(body, "tell") else None
+        replayable = body is None or isinstance(body, (str, bytes)) or body_start is not None
+        breaker = get_breaker(self.leader, url)
+        if not breaker.allow():
+            self._log("warn", action="circuit_open", method=method, url=url)
+            raise CircuitOpenError(f"Circuit breaker open for {self.url} after {breaker.consecutive} consecutive "
+                                   f"failures, not sending {method} {url}")
+        try:
+            kwargs.setdefault("timeout", self._timeout(kwargs))
+            governor = get_governor(self.leader, url)
+            started = time.monotonic()
+            attempt = 0
+            refreshed = False
+            while True:
+                response = None
+                error = None
+                governor.acquire(self.obj_type)
+                sent = time.monotonic()
+                try:
+                    response = session.request(method, url, verify=self.verify_ssl, **kwargs)
+                except requests.exceptions.RequestException as e:
+                    error = e
+                finally:
+                    # The body of a streamed download is read after this returns, it keeps its slot until closed.
+                    hold = response is not None and kwargs.get("stream", False) and response.status_code in [200, 206]
+                    governor.release(self.obj_type, time.monotonic() - sent,
+                                     response.status_code if response is not None else None,
+                                     profile=(self.obj_type, method, kwargs.get("stream", False)), hold=hold)
+                    if hold:
+                        free_on_close(response, governor, self.obj_type)
+                if (response is not None and response.status_code == 401 and replayable and not refreshed
+                        and self._refresh_token(kwargs)):
+                    # The token expired mid-run, replay once with a fresh one.
+                    refreshed = True
+                    response.close()
+                    if body_start is not None:
+                        body.seek(body_start)
+                    continue
+                delay = policy.next_delay(method, attempt, started, response=response, error=error) \
+                    if replayable else None
+                if delay is None:
+                    if attempt > 0:
+                        failed = error is not None or policy.is_retryable(method, response=response)
+                        record_retry(url, "exhausted" if failed else "recovered")
+                    if is_failure(response, error):
+                        breaker.failure()
+                    else:
+                        # The leader answered, or the request failed on our side.
+                        breaker.success()
+                    if error is not None:
+                        raise error
+                    return response
+                record_retry(url, "retries")
+                self._log("warn", action="retry_request", method=method, url=url, attempt=attempt + 1,
+                          status=response.status_code if response is not None else None, error=error,
+                          delay=round(delay, 2))
+                if response is not None:
+                    response.close()
+                time.sleep(delay)
+                if body_start is not None:
+                    body.seek(body_start)
+                attempt += 1
+        finally:
+            # A trial request let through by an open breaker that ended without an outcome (e.g. interrupted)
+            # must not keep the breaker waiting for it.
+            breaker.release_trial()
+
+    def _timeout(self, kwargs):
+        """
+        (connect, read) timeout for a request. Streamed downloads and file uploads use the leader's
+        `transfer` timeout as the read timeout, everything else uses `read`.
+        """
+        conf = self.leader.get("timeouts", None) or {}
+        transfer = kwargs.get("stream", False) or hasattr(kwargs.get("data", None), "read")
+        return conf.get("connect", None), conf.get("transfer" if transfer else "read", None)
+
+    def _refresh_token(self, kwargs):
+        headers = kwargs.get("headers", None)
+        if not headers or "Authorization" not in headers:
+            return False
+        # Imported here, Authentication is itself a BaseKnowledge.
+        from geese.knowledge.authentication import Authentication
+        with token_cache.refresh_lock(self.url):
+            # Another request may already have refreshed the token this one was sent with.
+            if headers["Authorization"] == f"Bearer {self.leader.get('token', '')}":
+                token, response = Authentication(self.leader, self.args, self.log).get_token(use_cache=False)
+                if token is None:
+                    self._log("error", action="refresh_token", url=self.url, response=response)
+                    return False
+                self.leader["token"] = token
+                self._log("info", action="refresh_token", url=self.url)
+        self.token = self.leader["token"]
+        self.headers["Authorization"] = f"Bearer {self.token}"
+        kwargs["headers"] = dict(headers, Authorization=f"Bearer {self.token}")
+        return True
+
     def get(self, endpoint=None, headers=None, payload=None, stream=False, use_session=False, url=None):
         try:
+            # Plain listings (no query, body or streaming) can be served from the run-scoped listing cache.
+            cacheable = (url is None and headers is None and payload is None and not stream
+                         and "?" not in f"{endpoint}")
             url = self._build_endpoint(endpoint) if url is None else url
             self._log("debug", method="get", url=url, headers=headers, payload=payload, stream=stream,
                       use_session=use_session)
@@ -184,23 +339,32 @@ class BaseKnowledge:
             if payload is None:
                 payload = self.payload
             if payload is not None:
-                if use_session is True:
-                    return requests.Session().get(url, data=json.dumps(payload),
-                                                  params=payload,
-                                                  headers=headers, stream=stream,
-                                                  verify=self.verify_ssl)
-                return requests.get(url, data=json.dumps(payload),
-                                    params=payload, headers=headers, stream=stream,
-                                    verify=self.verify_ssl)
+                return self._request("GET", url, data=json.dumps(payload), params=payload, headers=headers,
+                                     stream=stream)
+            elif cacheable:
+                return self._get_listing(url, headers)
             else:
-                if use_session is True:
-                    return requests.Session().get(url, headers=headers, stream=stream, verify=self.verify_ssl)
-                else:
-                    return requests.get(url, headers=headers, stream=stream, verify=self.verify_ssl)
+                return self._request("GET", url, headers=headers, stream=stream)
         except Exception as e:
             raise Exception(
                 f"General exception raised while attempting GET {self._build_endpoint(endpoint)}: {e}")
 
+    def _get_listing(self, url, headers):
+        if listing_cache.enabled:
+            return listing_cache.fetch((self.url, self.group, url), lambda: self._conditional_get(url, headers))
+        return self._conditional_get(url, headers)
+
+    def _conditional_get(self, url, headers):
+        if not response_cache.enabled:
+            return self._request("GET", url, headers=headers)
+        response = self._request("GET", url, headers=response_cache.conditional_headers(url, headers))
+        resolved = response_cache.resolve(url, response)
+        if resolved is None:
+            # Revalidated an entry removed from disk since: fetch the full body.
+            response = self._request("GET", url, headers=headers)
+            resolved = response_cache.resolve(url, response)
+        return resolved if resolved is not None else response
+
     def post(self, endpoint=None, headers=None, payload=None, stream=False, use_session=False, data=None, url=None):
         try:
             url = self._build_endpoint(endpoint) if url is None else url
@@ -208,11 +372,7 @@ class BaseKnowledge:
             headers = headers if headers is not None else self.headers
             self._log("debug", stage="request", method="post", url=url, headers=headers, payload=pay_me, stream=stream,
                       use_session=use_session)
-            response = None
-            if use_session is True:
-                response = requests.Session().post(url, data=pay_me, headers=headers, verify=self.verify_ssl)
-            else:
-                response = requests.post(url, data=pay_me, headers=headers, verify=self.verify_ssl)
+            response = self._request("POST", url, data=pay_me, headers=headers)
             self._log("debug", stage="response", response=response.text, status=response.status_code, method="post",
                       url=url, headers=headers, payload=pay_me, stream=stream,
                       use_session=use_session)
@@ -229,14 +389,39 @@ class BaseKnowledge:
             headers = headers if headers is not None else self.headers
             self._log("debug", method="put", url=url, headers=headers, payload=pay_me, stream=stream,
                       use_session=use_session)
-            if use_session is True:
-                return requests.Session().put(url, headers=headers, data=pay_me, verify=self.verify_ssl)
-            else:
-                return requests.put(url, headers=headers, data=pay_me, verify=self.verify_ssl)
+            return self._request("PUT", url, headers=headers, data=pay_me)
         except Exception as e:
             raise Exception(
                 f"General exception raised while attempting PUT {self._build_endpoint(endpoint)}: {e}")
 
+    def upload_file(self, endpoint, local_file, headers=None, compress=False, label=None):
+        """
+        PUTs a file from disk without reading it into memory.
+
+        The body is streamed from the open file with a known Content-Length. With `compress`, the file is
+        gzip-encoded to a temporary file first and sent with Content-Encoding: gzip.
+        """
+        upload = gzip_file(local_file) if compress else local_file
+        try:
+            size = archive_files.size(upload)
+            headers = copy.deepcopy(headers if headers is not None else self.headers)
+            headers["Content-Length"] = str(size)
+            if compress:
+                headers["Content-Encoding"] = "gzip"
+            started = time.monotonic()
+            with archive_files.open(upload) as f:
+                response = self.put(endpoint, headers=headers, data=f)
+            elapsed = max(time.monotonic() - started, 0.001)
+        finally:
+            if compress and os.path.exists(upload):
+                os.remove(upload)
+        self._log("info", action="upload_file", file=local_file, bytes=size, compressed=compress,
+                  seconds=round(elapsed, 3), bytes_per_second=int(size / elapsed), status=response.status_code)
+        label = label if label is not None else os.path.basename(local_file)
+        self._display(f"\t{label}: sent {round(size / 1048576, 2)} MB in {round(elapsed, 2)}s "
+                      f"({round(size / elapsed / 1048576, 2)} MB/s)", self.colors.get("info", "blue"))
+        return response
+
     def patch(self, endpoint=None, headers=None, payload=None, stream=False, use_session=False, data=None, url=None):
         try:
             url = self._build_endpoint(endpoint) if url is None else url
@@ -244,10 +429,7 @@ class BaseKnowledge:
             headers = headers if headers is not None else self.headers
             self._log("debug", method="patch", url=url, headers=headers, payload=pay_me, stream=stream,
                       use_session=use_session)
-            if use_session is True:
-                return requests.Session().patch(url, data=pay_me, headers=headers, verify=self.verify_ssl)
-            else:
-                return requests.patch(url, data=pay_me, headers=headers, verify=self.verify_ssl)
+            return self._request("PATCH", url, data=pay_me, headers=headers)
         except Exception as e:
             raise Exception(
                 f"General exception raised while attempting PATCH {self._build_endpoint(endpoint)}: {e}")
@@ -259,19 +441,46 @@ class BaseKnowledge:
             self._log("debug", method="delete", url=url, headers=headers, payload=payload, stream=stream,
                       use_session=use_session)
             if payload is not None:
-                if use_session is True:
-                    requests.Session().delete(url, headers=headers, verify=self.verify_ssl, data=json.dumps(payload))
-                else:
-                    return requests.delete(url, headers=headers, verify=self.verify_ssl, data=json.dumps(payload))
+                return self._request("DELETE", url, headers=headers, data=json.dumps(payload))
             else:
-                if use_session is True:
-                    return requests.Session().delete(url, headers=headers, verify=self.verify_ssl)
-                else:
-                    return requests.delete(url, headers=headers, verify=self.verify_ssl)
+                return self._request("DELETE", url, headers=headers)
         except Exception as e:
             raise Exception(
                 f"General exception raised while attempting DELETE {self._build_endpoint(endpoint)}: {e}")
 
+    async def _acall(self, func, *args, **kwargs):
+        transport = get_transport()
+        if transport is None:
+            return func(*args, **kwargs)
+        return await transport.call(func, *args, **kwargs)
+
+    async def aget(self, *args, **kwargs):
+        return await self._acall(self.get, *args, **kwargs)
+
+    async def apost(self, *args, **kwargs):
+        return await self._acall(self.post, *args, **kwargs)
+
+    async def aput(self, *args, **kwargs):
+        return await self._acall(self.put, *args, **kwargs)
+
+    async def apatch(self, *args, **kwargs):
+        return await self._acall(self.patch, *args, **kwargs)
+
+    async def adelete(self, *args, **kwargs):
+        return await self._acall(self.delete, *args, **kwargs)
+
+    async def aexport(self, *args, **kwargs):
+        return await self._acall(self.export, *args, **kwargs)
+
+    async def ainventory(self, *args, **kwargs):
+        return await self._acall(self.inventory, *args, **kwargs)
+
+    async def aupdate(self, *args, **kwargs):
+        return await self._acall(self.update, *args, **kwargs)
+
+    async def asimulate(self, *args, **kwargs):
+        return await self._acall(self.simulate, *args, **kwargs)
+
     def _update_item(self, action, item, id_field="id", changes=None, update_on_create_failure=True):
         if changes is None:
             changes = {"id": item[id_field] if id_field in item else "Unknown",
@@ -2,6 +2,7 @@ import json
 import os
 from deepdiff import DeepDiff
 from geese.knowledge.base import BaseKnowledge
+from geese.utils.export_manifest import export_manifest
 
 
 class Certificates(BaseKnowledge):
@@ -17,18 +18,25 @@ class Certificates(BaseKnowledge):
             self.endpoint = "system/certificates"
         self.certificates = {}
 
-    def export(self):
+    def inventory(self):
+        return self.export(save_file=False)
+
+    def export(self, save_file=True):
         action = f"export_{self.obj_type}"
         data = self.get(self.endpoint)
         if data.status_code == 200 and data.json():
             items = []
-            output_directory = self._gen_save_dir(self.args.directory, "certificates")
+            if save_file:
+                output_directory = self._gen_save_dir(self.args.directory, "certificates")
             for item in data.json()["items"]:
-                filename = os.path.join(output_directory, f"{item['id']}.crt")
-                with open(filename, 'w') as of:
-                    of.write(item["cert"])
-                item["cert"] = filename
+                if save_file:
+                    filename = os.path.join(output_directory, f"{item['id']}.crt")
+                    with export_manifest.open(filename, *self._export_source()) as of:
+                        of.write(item["cert"])
+                    item["cert"] = filename
                 items.append(item)
+            if save_file:
+                export_manifest.exported(*self._export_source())
             self._log("info",
                       action=action,
                       source_url=self.url,
@@ -1,9 +1,28 @@
 import csv
+import gzip
+import hashlib
+import io
 import json
 import os
+import tempfile
+
+from collections import deque
+from copy import deepcopy
+from concurrent.futures import ThreadPoolExecutor
 
 from deepdiff import DeepDiff
+from geese.constants.configs import export_cmd
 from geese.knowledge.base import BaseKnowledge
+from geese.utils.circuit import failure_statuses
+from geese.utils.codec import json_dumps
+from geese.utils.export_manifest import export_manifest
+from geese.utils.files import gunzip_file
+
+
+# Times a lookup content download resumes from the last written page after a failure.
+resume_attempts = 3
+# Listing fields that change with a lookup's content; without any of them its content is always downloaded.
+change_fields = ["size", "version", "modified", "mtime"]
 
 
 class Lookups(BaseKnowledge):
@@ -23,20 +42,121 @@ class Lookups(BaseKnowledge):
         except Exception as e:
             self._display_error("Unhandled INIT Exception", e)
 
-    def save_lookup_content(self, lookup_id, filename, save_to_directory="."):
-        limit = 100000
-        # TODO: Implement dynamic, config driven limits.
-        response = self.get(f"{self.endpoint}/{lookup_id}/content?offset=0&limit={limit}")
-        if response.status_code == 200:
-            with open(os.path.join(save_to_directory, filename), "w", newline='') as lf:
-                r = response.json()
-                fieldnames = r["fields"]
-                data = [fieldnames]
-                [data.append(r) for r in r["items"]]
+    def _get_lookup_page(self, lookup_id, offset, limit):
+        return self.get(f"{self.endpoint}/{lookup_id}/content?offset={offset}&limit={limit}")
+
+    def _lookup_pages(self, lookup_id, limit, workers, start=0):
+        """
+        Yields (response, page) for the lookup content pages in order from row `start`, stopping after the first
+        failed one (whose page is None) or the first page shorter than `limit`.
+
+        The leader's `count` is the number of items in a page, not in the lookup, so the end is only known from
+        a short page. For as long as pages come back full, `workers` threads keep the next `workers` pages in
+        flight; the first short or failed page cancels the ones not started yet.
+        """
+        response = self._get_lookup_page(lookup_id, start, limit)
+        page = response.json() if response.status_code == 200 else None
+        yield response, page
+        if page is None or len(page.get("items", [])) < limit:
+            return
+        workers = max(1, workers)
+        offset = start + limit
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="geese-lookup") as executor:
+            pending = deque()
+            while True:
+                while len(pending) < workers:
+                    pending.append(executor.submit(self._get_lookup_page, lookup_id, offset, limit))
+                    offset += limit
+                response = pending.popleft().result()
+                page = response.json() if response.status_code == 200 else None
+                yield response, page
+                if page is None or len(page.get("items", [])) < limit:
+                    for future in pending:
+                        future.cancel()
+                    return
+
+    @staticmethod
+    def _lookup_meta(lookup):
+        # What the listing says about a lookup, checked before downloading its content again.
+        if not any(lookup.get(f, None) is not None for f in change_fields):
+            return None
+        listed = {k: v for k, v in lookup.items() if k not in ["local_location", "local_filename"]}
+        return {"id": lookup["id"], "size": lookup.get("size", None), "version": lookup.get("version", None),
+                "listing": hashlib.sha256(json_dumps(listed, sort_keys=True).encode("utf-8")).hexdigest()}
+
+    def _reuse_lookup(self, lookup, filename, directory):
+        """
+        Keeps the lookup file of the previous export when the lookup listing is unchanged, see `export_manifest.reuse`.
+        """
+        if getattr(self.args, "refresh_lookups", False):
+            return False
+        path = os.path.join(directory, filename)
+        entry = export_manifest.reuse(path, *self._export_source(), meta=self._lookup_meta(lookup))
+        if entry is None:
+            return False
+        self._log("debug", action="reuse_lookup_content", lookup=lookup["id"], location=path, size=entry["size"])
+        return True
+
+    def _keep_lookup(self, lookup, filename, directory):
+        """
+        Keeps the lookup file of the previous export when this run could not download it, see `export_manifest.keep`.
+        """
+        if export_manifest.keep(os.path.join(directory, filename), *self._export_source()) is None:
+            return
+        lookup["local_location"] = directory
+        lookup["local_filename"] = filename
+        self._display(f"\t{lookup['id']}: Keeping the previous download.", self.colors.get("warning", "yellow"))
+
+    def save_lookup_content(self, lookup_id, filename, save_to_directory=".", meta=None):
+        limit = max(1, getattr(self.args, "lookup_page_size", None) or export_cmd["lookup_page_size"])
+        workers = getattr(self.args, "lookup_page_workers", None) or export_cmd["lookup_page_workers"]
+        path = os.path.join(save_to_directory, filename)
+        fd, tmp_path = tempfile.mkstemp(dir=save_to_directory, prefix=".tmp-", suffix=filename)
+        os.close(fd)
+        response = None
+        fields = None
+        rows = 0
+        try:
+            # No timestamp in the gzip header, so unchanged content gives the same file.
+            with open(tmp_path, "wb") as raw, \
+                    io.TextIOWrapper(gzip.GzipFile(path, "wb", fileobj=raw, mtime=0) if filename.endswith(".gz")
+                                     else raw, newline='') as lf:
                 writer = csv.writer(lf)
-                writer.writerows(data)
+                failures = 0
+                while True:
+                    try:
+                        for response, r in self._lookup_pages(lookup_id, limit, workers, start=rows):
+                            if r is None:
+                                break
+                            if fields is None:
+                                fields = r["fields"]
+                                writer.writerow(fields)
+                            writer.writerows(r["items"])
+                            rows += len(r["items"])
+                        if response.status_code not in failure_statuses:
+                            break
+                        error = response.status_code
+                    except Exception as e:
+                        error = e
+                    # Pages are written in order, so the rows written so far are the offset to resume from.
+                    failures += 1
+                    if failures > resume_attempts:
+                        if isinstance(error, Exception):
+                            raise error
+                        break
+                    self._log("warn", action="resume_lookup_content", lookup=lookup_id, offset=rows, error=error)
+            if response.status_code == 200:
+                export_manifest.commit(tmp_path, path, *self._export_source(), meta=meta)
+                self._log("debug", action="save_lookup_content", lookup=lookup_id, location=path, rows=rows,
+                          page_size=limit)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
         return response
 
+    def inventory(self):
+        return self.export(save_file=False)
+
     def export(self, save_file=True):
         try:
             action = f"export_{self.obj_type}"
@@ -49,18 +169,36 @@ class Lookups(BaseKnowledge):
                         filename = f"{lookup['id']}"
                         if self.args.use_namespace:
                             filename = f"{lookup['id']}"
-                        self._display(f"\tDownloading Lookup: {filename}", self.colors.get("info", "blue"))
+                        if getattr(self.args, "gzip_lookups", False) and not filename.endswith(".gz"):
+                            filename = f"{filename}.gz"
                         # if self.args.split and self.args.use_namespace:
                         lookup_directory = self._gen_save_dir(self.args.directory, "lookups")
-                        response = self.save_lookup_content(lookup['id'], filename, f"{lookup_directory}")
-                        if response.status_code == 200:
+                        if self._reuse_lookup(lookup, filename, lookup_directory):
+                            self._display(f"\t{lookup['id']}: Listing unchanged, not downloading again.",
+                                          self.colors.get("success", "green"))
+                            lookup["local_location"] = lookup_directory
+                            lookup["local_filename"] = filename
+                            items.append(lookup)
+                            continue
+                        self._display(f"\tDownloading Lookup: {filename}", self.colors.get("info", "blue"))
+                        try:
+                            response = self.save_lookup_content(lookup['id'], filename, f"{lookup_directory}",
+                                                                meta=self._lookup_meta(lookup))
+                            error = None if response.status_code == 200 else response.text
+                        except Exception as e:
+                            error = e
+                        if error is None:
                             self._display(f"\t{lookup['id']}: File downloaded.", self.colors.get("success", "green"))
                             lookup["local_location"] = lookup_directory
                             lookup["local_filename"] = filename
                         else:
-                            self._display(f"\t{lookup['id']}: Error while trying to download. {response.text}",
+                            self._display(f"\t{lookup['id']}: Error while trying to download. {error}",
                                           self.colors.get("error"))
+                            self._keep_lookup(lookup, filename, lookup_directory)
                     items.append(lookup)
+                if save_file:
+                    # Only once every lookup was handled, so an export that stopped halfway prunes nothing.
+                    export_manifest.exported(*self._export_source())
                 self._log("info",
                           action=action,
                           source_url=self.url,
@@ -78,8 +216,23 @@ class Lookups(BaseKnowledge):
             return []
 
     def _upload_lookup_file(self, item):
-        local_file = os.path.join(item["local_location"], item["id"])
-        response = self.put(f"{self.endpoint}?filename={item['id']}", data=open(local_file, "rb"))
+        local_file = os.path.join(item["local_location"], item.get("local_filename", item["id"]))
+        endpoint = f"{self.endpoint}?filename={item['id']}"
+        compress = getattr(self.args, "gzip_uploads", False)
+        if local_file.endswith(".gz") and not item["id"].endswith(".gz"):
+            # Exported with --gzip-lookups: the file is already gzip-encoded.
+            if compress:
+                headers = deepcopy(self.headers)
+                headers["Content-Encoding"] = "gzip"
+                response = self.upload_file(endpoint, local_file, headers=headers)
+            else:
+                plain_file = gunzip_file(local_file)
+                try:
+                    response = self.upload_file(endpoint, plain_file, label=item["id"])
+                finally:
+                    os.remove(plain_file)
+        else:
+            response = self.upload_file(endpoint, local_file, compress=compress)
         if response.status_code == 200:
             self._display(f"\t{item['id']}: upload successful", self.colors.get("success", "green"))
             filename = None
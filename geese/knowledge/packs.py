@@ -1,15 +1,21 @@
+import hashlib
 import json
 import os
 import shutil
 import uuid
 from copy import deepcopy
 
+import requests
 from deepdiff import DeepDiff
-from yaml import YAMLError, safe_dump
+from yaml import YAMLError
 
 from geese.knowledge import Secrets, CollectorJobs, Routes, Inputs, Outputs
 from geese.knowledge.base import BaseKnowledge
 from geese.utils import validate
+from geese.utils.archive import archive_files
+from geese.utils.codec import json_dumps, yaml_dump
+from geese.utils.export_manifest import export_manifest
+from geese.utils.files import download_to_file
 
 
 def stz_compress(*args):
@@ -30,6 +36,7 @@ class Packs(BaseKnowledge):
                 self.group = fleet if fleet is not None else group
             self.is_fleet = True if fleet is not None else False
             self.endpoint = f"m/{self.group}/packs" if self.group else f"packs"
+            self._manifest = {}
         except Exception as e:
             self._display_error("Unhandled INIT Exception", e)
 
@@ -45,22 +52,82 @@ class Packs(BaseKnowledge):
             url = f"m/{self.group}/{url}"
         return self.get(url)
 
-    def _export_pack_merge(self, pack_id):
-        url = f"packs/{pack_id}/export?mode=merge"
+    def _export_pack_url(self, pack_id, mode):
+        url = f"packs/{pack_id}/export?mode={mode}"
         if self.group is not None:
             url = f"m/{self.group}/{url}"
-        return self.get(url)
+        return url
+
+    def _export_pack_merge(self, pack_id):
+        return self.get(self._export_pack_url(pack_id, "merge"), stream=True)
 
     def _export_pack_merge_safe(self, pack_id):
-        url = f"packs/{pack_id}/export?mode=merge_safe"
-        if self.group is not None:
-            url = f"m/{self.group}/{url}"
-        return self.get(url)
+        return self.get(self._export_pack_url(pack_id, "merge_safe"), stream=True)
+
+    @staticmethod
+    def _pack_meta(pack):
+        # What the listing says about a pack, with its routes and pipelines: the .crbl is downloaded again
+        # when any of it changes.
+        listed = {k: v for k, v in pack.items() if k != "local_location"}
+        return {"id": pack["id"], "version": pack.get("version", None), "size": pack.get("size", None),
+                "listing": hashlib.sha256(json_dumps(listed, sort_keys=True).encode("utf-8")).hexdigest()}
+
+    def _reuse_pack(self, directory, pack):
+        """
+        Keeps the .crbl of the previous export when the pack listing is unchanged, see `export_manifest.reuse`.
+        """
+        if getattr(self.args, "refresh_packs", False):
+            return False
+        local_location = os.path.join(directory, f"{pack['id']}.crbl")
+        entry = export_manifest.reuse(local_location, *self._export_source(), meta=self._pack_meta(pack))
+        if entry is None:
+            return False
+        pack["local_location"] = local_location
+        self._log("debug", action="reuse_pack", pack=pack["id"], location=local_location, size=entry["size"],
+                  version=pack.get("version", None))
+        self._manifest[pack["id"]] = {"file": f"{pack['id']}.crbl", "size": entry["size"], "sha256": entry["sha256"]}
+        self._display(f"\tPack {pack['id']}: Listing unchanged (version {pack.get('version', None)}), not downloading "
+                      f"again: {local_location}", self.colors.get("info", "green"))
+        return True
+
+    def _keep_pack(self, directory, pack):
+        """
+        Keeps the .crbl of the previous export when this run could not download the pack, see `export_manifest.keep`.
+        """
+        local_location = os.path.join(directory, f"{pack['id']}.crbl")
+        entry = export_manifest.keep(local_location, *self._export_source())
+        if entry is None:
+            return
+        pack["local_location"] = local_location
+        self._manifest[pack["id"]] = {"file": f"{pack['id']}.crbl", "size": entry["size"], "sha256": entry["sha256"]}
+        self._display(f"\tPack {pack['id']}: Keeping the previous download: {local_location}",
+                      self.colors.get("warning", "yellow"))
+
+    def _write_pack(self, directory, pack, response):
+        local_location = os.path.join(directory, f"{pack['id']}.crbl")
+        # Resume with the export mode that produced this response.
+        url = response.request.url if response.request is not None else None
+        resume = (lambda headers: self.get(url=url, headers=dict(self.headers, **headers), stream=True)) if url else None
+        try:
+            size, sha256 = download_to_file(
+                response, local_location, resume=resume,
+                commit=lambda part, path, digest: export_manifest.commit(part, path, *self._export_source(),
+                                                                         sha256=digest, meta=self._pack_meta(pack)))
+        except (requests.exceptions.RequestException, IOError) as e:
+            self._log("error", action="save_pack", pack=pack["id"], location=local_location, error=e)
+            self._display(f"\tPack {pack['id']}: Could not download pack. {e}", self.colors.get("error", "red"))
+            return False
+        pack["local_location"] = local_location
+        self._log("debug", action="save_pack", pack=pack["id"], location=local_location, size=size, sha256=sha256)
+        self._manifest[pack["id"]] = {"file": f"{pack['id']}.crbl", "size": size, "sha256": sha256}
+        return True
 
     def save_pack(self, directory, pack):
         pack_id = pack["id"]
-        if not os.path.exists(directory):
-            os.makedirs(directory)
+        os.makedirs(directory, exist_ok=True)
+        if self._reuse_pack(directory, pack):
+            return pack
+        saved = False
         response = self._export_pack_merge_safe(pack_id)
         if response is not None and response.status_code != 200:
             if response.text.find("Use a different export mode") != -1:
@@ -72,12 +139,11 @@ class Packs(BaseKnowledge):
                 # try merge
                 response = self._export_pack_merge(pack_id)
                 if response.status_code == 200:
-                    pack["local_location"] = os.path.join(directory, f"{pack_id}.crbl")
-                    with open(pack["local_location"], "wb") as pack_file:
-                        pack_file.write(response.content)
-                    self._display(
-                        f"\tPack {pack_id}: Successfully exported to {directory}",
-                        self.colors.get("info", "green"))
+                    saved = self._write_pack(directory, pack, response)
+                    if saved:
+                        self._display(
+                            f"\tPack {pack_id}: Successfully exported to {directory}",
+                            self.colors.get("info", "green"))
                 else:
                     self._display(f"\tPack {pack_id}: Could not download pack.",
                                   self.colors.get("error", "red"))
@@ -86,16 +152,34 @@ class Packs(BaseKnowledge):
                     f"\tPack {pack_id}: Error on download. API responded with error: {json.loads(response.text)['message']}",
                     self.colors.get("error", "red"))
         elif response is not None and response.status_code == 200:
-            pack["local_location"] = os.path.join(directory, f"{pack_id}.crbl")
-            with open(pack["local_location"], "wb") as pack_file:
-                pack_file.write(response.content)
-            self._display(
-                f"\tPack {pack_id}: Successfully exported pack to {directory}",
-                self.colors.get("info", "green"))
+            saved = self._write_pack(directory, pack, response)
+            if saved:
+                self._display(
+                    f"\tPack {pack_id}: Successfully exported pack to {directory}",
+                    self.colors.get("info", "green"))
         else:
             self._display(f"Unexpected response: {response}")
+        if not saved:
+            self._keep_pack(directory, pack)
         return pack
 
+    def write_manifest(self, directory):
+        """
+        Writes manifest.json next to the downloaded packs with the size and sha256 of each .crbl file.
+        """
+        manifest_file = os.path.join(directory, "manifest.json")
+        with export_manifest.open(manifest_file, *self._export_source(), mode="wb") as f:
+            f.write(json_dumps({"packs": self._manifest}, indent=2, sort_keys=True).encode("utf-8"))
+        self._log("info", action="write_manifest", location=manifest_file, packs=len(self._manifest))
+        return manifest_file
+
+    def inventory(self):
+        # The pack listing has the ids, names and descriptions, skip the routes, pipelines and .crbl downloads.
+        data = self.get(self.endpoint)
+        if data.status_code == 200 and data.json():
+            return [p for p in data.json()["items"] if validate("packs", p, self.tuning)]
+        return []
+
     def export(self, save_pack=True):
         action = f"export_{self.obj_type}"
         try:
@@ -119,21 +203,24 @@ class Packs(BaseKnowledge):
                             directory = self._gen_save_dir(self.args.directory, "packs")
                             self.save_pack(directory, pack)
                         packs.append(pack)
+                if save_pack:
+                    # Only once every pack was handled, so an export that stopped halfway prunes nothing.
+                    export_manifest.exported(*self._export_source())
+                if save_pack and self._manifest and getattr(self.args, "pack_manifest", False):
+                    self.write_manifest(self._gen_save_dir(self.args.directory, "packs"))
             return packs
         except Exception as e:
             self._display_error(f"{action} Unhandled EXPORT Exception: {self.obj_type}", e)
             return []
 
     def _upload_and_install(self, pack, local_location=""):
-        pack_id = pack["name"]
-        with open(local_location, 'rb') as f:
-            data = f.read()
-        url = f"packs?filename={pack_id}.crbl&size={len(data)}"
+        pack_id = pack.get("name", pack.get("id"))
+        url = f"packs?filename={pack_id}.crbl&size={archive_files.size(local_location)}"
         if self.group is not None:
             url = f"m/{self.group}/{url}"
         headers = deepcopy(self.headers)
         headers["Content-type"] = 'application/octet-stream'
-        response = self.put(url, headers=headers, data=data)
+        response = self.upload_file(url, local_location, headers=headers)
         if response.status_code == 200:
             if "source" in response.json():
                 payload = {
@@ -170,14 +257,14 @@ class Packs(BaseKnowledge):
                 if not os.path.exists(d):
                     os.makedirs(d)
             with open(os.path.join(tmp_location, "package.json"), "w") as f:
-                f.write(json.dumps(item))
+                f.write(json_dumps(item))
             for pack_item in pack_valid_items:
                 if pack_item == "routes" and pack_item in pack:
                     if not os.path.exists(pipeline_location):
                         os.makedirs(pipeline_location)
                     t = pack[pack_item]
                     with open(os.path.join(pipeline_location, "route.yml"), "w") as f:
-                        safe_dump(t[0], f)
+                        yaml_dump(t[0], f)
                 if pack_item == "pipelines" and pack_item in pack:
                     self._log("debug", action="upload_via_conf", pack_item=pack_item)
                     if not os.path.exists(pipeline_location):
@@ -192,7 +279,7 @@ class Packs(BaseKnowledge):
                             os.makedirs(output_path)
                         output_file = os.path.join(output_path, "conf.yml")
                         with open(output_file, "w") as f:
-                            safe_dump(conf, f)
+                            yaml_dump(conf, f)
                 if pack_item == "readme" and pack_item in pack:
                     t = pack[pack_item]
                     with open(os.path.join(tmp_location, "README.md"), "w") as f:
@@ -200,7 +287,7 @@ class Packs(BaseKnowledge):
                 if pack_item == "logo" and pack_item in pack:
                     t = pack[pack_item]
                     with open(os.path.join(tmp_location, "default", "pack.yml"), "w") as f:
-                        safe_dump({"logo": f"data:image/png;base64,{pack['logo']}"}, f)
+                        yaml_dump({"logo": f"data:image/png;base64,{pack['logo']}"}, f)
             shutil.make_archive(zip_file, 'gztar', tmp_location)
             shutil.move(f"{zip_file}.tar.gz", zip_file)
             if not self.args.no_delete_pack:
@@ -1,9 +1,108 @@
 import datetime
 import json
+from urllib.parse import quote
 
 from deepdiff import DeepDiff
 from geese.knowledge.base import BaseKnowledge
 
+# Config files under local/cribl of a group, and the knowledge object type stored in each.
+config_files = {
+    "inputs.yml": "inputs",
+    "outputs.yml": "outputs",
+    "routes.yml": "routes",
+    "parsers.yml": "parsers",
+    "regexes.yml": "regexes",
+    "schemas.yml": "schemas",
+    "parquet_schemas.yml": "parquet_schemas",
+    "breakers.yml": "event_breaker_rules",
+    "jobs.yml": "collectors",
+    "vars.yml": "global_variables",
+    "database_connections.yml": "database_connections",
+    "notifications.yml": "notifications",
+    "notification_targets.yml": "notification_targets",
+    "secrets.yml": "secrets",
+    "keys.yml": "keys",
+    "certificates.yml": "certificates",
+    "mappings.yml": "mappings",
+    "packs.yml": "packs"
+}
+# Directories under local/cribl holding one knowledge object type.
+config_dirs = {
+    "grok": "grokfiles",
+    "lookups": "lookups"
+}
+
+
+def _file_paths(items, prefix=""):
+    # Flattens a tree of GitFile objects ({name, children}) into file paths.
+    paths = []
+    for item in items or []:
+        if not isinstance(item, dict) or not item.get("name", None):
+            continue
+        if item.get("children", None):
+            paths.extend(_file_paths(item["children"], f"{prefix}{item['name']}/"))
+        else:
+            paths.append(f"{prefix}{item['name']}")
+    return paths
+
+
+def _commit_paths(body):
+    """
+    Reads the files of a commit from a version/files answer: items of GitFilesResponse, each holding a tree of
+    GitFile objects.
+
+    :return: List of file paths, or None when the answer is empty or not shaped like that
+    """
+    responses = body.get("items", None) if isinstance(body, dict) else None
+    if not isinstance(responses, list) or len(responses) == 0:
+        return None
+    paths = []
+    for response in responses:
+        if not isinstance(response, dict) or not isinstance(response.get("items", None), list):
+            return None
+        paths.extend(_file_paths(response["items"]))
+    return paths if len(paths) > 0 else None
+
+
+def changed_objects(paths, group=None):
+    """
+    Maps changed config file paths to the knowledge objects they hold.
+
+    :param paths: File paths relative to the leader's config root
+    :param group: Worker group the paths were listed for
+    :return: Tuple of ({object type: set of changed ids, or None for the whole type}, [unmapped paths])
+    """
+    changed = {}
+    unmapped = []
+    for path in paths:
+        parts = [p for p in path.split("/") if p]
+        if len(parts) >= 2 and parts[0] == "groups":
+            if group is not None and parts[1] != group:
+                continue
+            parts = parts[2:]
+        if parts[:1] == ["data"]:
+            parts = parts[1:]
+        if len(parts) >= 3 and parts[:2] == ["local", "cribl"]:
+            rest = parts[2:]
+            if rest[0] == "pipelines" and len(rest) >= 3:
+                if changed.get("pipelines", set()) is not None:
+                    changed.setdefault("pipelines", set()).add(rest[1])
+                continue
+            if len(rest) == 1 and rest[0] in config_files:
+                changed[config_files[rest[0]]] = None
+                continue
+            if len(rest) >= 2 and rest[0] in config_dirs:
+                changed[config_dirs[rest[0]]] = None
+                continue
+        elif len(parts) >= 2 and parts[0] == "lookups":
+            changed["lookups"] = None
+            continue
+        elif len(parts) >= 2 and parts[0] == "default" and parts[1] != "cribl":
+            changed["packs"] = None
+            continue
+        unmapped.append(path)
+    return changed, unmapped
+
 
 class Versioning(BaseKnowledge):
     obj_type = "versioning"
@@ -19,6 +118,66 @@ class Versioning(BaseKnowledge):
             self.is_fleet = True if fleet is not None else False
             self.endpoint = f"m/{self.group}/version/commit"
 
+    def _group_git(self):
+        cloud = f'{self.leader.get("is_cloud", False)}'.lower() == "true"
+        endpoint = "products/stream/groups" if cloud else "master/groups"
+        result = self.get(f"{endpoint}/{quote(self.group, safe='')}?fields=git.commit,git.localChanges,git.log")
+        if result.status_code != 200:
+            return None
+        try:
+            items = result.json().get("items", [])
+            return items[0].get("git", None) if len(items) == 1 else None
+        except (ValueError, AttributeError):
+            return None
+
+    def _commits_since(self, since):
+        # Hashes of the group's commits made after `since`, or None when its log does not reach back to it.
+        git = self._group_git()
+        if not isinstance(git, dict) or not isinstance(git.get("log", None), list) or git.get("localChanges", 0):
+            return None
+        log = [c.get("hash", None) for c in git["log"] if isinstance(c, dict)]
+        if len(log) == 0 or None in log:
+            return None
+        if log[-1] == git.get("commit", None) and log[0] != git.get("commit", None):
+            # Oldest first.
+            log.reverse()
+        for position, commit in enumerate(log):
+            if commit.startswith(f"{since}"):
+                return log[:position]
+        return None
+
+    def changed_files(self, since):
+        """
+        Lists the config files changed since commit `since`: the files of every commit in the group's log made
+        after it.
+
+        :param since: Commit ID to compare against
+        :return: List of file paths, or None when the leader cannot tell (no group, `since` not in the log,
+            uncommitted changes, or a commit whose files cannot be listed)
+        """
+        if self.group is None:
+            return None
+        commits = self._commits_since(since)
+        if commits is None:
+            self._log("warn", action="changed_files", source_url=self.url, source_group=self.group, since=since,
+                      message="commit_not_in_log")
+            return None
+        paths = []
+        for commit in commits:
+            result = self.get(f"version/files?ID={quote(commit, safe='')}&group={quote(self.group, safe='')}")
+            try:
+                files = _commit_paths(result.json()) if result.status_code == 200 else None
+            except ValueError:
+                files = None
+            if files is None:
+                self._log("warn", action="changed_files", source_url=self.url, source_group=self.group,
+                          commit=commit, status=result.status_code)
+                return None
+            paths.extend(f for f in files if f not in paths)
+        self._log("info", action="changed_files", source_url=self.url, source_group=self.group, since=since,
+                  commits=len(commits), count=len(paths))
+        return paths
+
     def commit(self, message=None, deploy=False, effective=True):
         action = f"import_{self.obj_type}"
         changes = {"id": "versioning",
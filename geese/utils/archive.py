@@ -0,0 +1,236 @@
+import atexit
+import gzip
+import hashlib
+import io
+import os
+import shutil
+import tarfile
+import tempfile
+import time
+import uuid
+
+from geese.utils.codec import json_dumps, json_loads
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# First member of every archive: the export root and the size and sha256 of each file.
+index_name = ".geese-archive.json"
+# Left in an export directory while it is written, or the artifact store, never archived.
+skipped_prefixes = [".geese-spool-", ".tmp-", ".geese-artifacts"]
+skipped_suffixes = [".part", ".part.json"]
+suffixes = {".tar.zst": "zst", ".tzst": "zst", ".tar.gz": "gz", ".tgz": "gz", ".tar": ""}
+chunk_size = 1024 * 1024
+
+
+def archive_format(path):
+    for suffix, fmt in suffixes.items():
+        if path.endswith(suffix):
+            return suffix, fmt
+    raise ValueError(f"Unknown archive type {path}, use one of: {', '.join(suffixes.keys())}")
+
+
+def _archived_files(directory, archive_path):
+    names = []
+    archive_path = os.path.abspath(archive_path)
+    for root, dirs, files in os.walk(directory):
+        dirs[:] = sorted(d for d in dirs if not any(d.startswith(p) for p in skipped_prefixes))
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            if (any(name.startswith(p) for p in skipped_prefixes) or any(name.endswith(s) for s in skipped_suffixes)
+                    or os.path.abspath(path) == archive_path):
+                continue
+            names.append(os.path.relpath(path, directory).replace(os.sep, "/"))
+    return names
+
+
+def _sha256(path):
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def write_archive(directory, path):
+    """
+    Streams every file of an export directory into one tar archive, compressed with zstd (.tar.zst) or
+    gzip (.tar.gz). A .tar.zst is written as .tar.gz when the zstandard module is not installed.
+
+    :param directory: Export directory
+    :param path: Archive to write
+    :return: Tuple of (archive written, number of files, archive size in bytes)
+    """
+    suffix, fmt = archive_format(path)
+    if fmt == "zst" and zstandard is None:
+        path, fmt = f"{path[:-len(suffix)]}.tar.gz", "gz"
+    names = _archived_files(directory, path)
+    index = {"root": os.path.normpath(directory), "created": int(time.time()),
+             "files": {n: {"size": os.path.getsize(os.path.join(directory, n)),
+                           "sha256": _sha256(os.path.join(directory, n))} for n in names}}
+    target = os.path.dirname(os.path.abspath(path))
+    os.makedirs(target, exist_ok=True)
+    tmp_path = os.path.join(target, f".tmp-{uuid.uuid4().hex}-{os.path.basename(path)}")
+    try:
+        with open(tmp_path, "xb") as raw:
+            if fmt == "zst":
+                stream = zstandard.ZstdCompressor().stream_writer(raw)
+            elif fmt == "gz":
+                stream = gzip.GzipFile(fileobj=raw, mode="wb")
+            else:
+                stream = raw
+            # Files hard linked from the artifact store are archived with their content, not as links.
+            with tarfile.open(fileobj=stream, mode="w|", dereference=True) as tar:
+                data = json_dumps(index, indent=2, sort_keys=True).encode("utf-8")
+                info = tarfile.TarInfo(index_name)
+                info.size = len(data)
+                info.mtime = index["created"]
+                tar.addfile(info, io.BytesIO(data))
+                for name in names:
+                    tar.add(os.path.join(directory, name), arcname=name, recursive=False)
+            if stream is not raw:
+                stream.close()
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return path, len(names), os.path.getsize(path)
+
+
+class ExportArchive:
+    """
+    Read access to an archive written by `export --archive`, without extracting it up front.
+
+    Opening the archive makes one pass over it to list every member. The configuration files are read in a
+    single pass with `read`; the first `open` extracts the other members into a spool directory in one more
+    pass, so packs and lookups are uploaded from seekable files on disk.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.members = {}
+        self.index = {}
+        self._spool = None
+        with self._raw() as raw, tarfile.open(fileobj=raw, mode="r|") as tar:
+            for info in tar:
+                if not info.isfile():
+                    continue
+                if info.name == index_name:
+                    self.index = json_loads(tar.extractfile(info).read())
+                else:
+                    self.members[info.name] = info.size
+        self.root = os.path.normpath(self.index.get("root", "."))
+
+    def _raw(self):
+        with open(self.path, "rb") as f:
+            magic = f.read(4)
+        if magic[:2] == b"\x1f\x8b":
+            return gzip.open(self.path, "rb")
+        if magic == b"\x28\xb5\x2f\xfd":
+            if zstandard is None:
+                raise IOError(f"{self.path} is zstd-compressed, install the zstandard module to read it")
+            return zstandard.ZstdDecompressor().stream_reader(open(self.path, "rb"))
+        return open(self.path, "rb")
+
+    def configuration_files(self, file, split=False):
+        """
+        Names of the export files in a `configs` directory, the archive equivalent of `**/configs/<file>`.
+        """
+        names = []
+        for name in self.members:
+            parts = name.split("/")
+            if len(parts) >= 2 and parts[-2] == "configs" and (parts[-1].endswith(file) if split else parts[-1] == file):
+                names.append(name)
+        return names
+
+    def read(self, names):
+        """
+        Yields (name, file object) for `names` in a single pass; each file object must be read before the next.
+        """
+        wanted = set(names)
+        with self._raw() as raw, tarfile.open(fileobj=raw, mode="r|") as tar:
+            for info in tar:
+                if info.name in wanted:
+                    yield info.name, tar.extractfile(info)
+
+    def member(self, path):
+        """
+        Returns the member holding the file exported to `path`, or None.
+        """
+        path = os.path.normpath(path)
+        if self.root != "." and not path.startswith(self.root + os.sep):
+            return None
+        name = (path if self.root == "." else path[len(self.root) + 1:]).replace(os.sep, "/")
+        return name if name in self.members else None
+
+    def _spool_path(self, name):
+        path = os.path.normpath(os.path.join(self._spool, name))
+        if not path.startswith(self._spool + os.sep):
+            raise IOError(f"{self.path}: member {name} is outside the archive")
+        return path
+
+    def _extract(self):
+        # Compressed streams cannot seek back, extract every member once rather than decompressing up to each.
+        spool = tempfile.mkdtemp(prefix=".geese-spool-")
+        self._spool = spool
+        try:
+            with self._raw() as raw, tarfile.open(fileobj=raw, mode="r|") as tar:
+                for info in tar:
+                    if info.name not in self.members:
+                        continue
+                    path = self._spool_path(info.name)
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    with tar.extractfile(info) as src, open(path, "xb") as dst:
+                        shutil.copyfileobj(src, dst, chunk_size)
+        except BaseException:
+            self.close()
+            raise
+
+    def open(self, name):
+        if self._spool is None:
+            self._extract()
+        return open(self._spool_path(name), "rb")
+
+    def close(self):
+        """
+        Removes the spool directory, if any member was extracted.
+        """
+        if self._spool is not None:
+            shutil.rmtree(self._spool, ignore_errors=True)
+            self._spool = None
+
+
+class ArchiveFiles:
+    """
+    Serves the packs and lookups referenced by imported objects from the archive given with --archive,
+    and from disk otherwise.
+    """
+
+    def __init__(self):
+        self.archive = None
+
+    def configure(self, path):
+        self.close()
+        self.archive = ExportArchive(path)
+        atexit.register(self.close)
+
+    def close(self):
+        if self.archive is not None:
+            self.archive.close()
+
+    def _member(self, path):
+        return self.archive.member(path) if self.archive is not None else None
+
+    def open(self, path):
+        name = self._member(path)
+        return self.archive.open(name) if name is not None else open(path, "rb")
+
+    def size(self, path):
+        name = self._member(path)
+        return self.archive.members[name] if name is not None else os.path.getsize(path)
+
+
+archive_files = ArchiveFiles()
@@ -0,0 +1,107 @@
+import os
+import uuid
+
+
+class ArtifactStore:
+    """
+    Content-addressed store for the binary files of an export (packs, lookups and certificates).
+
+    Each distinct file is kept once as `<store>/<sha256[:2]>/<sha256>` and hard linked into the group
+    directories, so a pack deployed to many groups takes its size on disk once. A blob that no export file
+    links to any more has a link count of 1 and is removed by `gc`.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def blob(self, sha256):
+        return os.path.join(self.directory, sha256[:2], sha256)
+
+    def has(self, sha256, size=None):
+        path = self.blob(sha256)
+        return os.path.exists(path) and (size is None or os.path.getsize(path) == size)
+
+    def linked(self, sha256, path):
+        """
+        True when `path` is a link to the blob of `sha256`.
+        """
+        try:
+            return os.path.samefile(self.blob(sha256), path)
+        except OSError:
+            return False
+
+    def link(self, sha256, path):
+        """
+        Replaces `path` with a hard link to the blob of `sha256`.
+        """
+        tmp_path = os.path.join(os.path.dirname(os.path.abspath(path)), f".tmp-{uuid.uuid4().hex}")
+        os.link(self.blob(sha256), tmp_path)
+        try:
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    def adopt(self, path, sha256):
+        """
+        Links a file exported before the store was used into it, without copying it.
+
+        :return: False when hard links are not supported
+        """
+        try:
+            if os.path.exists(self.blob(sha256)):
+                self.link(sha256, path)
+            else:
+                os.makedirs(os.path.dirname(self.blob(sha256)), exist_ok=True)
+                os.chmod(path, os.stat(path).st_mode & ~0o222)
+                os.link(path, self.blob(sha256))
+            return True
+        except OSError:
+            return False
+
+    def add(self, tmp_path, path, sha256):
+        """
+        Moves a finished file to `path` through the store: `tmp_path` becomes the blob of `sha256` unless the store
+        already has it, and `path` a link to the blob. Falls back to a plain rename where hard links fail.
+        """
+        blob = self.blob(sha256)
+        try:
+            if os.path.exists(blob):
+                os.remove(tmp_path)
+            else:
+                os.makedirs(os.path.dirname(blob), exist_ok=True)
+                # Read-only, as it is shared by every group it is linked into.
+                os.chmod(tmp_path, os.stat(tmp_path).st_mode & ~0o222)
+                try:
+                    os.link(tmp_path, blob)
+                except FileExistsError:
+                    # Stored by another group in the meantime.
+                    os.remove(tmp_path)
+                else:
+                    os.replace(tmp_path, path)
+                    return
+            self.link(sha256, path)
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.replace(tmp_path, path)
+            else:
+                raise
+
+    def gc(self):
+        """
+        Removes the blobs no export file links to.
+
+        :return: Tuple of (blobs removed, bytes freed)
+        """
+        removed, freed = 0, 0
+        if not os.path.isdir(self.directory):
+            return removed, freed
+        for root, dirs, files in os.walk(self.directory):
+            for name in files:
+                path = os.path.join(root, name)
+                stat = os.stat(path)
+                if stat.st_nlink == 1:
+                    os.remove(path)
+                    removed += 1
+                    freed += stat.st_size
+        return removed, freed
@@ -0,0 +1,114 @@
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+
+# Responses that count as a leader failure, besides connection errors and timeouts. Other errors, 500 included,
+# are the leader rejecting a request and say nothing about whether it is reachable.
+failure_statuses = [502, 503, 504]
+failure_errors = (requests.exceptions.ConnectionError, requests.exceptions.Timeout)
+
+default_breaker = {
+    "failures": 5,
+    "reset": 60
+}
+
+_breakers = {}
+_lock = threading.Lock()
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """
+    Raised instead of sending a request to a leader whose circuit breaker is open.
+    """
+
+
+def is_failure(response=None, error=None):
+    """
+    True when a request failed because the leader could not be reached or could not answer it.
+    """
+    if error is not None:
+        return isinstance(error, failure_errors)
+    return response is not None and response.status_code in failure_statuses
+
+
+def _leader_key(url):
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}".lower()
+
+
+class CircuitBreaker:
+    """
+    Counts consecutive failed requests to one leader.
+
+    After `failures` in a row the breaker opens and requests fail fast. Once `reset` seconds have passed a
+    single trial request is let through; its outcome closes or re-opens the breaker.
+    """
+
+    def __init__(self, failures=None, reset=None):
+        self.failures = int(failures if failures is not None else default_breaker["failures"])
+        self.reset = float(reset if reset is not None else default_breaker["reset"])
+        self.consecutive = 0
+        self.opened_at = None
+        self.trial = False
+        self._trial_thread = None
+        self.stats = {"opened": 0, "short_circuited": 0}
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if not self.trial and time.monotonic() - self.opened_at >= self.reset:
+                self.trial = True
+                self._trial_thread = threading.get_ident()
+                return True
+            self.stats["short_circuited"] += 1
+            return False
+
+    def success(self):
+        with self._lock:
+            self.consecutive = 0
+            self.opened_at = None
+            self.trial = False
+
+    def failure(self):
+        with self._lock:
+            self.consecutive += 1
+            if self.trial or (self.opened_at is None and self.failures > 0 and self.consecutive >= self.failures):
+                if self.opened_at is None:
+                    self.stats["opened"] += 1
+                self.opened_at = time.monotonic()
+                self.trial = False
+
+    def release_trial(self):
+        """
+        Lets another trial request through when the one taken by this thread ended without `success` or
+        `failure` being called.
+        """
+        with self._lock:
+            if self.trial and self._trial_thread == threading.get_ident():
+                self.trial = False
+                self._trial_thread = None
+
+    @property
+    def is_open(self):
+        return self.opened_at is not None
+
+
+def get_breaker(leader, url):
+    """
+    Returns the breaker of the leader serving `url`, created from the leader's `circuit_breaker` config.
+    """
+    key = _leader_key(url)
+    with _lock:
+        if key not in _breakers:
+            conf = leader.get("circuit_breaker", None) or {}
+            _breakers[key] = CircuitBreaker(**{k: v for k, v in conf.items() if k in default_breaker})
+        return _breakers[key]
+
+
+def get_stats():
+    with _lock:
+        return {k: dict(v.stats, open=v.is_open, consecutive=v.consecutive) for k, v in _breakers.items()}
@@ -0,0 +1,91 @@
+import json
+
+import yaml
+
+try:
+    from yaml import CSafeLoader as FastLoader, CSafeDumper as FastDumper
+except ImportError:
+    from yaml import SafeLoader as FastLoader, SafeDumper as FastDumper
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Set by `configure`. The pure Python codecs parse the same documents; output only differs in the line wrapping
+# of long quoted YAML strings and in JSON whitespace and escaping.
+_fast = {"enabled": True}
+
+
+def configure(fast=True):
+    _fast["enabled"] = bool(fast)
+
+
+def describe():
+    """
+    Names the codecs in use, for debug logging.
+    """
+    return {"yaml": "libyaml" if _fast["enabled"] and FastLoader is not yaml.SafeLoader else "python",
+            "json": "orjson" if _fast["enabled"] and orjson is not None else "json"}
+
+
+def _loader():
+    return FastLoader if _fast["enabled"] else yaml.SafeLoader
+
+
+def _dumper():
+    return FastDumper if _fast["enabled"] else yaml.SafeDumper
+
+
+def yaml_load(stream):
+    """
+    Drop-in for `yaml.safe_load`.
+    """
+    return yaml.load(stream, Loader=_loader())
+
+
+def yaml_dump(data, stream=None, **kwargs):
+    """
+    Drop-in for `yaml.safe_dump`.
+    """
+    return yaml.dump(data, stream, Dumper=_dumper(), **kwargs)
+
+
+def json_loads(text):
+    if _fast["enabled"] and orjson is not None:
+        try:
+            return orjson.loads(text)
+        except orjson.JSONDecodeError:
+            # orjson is stricter (NaN, integers over 64 bits), let the standard parser decide.
+            pass
+    return json.loads(text)
+
+
+def json_load(stream):
+    return json_loads(stream.read())
+
+
+def json_dumps(data, indent=None, sort_keys=False):
+    """
+    Serializes to a JSON string. orjson is used for compact and 2-space indented output, the standard library
+    for anything orjson cannot produce or serialize.
+    """
+    if _fast["enabled"] and orjson is not None and indent in [None, 2]:
+        option = orjson.OPT_NON_STR_KEYS
+        if indent == 2:
+            option |= orjson.OPT_INDENT_2
+        if sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        try:
+            return orjson.dumps(data, option=option).decode("utf-8")
+        except TypeError:
+            pass
+    return json.dumps(data, indent=indent, sort_keys=sort_keys)
+
+
+def load_file(path):
+    """
+    Reads a JSON file, or a YAML file for any other extension.
+    """
+    with open(path, "rb" if path.endswith(".json") else "r") as f:
+        return json_loads(f.read()) if path.endswith(".json") else yaml_load(f)
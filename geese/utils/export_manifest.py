@@ -0,0 +1,267 @@
+import hashlib
+import os
+import tempfile
+import threading
+import time
+
+from geese.utils.codec import json_dumps, json_load
+from geese.utils.files import atomic_write
+
+chunk_size = 1024 * 1024
+# Temporary files are created readable by the owner only, give the final file the usual permissions.
+_umask = os.umask(0)
+os.umask(_umask)
+
+
+def _sha256(path):
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+class ManifestFile:
+    """
+    A file being written for the export manifest: written to a temporary file next to `path`, then moved into
+    place by `commit`, or dropped by `discard`. Usable as a context manager.
+    """
+
+    def __init__(self, manifest, path, source, mode="w", **kwargs):
+        self._manifest = manifest
+        self.path = path
+        self.source = source
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        fd, self.tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-", suffix=os.path.basename(path))
+        os.chmod(self.tmp_path, 0o666 & ~_umask)
+        self.file = os.fdopen(fd, mode, **kwargs)
+
+    def commit(self):
+        self.file.close()
+        return self._manifest.commit(self.tmp_path, self.path, *self.source)
+
+    def discard(self):
+        self.file.close()
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+    def __enter__(self):
+        return self.file
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.discard()
+
+
+class ExportManifest:
+    """
+    Keeps `.geese_export_manifest.json` in the export directory: the sha256, size and source (leader, namespace,
+    group, object type and group commit) of every file the export writes.
+
+    A file whose new content hashes the same as the manifest entry, and which is untouched on disk since, is
+    left as it is instead of being rewritten. Files of an exported group and object type that were not
+    written again are stale, and removed by `close(prune=True)`.
+
+    With an `ArtifactStore`, downloaded files (packs, lookups and certificates) are stored once per sha256 and
+    hard linked into the group directories, and a file whose listing matches one already stored for another
+    group is linked instead of downloaded.
+
+    Until `configure` is called (import, simulate, validate) files are simply moved into place.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.directory = None
+        self._previous = {}
+        self._files = {}
+        self._scopes = set()
+        self._leaders = {}
+        self._versions = {}
+        self.counts = {}
+        self.store = None
+        self._stored = {}
+
+    def configure(self, directory, manifest_file, sources=None, store=None):
+        """
+        :param directory: Export directory
+        :param manifest_file: Manifest file name in the export directory
+        :param sources: Exported sources, for the leader and group commit of each file
+        :param store: Optional `ArtifactStore` for the downloaded files
+        """
+        self.directory = directory
+        self._manifest_file = os.path.join(directory, manifest_file)
+        self._previous = {}
+        self._files = {}
+        self._scopes = set()
+        self.counts = {"written": 0, "unchanged": 0, "kept": 0, "stale": 0, "removed": 0, "reused_bytes": {},
+                       "gc_blobs": 0, "gc_bytes": 0}
+        self.store = store
+        self._stored = {}
+        self._leaders = {s.get("namespace", None): s["url"] for s in sources or []}
+        self._versions = {(s.get("namespace", None), g): v for s in sources or []
+                          for g, v in s.get("group_versions", {}).items()}
+        if os.path.exists(self._manifest_file):
+            try:
+                with open(self._manifest_file, "r") as f:
+                    self._previous = json_load(f).get("files", {})
+            except (OSError, ValueError, AttributeError):
+                self._previous = {}
+        for entry in self._previous.values():
+            self._index(entry)
+
+    @staticmethod
+    def _meta_key(meta):
+        # Only listings with a version are trusted to identify the same file in another group.
+        if meta is None or meta.get("version", None) is None:
+            return None
+        return json_dumps(meta, sort_keys=True)
+
+    def _index(self, entry):
+        key = self._meta_key(entry.get("meta", None))
+        if self.store is not None and key is not None:
+            with self._lock:
+                self._stored[key] = (entry["sha256"], entry["size"])
+
+    def _key(self, path):
+        return os.path.relpath(path, self.directory).replace(os.sep, "/")
+
+    def open(self, path, namespace=None, group=None, obj_type=None, kind="files", mode="w", **kwargs):
+        """
+        Opens `path` for writing through a temporary file, see `ManifestFile`.
+        """
+        return ManifestFile(self, path, (namespace, group, obj_type, kind), mode=mode, **kwargs)
+
+    def _record(self, path, entry, namespace, group, obj_type, kind, counter):
+        entry = dict(entry, leader=self._leaders.get(namespace, None), namespace=namespace, group=group,
+                     type=obj_type, kind=kind, commit=self._versions.get((namespace, group), None))
+        with self._lock:
+            self._files[self._key(path)] = entry
+            self.counts[counter] += 1
+        return entry
+
+    def _untouched(self, path, entry):
+        # The file on disk is still the one the entry was recorded for.
+        if not os.path.exists(path):
+            return False
+        stat = os.stat(path)
+        return stat.st_size == entry.get("size", None) and stat.st_mtime_ns == entry.get("mtime_ns", None)
+
+    def reuse(self, path, namespace=None, group=None, obj_type=None, kind="files", meta=None):
+        """
+        Keeps `path` from the previous export, instead of downloading it again, when its entry was recorded with
+        the same `meta` (what the leader's listing says about the file) and the file is untouched since.
+
+        :return: The manifest entry, or None when the file has to be exported again
+        """
+        if self.directory is None or meta is None:
+            return None
+        last = self._previous.get(self._key(path), None)
+        if last is not None and last.get("meta", None) == meta and self._untouched(path, last) \
+                and (self.store is None or self.store.linked(last["sha256"], path)
+                     or self.store.adopt(path, last["sha256"])):
+            self._reused(obj_type, last["size"])
+            return self._record(path, dict(last, mtime_ns=os.stat(path).st_mtime_ns), namespace, group, obj_type,
+                                kind, "unchanged")
+        stored = self._stored.get(self._meta_key(meta), None) if self.store is not None else None
+        if stored is None or not self.store.has(*stored):
+            return None
+        # The same file was already downloaded for another group.
+        self.store.link(stored[0], path)
+        self._reused(obj_type, stored[1])
+        entry = {"sha256": stored[0], "size": stored[1], "mtime_ns": os.stat(path).st_mtime_ns, "meta": meta}
+        return self._record(path, entry, namespace, group, obj_type, kind, "written")
+
+    def keep(self, path, namespace=None, group=None, obj_type=None, kind="files"):
+        """
+        Keeps `path` from the previous export after its download failed in this run, so `close(prune=True)`
+        does not remove the last good copy of an object the leader still lists.
+
+        :return: The previous manifest entry, or None when there is no previous copy of `path`
+        """
+        if self.directory is None:
+            return None
+        last = self._previous.get(self._key(path), None)
+        if last is None or not os.path.exists(path):
+            return None
+        return self._record(path, last, namespace, group, obj_type, kind, "kept")
+
+    def _reused(self, obj_type, size):
+        with self._lock:
+            reused = self.counts["reused_bytes"]
+            reused[obj_type] = reused.get(obj_type, 0) + size
+
+    def commit(self, tmp_path, path, namespace=None, group=None, obj_type=None, kind="files", sha256=None,
+               meta=None):
+        """
+        Moves the finished temporary file `tmp_path` to `path`, unless `path` already holds the same content.
+
+        :param sha256: Digest of `tmp_path` when already known
+        :param meta: Listing details of the file, checked by `reuse` on the next export
+        :return: True when `path` was written
+        """
+        if self.directory is None:
+            os.replace(tmp_path, path)
+            return True
+        sha256 = sha256 if sha256 is not None else _sha256(tmp_path)
+        size = os.path.getsize(tmp_path)
+        store = self.store if kind == "files" else None
+        last = self._previous.get(self._key(path), {})
+        unchanged = last.get("sha256", None) == sha256 and last.get("size", None) == size \
+            and self._untouched(path, last) and (store is None or store.linked(sha256, path))
+        if unchanged:
+            os.remove(tmp_path)
+        elif store is not None:
+            store.add(tmp_path, path, sha256)
+        else:
+            os.replace(tmp_path, path)
+        entry = {"sha256": sha256, "size": size, "mtime_ns": os.stat(path).st_mtime_ns}
+        if meta is not None:
+            entry["meta"] = meta
+        self._index(entry)
+        self._record(path, entry, namespace, group, obj_type, kind, "unchanged" if unchanged else "written")
+        return not unchanged
+
+    def exported(self, namespace=None, group=None, obj_type=None, kind="files"):
+        """
+        Marks a group and object type as exported in this run: its files that are not written again are stale.
+        """
+        with self._lock:
+            self._scopes.add((kind, namespace, group, obj_type))
+
+    def close(self, prune=False):
+        """
+        Saves the manifest, removing the stale files when `prune` is set.
+
+        :return: Counts of written, unchanged, kept (after a failed download), stale and removed files, the bytes
+            of the files kept by `reuse` by object type, and the blobs (and their bytes) removed from the
+            artifact store
+        """
+        for key, entry in self._previous.items():
+            if key in self._files:
+                continue
+            path = os.path.join(self.directory, key)
+            scope = (entry.get("kind", None), entry.get("namespace", None), entry.get("group", None),
+                     entry.get("type", None))
+            if scope not in self._scopes or not os.path.exists(path):
+                if os.path.exists(path):
+                    # Not part of this export (other sources, groups or object types): keep tracking it.
+                    self._files[key] = entry
+                continue
+            if prune:
+                os.remove(path)
+                self.counts["removed"] += 1
+            else:
+                self._files[key] = entry
+                self.counts["stale"] += 1
+        if self.store is not None:
+            self.counts["gc_blobs"], self.counts["gc_bytes"] = self.store.gc()
+        atomic_write(self._manifest_file, json_dumps({"updated": int(time.time()), "files": self._files},
+                                                     indent=2, sort_keys=True).encode("utf-8"))
+        self.directory = None
+        return self.counts
+
+
+export_manifest = ExportManifest()
@@ -0,0 +1,306 @@
+import csv
+import hashlib
+import json
+import os
+import pickle
+import shutil
+import tempfile
+
+from geese.constants.configs import colors, export_cmd
+from geese.utils.codec import json_dumps, yaml_dump
+from geese.utils.export_manifest import export_manifest
+
+lookup_header = ["type", "id", "name", "parent", "description", "worker_group", "namespace"]
+id_fields = ["id", "keyId", "tenantId"]
+
+
+def build_lookup_item(type, data, wg="default", ns="no_namespace"):
+    # Should have 3 columns. type,id,name,description
+    if type in ["system_auth"]:
+        return []
+    default_id = "id_not_found"
+    default_name = "name_not_found"
+    default_description = "description_not_found"
+    default_parent = "cribl"
+    item = {"type": type, "id": default_id, "name": default_name, "parent": default_parent, "description": default_description, "worker_group": wg, "namespace": ns}
+    if type in ["routes"]:
+        item = [{"type": type, "id": data.get("id", default_id), "name": data.get("name", default_name), "parent": default_parent, "description": data.get("description", default_description), "worker_group": wg, "namespace": ns}]
+        for rts in data.get("routes", []):
+            item.append({"type": f"{type}_route", "id": rts.get("id", default_id), "name": rts.get("name", default_name), "parent": data.get("id", default_id), "description": data.get("description", default_description), "worker_group": wg, "namespace": ns})
+    else:
+        item["id"] = data.get("id", default_id)
+        item["name"] = data.get("name", default_name)
+        item["description"] = data.get("description", default_description)
+        if type in ["pipelines"]:
+            item["name"] = item["id"]
+            item = [item]
+            for i, f in enumerate(data.get('conf', {}).get('functions', [])):
+                item.append({"type": f"{type}_function", "id": f'{i}_{f.get("id", default_id)}', "name": f.get("name", default_name), "parent": item[0].get("id", default_id), "description": f.get("description", default_description), "worker_group": wg, "namespace": ns})
+    return item
+
+
+def _yaml_fragment(keys, value, skip):
+    # Dumps `value` nested under `keys` and drops the first `skip` key lines, so fragments written one after
+    # the other give the same document as dumping the whole tree at once.
+    for key in reversed(keys):
+        value = {key: value}
+    return yaml_dump(value).split("\n", skip)[skip]
+
+
+def _json_indent(text, level):
+    return text.replace("\n", "\n" + "    " * level)
+
+
+class ExportWriter:
+    """
+    Writes exported objects batch by batch instead of from one tree of every source, group and type.
+
+    Each (namespace, group, object type) batch is spooled to disk as it arrives and its id lookup rows are
+    written straight away. `close` assembles the export files one object type at a time, in the layout and
+    format the export arguments ask for, so peak memory stays at about one batch.
+
+    With --dedupe, items are held back until every group is exported: an item that is identical in several
+    groups is written once, to the `_shared` group with a `worker_groups` list, and the others to their group.
+    """
+
+    def __init__(self, args, display):
+        self.args = args
+        self._display = display
+        self._files = {}
+        self._seen = {}
+        self._lookup_file = None
+        self._lookup = None
+        os.makedirs(args.directory, exist_ok=True)
+        self._spool = tempfile.mkdtemp(dir=args.directory, prefix=".geese-spool-")
+        self._held = None
+        self._held_file = None
+        if getattr(args, "dedupe", False) and not args.lookup_only:
+            self._held = {}
+            self._held_file = open(os.path.join(self._spool, "held.pickle"), "w+b")
+        if args.id_lookup:
+            self._lookup_file = export_manifest.open(os.path.join(args.directory, args.id_lookup), kind="id_lookup",
+                                                     newline='')
+            self._lookup = csv.DictWriter(self._lookup_file.file, fieldnames=lookup_header)
+            self._lookup.writeheader()
+
+    def _source(self, namespace, group, obj_type):
+        # (namespace, group, object type) of the export file holding a batch, as recorded in the export manifest.
+        if self.args.split:
+            return namespace, group, obj_type
+        return (namespace, None, None) if self.args.use_namespace else (namespace, group, None)
+
+    def _target(self, namespace, group, obj_type):
+        """
+        Returns (export file, its record, tree keys of the batch) for a batch, registering the file on first use.
+        """
+        args = self.args
+        if args.split and args.use_namespace:
+            path = os.path.join(args.directory, namespace, group, "configs", f"{obj_type}.{args.file}")
+            header, order, keys = {"namespace": namespace, "group": group, "object_type": obj_type}, \
+                ["namespace", "group", "object_type", "data"], []
+        elif args.split:
+            path = os.path.join(args.directory, group, "configs", f"{obj_type}.{args.file}")
+            header, order, keys = {"group": group, "object_type": obj_type}, ["group", "object_type", "data"], []
+        elif args.use_namespace:
+            path = os.path.join(args.directory, namespace, "configs", args.file)
+            header, order, keys = {"namespace": namespace}, ["data", "namespace"], [group, obj_type]
+        else:
+            path = os.path.join(args.directory, group, "configs", args.file)
+            header, order, keys = {"group": group}, ["data", "group"], [obj_type]
+        if path not in self._files:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            self._files[path] = {"header": header, "order": order, "depth": len(keys), "tree": {},
+                                 "source": self._source(namespace, group, obj_type)}
+        return path, self._files[path], keys
+
+    def add(self, namespace, group, obj_type, items):
+        """
+        Takes the exported items of one object type in one group of a source.
+        """
+        if self.args.lookup_only:
+            self._add_lookup_rows(namespace, group, obj_type, items)
+            return
+        export_manifest.exported(*self._source(namespace, group, obj_type), kind="configs")
+        self._add_lookup_rows(namespace, group, obj_type, items)
+        if self._held is not None:
+            export_manifest.exported(*self._source(namespace, export_cmd["dedupe_group"], obj_type), kind="configs")
+            items = self._hold(namespace, group, obj_type, items)
+        self._spool_items(namespace, group, obj_type, items)
+
+    def _hold(self, namespace, group, obj_type, items):
+        """
+        Spools each distinct definition of an item once, with the groups it was exported from.
+        Returns the items that cannot be held (no id, or the same id twice in the group).
+        """
+        kept = []
+        held = self._held.setdefault((namespace, obj_type), {})
+        for item in items:
+            item_id = item.get("id", None) if isinstance(item, dict) else None
+            if item_id is None:
+                kept.append(item)
+                continue
+            digest = hashlib.sha256(json_dumps(item, sort_keys=True).encode("utf-8")).hexdigest()
+            definitions = held.setdefault(f"{item_id}", {})
+            if any(group in d["groups"] for d in definitions.values()):
+                kept.append(item)
+                continue
+            if digest not in definitions:
+                self._held_file.seek(0, os.SEEK_END)
+                definitions[digest] = {"offset": self._held_file.tell(), "groups": []}
+                pickle.dump(item, self._held_file)
+            definitions[digest]["groups"].append(group)
+        return kept
+
+    def _release(self):
+        """
+        Spools the held items: for each id, the definition found in the most groups goes to the shared group
+        when there are several of them, every other definition to its own groups.
+        """
+        for (namespace, obj_type), held in self._held.items():
+            shared = []
+            single = {}
+            for definitions in held.values():
+                best = max(definitions.values(), key=lambda d: len(d["groups"]))
+                for definition in definitions.values():
+                    self._held_file.seek(definition["offset"])
+                    item = pickle.load(self._held_file)
+                    if definition is best and len(definition["groups"]) > 1:
+                        item["worker_groups"] = definition["groups"]
+                        shared.append(item)
+                        continue
+                    for group in definition["groups"]:
+                        single.setdefault(group, []).append(item)
+            for group, items in single.items():
+                self._spool_items(namespace, group, obj_type, items)
+            if len(shared) > 0:
+                self._spool_items(namespace, export_cmd["dedupe_group"], obj_type, shared)
+        self._held = None
+
+    def _spool_items(self, namespace, group, obj_type, items):
+        if len(items) == 0:
+            if not self.args.split:
+                # Groups without any items still get their (empty) export file.
+                path, record, keys = self._target(namespace, group, obj_type)
+                if len(keys) == 2:
+                    record["tree"].setdefault(group, {})
+            return
+        path, record, keys = self._target(namespace, group, obj_type)
+        node = record["tree"]
+        for key in keys[:-1]:
+            node = node.setdefault(key, {})
+        if len(keys) == 0:
+            spool = record.setdefault("spool", os.path.join(self._spool, f"{len(self._seen)}.pickle"))
+        else:
+            spool = node.setdefault(keys[-1], os.path.join(self._spool, f"{len(self._seen)}.pickle"))
+        seen = self._seen.setdefault(spool, set())
+        with open(spool, "ab") as f:
+            for item in items:
+                id_id = None
+                for my_id in id_fields:
+                    if my_id in item:
+                        id_id = item[my_id]
+                if id_id is not None:
+                    key = id_id if id_id not in seen else f"{namespace}-{id_id}"
+                    seen.add(key)
+                    pickle.dump((key, item, False), f)
+                else:
+                    self._display(f"Could not find ID field in item: {item}", colors.get("warning", "yellow"))
+                    pickle.dump((f"{namespace}-unknown_id", item, True), f)
+
+    def _add_lookup_rows(self, namespace, group, obj_type, items):
+        if self._lookup is not None:
+            ns = namespace if self.args.use_namespace else "no_namespace_found"
+            for item in items:
+                r = build_lookup_item(obj_type, item, wg=group, ns=ns)
+                self._lookup.writerows(r if type(r) is list else [r])
+
+    @staticmethod
+    def _load(spool):
+        items = {}
+        with open(spool, "rb") as f:
+            while True:
+                try:
+                    key, item, is_list = pickle.load(f)
+                except EOFError:
+                    return items
+                if is_list:
+                    items.setdefault(key, []).append(item)
+                else:
+                    items[key] = item
+
+    def _write_yaml(self, f, record):
+        tree = record["tree"]
+        if record["depth"] == 0:
+            f.write(_yaml_fragment(["data"], self._load(record["spool"]), 0))
+        elif len(tree) == 0:
+            f.write(yaml_dump({"data": {}}))
+        else:
+            f.write("data:\n")
+            for k in sorted(tree):
+                if record["depth"] == 1:
+                    f.write(_yaml_fragment(["data", k], self._load(tree[k]), 1))
+                    continue
+                if len(tree[k]) == 0:
+                    f.write(_yaml_fragment(["data", k], {}, 1))
+                for i, t in enumerate(sorted(tree[k])):
+                    f.write(_yaml_fragment(["data", k, t], self._load(tree[k][t]), 1 if i == 0 else 2))
+        # The header keys all sort after "data".
+        f.write(yaml_dump(record["header"]))
+
+    def _write_json_tree(self, f, node, depth, level):
+        if depth == 0:
+            f.write(_json_indent(json.dumps(self._load(node), indent=4), level))
+            return
+        if len(node) == 0:
+            f.write("{}")
+            return
+        f.write("{")
+        for i, (k, child) in enumerate(node.items()):
+            f.write(f'{"," if i > 0 else ""}\n{"    " * (level + 1)}{json.dumps(k)}: ')
+            self._write_json_tree(f, child, depth - 1, level + 1)
+        f.write(f'\n{"    " * level}}}')
+
+    def _write_json(self, f, record):
+        f.write("{")
+        for i, key in enumerate(record["order"]):
+            f.write(f'{"," if i > 0 else ""}\n    {json.dumps(key)}: ')
+            if key == "data":
+                node = record["spool"] if record["depth"] == 0 else record["tree"]
+                self._write_json_tree(f, node, record["depth"], 1)
+            else:
+                f.write(json.dumps(record["header"][key]))
+        f.write("\n}")
+
+    def close(self):
+        """
+        Writes the export files and finishes the id lookup file.
+        """
+        try:
+            if self._held is not None:
+                self._release()
+            if not self.args.lookup_only:
+                for path, record in self._files.items():
+                    with export_manifest.open(path, *record["source"], kind="configs") as of:
+                        self._display(f"Writing Exported File {os.path.basename(path)}", colors.get("info", "blue"))
+                        if path.endswith(".json"):
+                            self._write_json(of, record)
+                        else:
+                            self._write_yaml(of, record)
+            if self._lookup_file is not None:
+                self._display(f"Saving Lookup IDs to {self.args.id_lookup}", colors.get("info", "blue"))
+                self._lookup_file.commit()
+                self._lookup_file = None
+        finally:
+            self.discard()
+
+    def discard(self):
+        """
+        Removes the spooled batches, e.g. after a failed export.
+        """
+        if self._lookup_file is not None:
+            self._lookup_file.discard()
+            self._lookup_file = None
+        if self._held_file is not None:
+            self._held_file.close()
+            self._held_file = None
+        shutil.rmtree(self._spool, ignore_errors=True)
@@ -0,0 +1,214 @@
+import base64
+import hashlib
+import gzip
+import os
+import re
+import tempfile
+
+import requests
+
+from geese.utils.archive import archive_files
+from geese.utils.codec import json_dumps, json_load
+
+
+def atomic_write(path, data, mode=None):
+    """
+    Writes bytes to `path` through a temporary file in the same directory and an atomic rename,
+    so readers never see a partially written file.
+
+    :param path: Destination file
+    :param data: Bytes to write
+    :param mode: Optional permission bits for the final file (e.g. 0o600)
+    :return: Number of bytes written
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-", suffix=os.path.basename(path))
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        if mode is not None:
+            os.chmod(tmp_path, mode)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return len(data)
+
+
+default_chunk_size = 1024 * 1024
+
+
+def _read_json(path):
+    try:
+        with open(path, "r") as f:
+            return json_load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _content_range(response):
+    """
+    Returns (start, total) from a Content-Range header, total is None when the server does not know it.
+    """
+    match = re.match(r"bytes (\d+)-\d+/(\d+|\*)", response.headers.get("Content-Range", ""))
+    if match is None:
+        return None, None
+    return int(match.group(1)), None if match.group(2) == "*" else int(match.group(2))
+
+
+def _content_length(response):
+    # A content-encoded body is decoded while streaming, so its Content-Length is not the file size.
+    if response.headers.get("Content-Encoding", "identity") != "identity" or "Content-Length" not in response.headers:
+        return None
+    return int(response.headers["Content-Length"])
+
+
+def _expected_digest(response):
+    for part in response.headers.get("Digest", "").split(","):
+        algorithm, _, value = part.strip().partition("=")
+        if algorithm.lower() == "sha-256" and value:
+            try:
+                return base64.b64decode(value).hex()
+            except ValueError:
+                return None
+    return None
+
+
+def download_to_file(response, path, resume=None, attempts=3, chunk_size=default_chunk_size, commit=None):
+    """
+    Streams a download to `path` through `<path>.part` and an atomic rename, resuming with a Range request
+    when the connection drops mid-transfer.
+
+    A partial file left by an earlier run is resumed only when the server sent an ETag or Last-Modified
+    validator, which is then passed as If-Range so a changed file is fetched in full. The final file must
+    match the advertised size, and the sha-256 of a Digest header when one is sent.
+
+    :param response: A streamed response for the whole file
+    :param path: Destination file
+    :param resume: Callable taking extra request headers and returning a new streamed response,
+        None to disable resuming
+    :param attempts: Resumes allowed after dropped connections
+    :param chunk_size: Bytes read per chunk
+    :param commit: Callable taking (verified download, path, sha256) that moves the download to `path`,
+        os.replace by default
+    :return: Tuple of (bytes written, sha256 hex digest)
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    part_path = f"{path}.part"
+    meta_path = f"{part_path}.json"
+    validator = response.headers.get("ETag", None) or response.headers.get("Last-Modified", None)
+    total = _content_length(response)
+    digest = _expected_digest(response)
+    offset = 0
+    if (resume is not None and validator is not None and os.path.exists(part_path)
+            and _read_json(meta_path).get("validator", None) == validator):
+        offset = os.path.getsize(part_path)
+    else:
+        if os.path.exists(part_path):
+            os.remove(part_path)
+        atomic_write(meta_path, json_dumps({"validator": validator, "total": total}).encode("utf-8"))
+    current = response if offset == 0 else None
+    if current is None:
+        response.close()
+    failures = 0
+    while True:
+        try:
+            if current is None:
+                headers = {"Range": f"bytes={offset}-"} if offset > 0 else {}
+                if offset > 0 and validator is not None:
+                    headers["If-Range"] = validator
+                current = resume(headers)
+                start, range_total = _content_range(current)
+                if current.status_code == 206 and start == offset:
+                    total = range_total if range_total is not None else total
+                elif current.status_code == 200:
+                    # The server ignored the range, or the file changed: start over.
+                    offset = 0
+                    total = _content_length(current)
+                    digest = _expected_digest(current)
+                else:
+                    raise requests.exceptions.HTTPError(
+                        f"Unexpected status {current.status_code} resuming {path} at byte {offset}", response=current)
+            with open(part_path, "ab" if offset > 0 else "wb") as f:
+                for chunk in current.iter_content(chunk_size=chunk_size):
+                    if chunk:
+                        f.write(chunk)
+                        offset += len(chunk)
+            if total is not None and offset < total:
+                raise requests.exceptions.ChunkedEncodingError(f"Connection closed at byte {offset} of {total}")
+            break
+        except (requests.exceptions.ChunkedEncodingError, requests.exceptions.ConnectionError,
+                requests.exceptions.Timeout):
+            failures += 1
+            if resume is None or failures > attempts:
+                raise
+            offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        finally:
+            if current is not None:
+                current.close()
+            current = None
+    sha256 = hashlib.sha256()
+    with open(part_path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            sha256.update(chunk)
+    size = os.path.getsize(part_path)
+    if (total is not None and size != total) or (digest is not None and sha256.hexdigest() != digest):
+        os.remove(part_path)
+        raise IOError(f"Download of {path} failed verification: got {size} bytes (expected {total}), "
+                      f"sha256 {sha256.hexdigest()} (expected {digest})")
+    if commit is not None:
+        commit(part_path, path, sha256.hexdigest())
+    else:
+        os.replace(part_path, path)
+    if os.path.exists(meta_path):
+        os.remove(meta_path)
+    return size, sha256.hexdigest()
+
+
+def _scratch_dir(path):
+    # Files read from an export archive have no directory on disk, use the system temp directory.
+    directory = os.path.dirname(os.path.abspath(path))
+    return directory if os.path.isdir(directory) else None
+
+
+def gzip_file(path, chunk_size=default_chunk_size):
+    """
+    Gzip-compresses `path` chunk by chunk into a temporary file next to it (or in the temp directory for archived files).
+
+    :param path: File to compress
+    :param chunk_size: Bytes read per chunk
+    :return: Path of the compressed temporary file, to be removed by the caller
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=_scratch_dir(path), prefix=".tmp-", suffix=f"{os.path.basename(path)}.gz")
+    try:
+        with archive_files.open(path) as src, os.fdopen(fd, "wb") as raw, gzip.GzipFile(fileobj=raw, mode="wb") as dst:
+            for chunk in iter(lambda: src.read(chunk_size), b""):
+                dst.write(chunk)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return tmp_path
+
+
+def gunzip_file(path, chunk_size=default_chunk_size):
+    """
+    Decompresses the gzip file `path` chunk by chunk into a temporary file next to it (or in the temp directory for archived files).
+
+    :param path: File to decompress
+    :param chunk_size: Bytes read per chunk
+    :return: Path of the decompressed temporary file, to be removed by the caller
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=_scratch_dir(path), prefix=".tmp-", suffix=os.path.basename(path)[:-3])
+    try:
+        with archive_files.open(path) as raw, gzip.GzipFile(fileobj=raw, mode="rb") as src, \
+                os.fdopen(fd, "wb") as dst:
+            for chunk in iter(lambda: src.read(chunk_size), b""):
+                dst.write(chunk)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return tmp_path
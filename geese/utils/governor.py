@@ -0,0 +1,145 @@
+import threading
+import time
+import weakref
+from urllib.parse import urlsplit
+
+# Responses telling us the leader is overloaded.
+throttle_statuses = [429, 503]
+
+default_concurrency = {
+    "enabled": True,
+    "initial": 8,
+    "min_in_flight": 1,
+    "max_in_flight": 32,
+    "latency_factor": 3.0,
+    "caps": {}
+}
+
+_governors = {}
+_lock = threading.Lock()
+
+
+def _leader_key(url):
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}".lower()
+
+
+class Governor:
+    """
+    AIMD limit on the requests in flight against one leader.
+
+    Each success grows the limit by about one request per round trip. A throttling response, a failed
+    request or a latency spike cuts it in half, at most once per round trip. Object types listed in
+    `caps` never get more than their cap in flight, whatever the overall limit.
+    """
+
+    def __init__(self, enabled=True, initial=None, min_in_flight=None, max_in_flight=None, latency_factor=None,
+                 caps=None):
+        self.enabled = bool(enabled)
+        self.min_limit = float(min_in_flight if min_in_flight is not None else default_concurrency["min_in_flight"])
+        self.max_limit = float(max_in_flight if max_in_flight is not None else default_concurrency["max_in_flight"])
+        self.limit = float(initial if initial is not None else default_concurrency["initial"])
+        self.limit = max(self.min_limit, min(self.limit, self.max_limit))
+        self.latency_factor = float(latency_factor if latency_factor is not None
+                                    else default_concurrency["latency_factor"])
+        self.caps = dict(caps or {})
+        self.in_flight = 0
+        self._kinds = {}
+        self._latency = {}
+        self._last_decrease = 0.0
+        self._condition = threading.Condition()
+        self.stats = {"peak_limit": int(self.limit), "decreases": 0, "throttled": 0}
+
+    def _has_room(self, kind):
+        if self.in_flight >= int(self.limit):
+            return False
+        cap = self.caps.get(kind, None)
+        return cap is None or self._kinds.get(kind, 0) < cap
+
+    def acquire(self, kind=None):
+        if not self.enabled:
+            return
+        with self._condition:
+            self._condition.wait_for(lambda: self._has_room(kind))
+            self.in_flight += 1
+            self._kinds[kind] = self._kinds.get(kind, 0) + 1
+
+    def release(self, kind=None, latency=0.0, status=None, profile=None, hold=False):
+        """
+        Frees the slot taken by `acquire` and adjusts the limit.
+
+        :param kind: Object type of the request
+        :param latency: Seconds until the response headers arrived
+        :param status: Response status, None when the request failed
+        :param profile: Key of the latency baseline the request is compared to, defaults to `kind`
+        :param hold: Keep the slot until `free` is called, for a streamed response whose body is still to be read
+        """
+        if not self.enabled:
+            return
+        profile = profile if profile is not None else kind
+        with self._condition:
+            if not hold:
+                self._free(kind)
+            count, average = self._latency.get(profile, (0, latency))
+            spike = count >= 5 and latency > average * self.latency_factor
+            now = time.monotonic()
+            if status is None or status in throttle_statuses or spike:
+                if status in throttle_statuses:
+                    self.stats["throttled"] += 1
+                # One decrease per round trip, the other requests in flight saw the same congestion.
+                if now - self._last_decrease >= average:
+                    self.limit = max(self.min_limit, self.limit / 2)
+                    self._last_decrease = now
+                    self.stats["decreases"] += 1
+            else:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+                self.stats["peak_limit"] = max(self.stats["peak_limit"], int(self.limit))
+                self._latency[profile] = (count + 1, average + (latency - average) * 0.2)
+            self._condition.notify_all()
+
+    def _free(self, kind):
+        self.in_flight -= 1
+        self._kinds[kind] -= 1
+
+    def free(self, kind=None):
+        """
+        Frees a slot kept by `release(hold=True)`.
+        """
+        if not self.enabled:
+            return
+        with self._condition:
+            self._free(kind)
+            self._condition.notify_all()
+
+
+def get_governor(leader, url):
+    """
+    Returns the governor of the leader serving `url`, created from the leader's `concurrency` config.
+    """
+    key = _leader_key(url)
+    with _lock:
+        if key not in _governors:
+            conf = leader.get("concurrency", None) or {}
+            _governors[key] = Governor(**{k: v for k, v in conf.items() if k in default_concurrency})
+        return _governors[key]
+
+
+def free_on_close(response, governor, kind=None):
+    """
+    Frees the slot kept for a streamed `response` once it is closed, or garbage collected without being closed.
+    """
+    free = weakref.finalize(response, governor.free, kind)
+    close = response.close
+
+    def close_and_free():
+        try:
+            close()
+        finally:
+            free()
+
+    response.close = close_and_free
+
+
+def get_stats():
+    with _lock:
+        return {k: dict(v.stats, limit=int(v.limit)) for k, v in _governors.items() if v.enabled}
@@ -0,0 +1,129 @@
+import json
+import threading
+from urllib.parse import unquote, urlsplit
+
+
+class ListingCache:
+    """
+    Run-scoped cache of listing responses keyed by (leader, group, url).
+
+    Concurrent requests for the same listing are coalesced into a single GET. A successful write of a single
+    item (POST to a collection, PATCH or DELETE of `collection/<id>`) is applied to the cached listing of that
+    collection, so an import lists each object type once per group. Any other write drops the cached listings
+    of the collection it was made against; writes the leader refused leave them as they are.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self._entries = {}
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "coalesced": 0, "invalidated": 0}
+
+    def fetch(self, key, loader):
+        while True:
+            with self._lock:
+                if key in self._entries:
+                    self.stats["hits"] += 1
+                    return self._entries[key]
+                pending = self._in_flight.get(key, None)
+                if pending is None:
+                    pending = threading.Event()
+                    self._in_flight[key] = pending
+                    break
+            pending.wait()
+            with self._lock:
+                if key in self._entries:
+                    self.stats["coalesced"] += 1
+                    return self._entries[key]
+            # The request we waited on failed or was invalidated, try again ourselves.
+        try:
+            response = loader()
+            with self._lock:
+                self.stats["misses"] += 1
+                if response is not None and response.status_code == 200 and self._in_flight.get(key) is pending:
+                    self._entries[key] = response
+            return response
+        finally:
+            with self._lock:
+                if self._in_flight.get(key) is pending:
+                    del self._in_flight[key]
+            pending.set()
+
+    @staticmethod
+    def _collection(method, path):
+        # Collection listing affected by a write, and the id of the single item written when there is one.
+        if method == "POST":
+            return path, None
+        collection, _, item_id = path.rpartition("/")
+        return collection, unquote(item_id)
+
+    @staticmethod
+    def _written_item(method, data, response):
+        if method == "DELETE":
+            return None
+        try:
+            items = response.json().get("items", [])
+            if len(items) == 1 and isinstance(items[0], dict) and "id" in items[0]:
+                return items[0]
+        except (ValueError, AttributeError):
+            pass
+        try:
+            item = json.loads(data) if isinstance(data, (str, bytes)) else None
+        except ValueError:
+            item = None
+        return item if isinstance(item, dict) and "id" in item else None
+
+    @staticmethod
+    def _patch(response, method, item_id, item):
+        listing = response.json()
+        items = listing.get("items", None)
+        if not isinstance(items, list):
+            return False
+        item_id = item["id"] if item is not None else item_id
+        kept = [i for i in items if not (isinstance(i, dict) and i.get("id", None) == item_id)]
+        if method != "DELETE":
+            kept.append(item)
+        listing["items"] = kept
+        if "count" in listing:
+            listing["count"] = len(kept)
+        response._content = json.dumps(listing).encode("utf-8")
+        return True
+
+    def written(self, leader, url, method, data=None, response=None):
+        """
+        Brings the cached listings in line with a write made to `url`.
+
+        :param response: Response of the write, None when it raised
+        """
+        if response is not None and response.status_code >= 300:
+            return
+        path = urlsplit(url).path.rstrip("/")
+        collection, item_id = self._collection(method, path)
+        item = self._written_item(method, data, response) if response is not None else None
+        patchable = response is not None and method in ["POST", "PATCH", "DELETE"] \
+            and (item is not None or (method == "DELETE" and item_id))
+        # Uploads and other writes may address the collection itself or one of its items.
+        paths = [collection] if patchable else [collection, path]
+        with self._lock:
+            for key in list(self._entries.keys()):
+                if key[0] != leader or urlsplit(key[2]).path.rstrip("/") not in paths:
+                    continue
+                try:
+                    if patchable and self._patch(self._entries[key], method, item_id, item):
+                        continue
+                except (ValueError, AttributeError):
+                    pass
+                del self._entries[key]
+                self.stats["invalidated"] += 1
+            for key in list(self._in_flight.keys()):
+                if key[0] == leader and urlsplit(key[2]).path.rstrip("/") in paths:
+                    # Results of requests already in flight may predate the write, do not store them.
+                    del self._in_flight[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+listing_cache = ListingCache()
@@ -1,10 +1,10 @@
 import glob
-import json
 import sys
 import os
 import geese.constants.exit_codes as ec
-import yaml
 from geese.constants.configs import colors
+from geese.utils.archive import archive_files
+from geese.utils.codec import json_load, load_file, yaml_load
 
 _exclude_object = "exclude"
 _include_object = "include"
@@ -54,19 +54,18 @@ def validate(object_type, cribl_object, filter_set):
 
 
 def load_tuning(file):
-    with open(file, "r") as of:
-        if file.endswith(".json"):
-            file_data = json.load(of)
-        else:
-            file_data = yaml.safe_load(of)
-    return file_data
+    return load_file(file)
 
 def validate_args(self, args, cmd=None):
     if "directory" in args and cmd in ["import", "validate", "simulate"]:
         if not args.file.endswith(".yaml") and not args.file.endswith(".json"):
             self._display(f"Import file: {args.file} is not a YAML or JSON file.", colors.get("error"))
             sys.exit(ec.FILE_NOT_FOUND)
-        if not os.path.exists(args.directory):
+        if args.archive:
+            if not os.path.exists(args.archive):
+                self._display(f"Archive does not exist: {args.archive}", colors.get("error", "red"))
+                sys.exit(ec.FILE_NOT_FOUND)
+        elif not os.path.exists(args.directory):
             self._display(f"Directory does not exist: {args.directory}", colors.get("error", "red"))
             sys.exit(ec.LOCATION_NOT_FOUND)
     if "save_file" in args and not args.save_file.endswith(".yaml") and not args.save_file.endswith(".json"):
@@ -88,6 +87,12 @@ def validate_args(self, args, cmd=None):
                                                      a in knowledge_objects and validate_knowledge(
                                                          a, self.tuning_object)]
 
+def results_file(args):
+    # Results are saved next to the archive when configurations are read from one.
+    directory = os.path.dirname(os.path.abspath(args.archive)) if getattr(args, "archive", None) else args.directory
+    return os.path.join(directory, f"{args.save_file}")
+
+
 def load_configurations(self, args, ko):
     all_objects = {}
     base_dir = args.directory
@@ -96,20 +101,26 @@ def load_configurations(self, args, ko):
         glob_path = os.path.join(base_dir, "**", "configs", f"*{args.file}")
     else:
         glob_path = os.path.join(base_dir, "**", "configs", f"{args.file}")
-    files = glob.glob(glob_path, recursive=recursive)
+    if archive_files.archive is not None:
+        glob_path = f"{args.archive}:{glob_path[len(base_dir) + 1:]}"
+        files = archive_files.archive.configuration_files(args.file, split=args.split)
+        streams = archive_files.archive.read(files)
+    else:
+        files = glob.glob(glob_path, recursive=recursive)
+        streams = ((f, open(f, "rb")) for f in files)
     self._dbg(action="load_configurations",
               search=glob_path,
               files=files)
     if len(files) == 0:
         self._display(f"No configuration files found in {glob_path} with name {args.file}", colors.get("error", "red"))
         sys.exit(ec.FILE_NOT_FOUND)
-    for conf_file in files:
+    for conf_file, of in streams:
         self._display(f"Loading configuration file: {conf_file}", colors.get("info", "blue"))
-        with open(conf_file, "r") as of:
+        with of:
             if conf_file.endswith(".json"):
-                file_data = json.load(of)
+                file_data = json_load(of)
             elif conf_file.endswith(".yaml"):
-                file_data = yaml.safe_load(of)
+                file_data = yaml_load(of)
             else:
                 self._display(f"Configuration File {conf_file} is not a YAML or JSON file.", colors.get("error", "red"))
                 continue
@@ -157,7 +168,8 @@ def load_configurations(self, args, ko):
                         all_objects[root][k] = file_data["data"]
                         for iid in all_objects[root][k]:
                             if type(all_objects[root][k][iid]) != list:
-                                all_objects[root][k][iid]["worker_groups"] = [root]
+                                # Items of the export --dedupe shared group already list their groups.
+                                all_objects[root][k][iid].setdefault("worker_groups", [root])
                         self._dbg(action="load_configurations",
                                   use_namespace=args.use_namespace,
                                   group=root,
@@ -0,0 +1,120 @@
+import hashlib
+import os
+import threading
+
+from requests.models import Response
+from requests.structures import CaseInsensitiveDict
+
+from geese.utils.codec import json_dumps, json_load
+from geese.utils.files import atomic_write
+
+
+class ResponseCache:
+    """
+    On-disk cache of listing responses revalidated with conditional GETs.
+
+    When the leader returns an ETag or Last-Modified validator, the next request carries
+    If-None-Match / If-Modified-Since and a 304 is answered from disk. Without validators the body
+    hash is kept, so unchanged payloads are still detected and reported.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.directory = None
+        self._lock = threading.Lock()
+        self.stats = {"revalidated": 0, "unchanged": 0, "changed": 0, "new": 0, "bytes_saved": 0}
+
+    def configure(self, directory):
+        self.directory = directory
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        self.enabled = True
+
+    def _paths(self, url):
+        key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        base = os.path.join(self.directory, key[:2], key)
+        return f"{base}.json", f"{base}.body"
+
+    def _load_meta(self, url):
+        meta_path, body_path = self._paths(url)
+        if not os.path.exists(meta_path) or not os.path.exists(body_path):
+            return None
+        try:
+            with open(meta_path, "r") as f:
+                return json_load(f)
+        except (OSError, ValueError):
+            return None
+
+    @staticmethod
+    def _load_body(body_path):
+        try:
+            with open(body_path, "rb") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def _count(self, stat, value=1):
+        with self._lock:
+            self.stats[stat] += value
+
+    def conditional_headers(self, url, headers):
+        meta = self._load_meta(url)
+        headers = dict(headers)
+        if meta is not None:
+            if meta.get("etag"):
+                headers["If-None-Match"] = meta["etag"]
+            if meta.get("last_modified"):
+                headers["If-Modified-Since"] = meta["last_modified"]
+        return headers
+
+    def resolve(self, url, response):
+        """
+        Returns the response to hand back to the caller, answering 304s from disk and storing fresh 200s.
+
+        :return: None for a 304 whose cached entry is gone or unreadable, the GET must be sent again without
+            validators
+        """
+        meta = self._load_meta(url)
+        meta_path, body_path = self._paths(url)
+        if response.status_code == 304:
+            body = self._load_body(body_path) if meta is not None else None
+            if body is None:
+                response.close()
+                return None
+            self._count("revalidated")
+            self._count("bytes_saved", len(body))
+            cached = Response()
+            cached.status_code = 200
+            cached._content = body
+            cached.headers = CaseInsensitiveDict(meta.get("headers", {}))
+            cached.encoding = meta.get("encoding", None)
+            cached.url = url
+            cached.request = response.request
+            cached.reason = "OK (cached)"
+            return cached
+        if response.status_code != 200:
+            return response
+        body = response.content
+        digest = hashlib.sha256(body).hexdigest()
+        if meta is None:
+            self._count("new")
+        elif meta.get("sha256") == digest:
+            self._count("unchanged")
+        else:
+            self._count("changed")
+        if (meta is None or meta.get("sha256") != digest
+                or meta.get("etag") != response.headers.get("ETag", None)
+                or meta.get("last_modified") != response.headers.get("Last-Modified", None)):
+            atomic_write(body_path, body, mode=0o600)
+            atomic_write(meta_path, json_dumps({
+                "url": url,
+                "etag": response.headers.get("ETag", None),
+                "last_modified": response.headers.get("Last-Modified", None),
+                "sha256": digest,
+                "encoding": response.encoding,
+                "headers": {k: v for k, v in response.headers.items() if k.lower() in ["content-type", "etag",
+                                                                                      "last-modified"]}
+            }).encode("utf-8"), mode=0o600)
+        return response
+
+
+response_cache = ResponseCache()
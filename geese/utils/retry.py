@@ -0,0 +1,111 @@
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+import requests
+
+# Verbs that can be replayed safely after any transient failure.
+idempotent_methods = ["GET", "HEAD", "OPTIONS", "PUT", "DELETE"]
+# Statuses worth retrying for idempotent verbs.
+retry_statuses = [429, 502, 503, 504]
+# Statuses where the leader refused the request before acting on it, safe for POST/PATCH as well.
+rejected_statuses = [429, 503]
+
+default_policy = {
+    "total": 5,
+    "backoff_factor": 0.5,
+    "max_backoff": 30,
+    "max_elapsed": 120
+}
+
+_stats = {}
+_lock = threading.Lock()
+
+
+def _leader_key(url):
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}".lower()
+
+
+def record(url, event):
+    """
+    Increments a retry counter for the leader serving `url`.
+
+    :param url: The request url
+    :param event: One of "retries", "recovered", "exhausted"
+    """
+    key = _leader_key(url)
+    with _lock:
+        counters = _stats.setdefault(key, {"retries": 0, "recovered": 0, "exhausted": 0})
+        counters[event] += 1
+
+
+def get_stats():
+    with _lock:
+        return {k: dict(v) for k, v in _stats.items()}
+
+
+def retry_after_seconds(response):
+    if response is None:
+        return None
+    value = response.headers.get("Retry-After", None)
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class RetryPolicy:
+
+    def __init__(self, total=None, backoff_factor=None, max_backoff=None, max_elapsed=None):
+        self.total = int(total if total is not None else default_policy["total"])
+        self.backoff_factor = float(backoff_factor if backoff_factor is not None else default_policy["backoff_factor"])
+        self.max_backoff = float(max_backoff if max_backoff is not None else default_policy["max_backoff"])
+        self.max_elapsed = float(max_elapsed if max_elapsed is not None else default_policy["max_elapsed"])
+
+    @classmethod
+    def for_leader(cls, leader):
+        conf = leader.get("retries", None) or {}
+        return cls(**{k: v for k, v in conf.items() if k in default_policy})
+
+    def is_retryable(self, method, response=None, error=None):
+        method = method.upper()
+        if error is not None:
+            if method in idempotent_methods:
+                return isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout))
+            # The request never reached the leader, so it cannot have been applied.
+            return isinstance(error, requests.exceptions.ConnectTimeout)
+        if response is None:
+            return False
+        if method in idempotent_methods:
+            return response.status_code in retry_statuses
+        return response.status_code in rejected_statuses
+
+    def next_delay(self, method, attempt, started, response=None, error=None):
+        """
+        Decides if a failed attempt should be retried.
+
+        :param method: HTTP verb of the request
+        :param attempt: Zero based number of the attempt that just completed
+        :param started: time.monotonic() of the first attempt
+        :param response: The response, if one was received
+        :param error: The requests exception, if one was raised
+        :return: Seconds to wait before the next attempt, or None to stop
+        """
+        if attempt >= self.total or not self.is_retryable(method, response=response, error=error):
+            return None
+        remaining = self.max_elapsed - (time.monotonic() - started)
+        delay = retry_after_seconds(response)
+        if delay is None:
+            delay = random.uniform(0, min(self.max_backoff, self.backoff_factor * (2 ** attempt)))
+        if delay > remaining:
+            return None
+        return delay
@@ -0,0 +1,44 @@
+import threading
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Run-scoped pool of persistent HTTP sessions, one per leader origin (scheme://host:port).
+# Every knowledge object talking to the same leader reuses the same keep-alive connections.
+default_pool_size = 10
+
+_sessions = {}
+_lock = threading.Lock()
+
+
+def _origin(url):
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}".lower()
+
+
+def get_session(url, pool_size=None):
+    """
+    Returns the shared requests.Session for the leader that serves `url`, creating it on first use.
+
+    :param url: Any url on the leader, only the scheme, host and port are used as the key
+    :param pool_size: Maximum number of keep-alive connections kept open to the leader
+    :return: requests.Session
+    """
+    key = _origin(url)
+    with _lock:
+        session = _sessions.get(key, None)
+        if session is None:
+            size = int(pool_size) if pool_size else default_pool_size
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=size, pool_maxsize=size)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _sessions[key] = session
+        return session
+
+
+def close_sessions():
+    with _lock:
+        for key in list(_sessions.keys()):
+            _sessions.pop(key).close()
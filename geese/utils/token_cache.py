@@ -0,0 +1,129 @@
+import base64
+import hashlib
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from geese.utils.codec import json_dumps, json_load
+from geese.utils.files import atomic_write
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Tokens are treated as expired this many seconds before they actually expire.
+expiry_margin = 60
+
+
+def token_expiry(token, response=None):
+    """
+    Works out when a token expires, from the JWT "exp" claim or the "expires_in" of the login response.
+
+    :param token: The bearer token
+    :param response: The decoded login response, if any
+    :return: Expiry as a unix timestamp, or None when unknown
+    """
+    try:
+        payload = token.split(".")[1]
+        claims = json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))
+        if "exp" in claims:
+            return float(claims["exp"])
+    except (AttributeError, IndexError, TypeError, ValueError):
+        pass
+    if isinstance(response, dict) and response.get("expires_in", None) is not None:
+        try:
+            return time.time() + float(response["expires_in"])
+        except (TypeError, ValueError):
+            pass
+    return None
+
+
+def credential_key(leader, identity, secret):
+    """
+    Keys a token by leader url and credential identity. The secret is part of the hash so a changed
+    password or client secret never reuses a token obtained with the old one.
+    """
+    material = "\n".join([f"{leader.get('orig_url', leader.get('url', ''))}".rstrip("/"), f"{identity}", f"{secret}"])
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+class TokenCache:
+    """
+    File-based cache of leader auth tokens, readable by the current user only.
+
+    Concurrent runs share the file: every update re-reads it under an exclusive lock on `<path>.lock` and
+    replaces it atomically, so no run drops the tokens another one just saved.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.path = None
+        self._lock = threading.Lock()
+        self._refresh_locks = {}
+
+    def configure(self, path):
+        self.path = path
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        # makedirs leaves the mode of an existing directory as it is.
+        os.chmod(directory, 0o700)
+        self.enabled = True
+
+    def _load(self):
+        try:
+            with open(self.path, "r") as f:
+                return json_load(f)
+        except (OSError, ValueError):
+            return {}
+
+    @contextmanager
+    def _locked(self):
+        # The thread lock orders the threads of this run, the lock file the other runs (where fcntl is available).
+        with self._lock:
+            if fcntl is None:
+                yield
+                return
+            fd = os.open(f"{self.path}.lock", os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                yield
+            finally:
+                os.close(fd)
+
+    def _save(self, entries):
+        atomic_write(self.path, json_dumps(entries).encode("utf-8"), mode=0o600)
+
+    def get(self, key):
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._load().get(key, None)
+        if entry is None or entry.get("expires", 0) - expiry_margin <= time.time():
+            return None
+        return entry["token"]
+
+    def put(self, key, token, expires):
+        if not self.enabled or expires is None:
+            return
+        with self._locked():
+            entries = {k: v for k, v in self._load().items() if v.get("expires", 0) > time.time()}
+            entries[key] = {"token": token, "expires": expires}
+            self._save(entries)
+
+    def drop(self, key):
+        if not self.enabled:
+            return
+        with self._locked():
+            entries = self._load()
+            if entries.pop(key, None) is not None:
+                self._save(entries)
+
+    def refresh_lock(self, url):
+        with self._lock:
+            return self._refresh_locks.setdefault(url, threading.Lock())
+
+
+token_cache = TokenCache()
@@ -0,0 +1,69 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from geese.utils.sessions import default_pool_size
+
+
+class AsyncTransport:
+    """
+    Drives blocking knowledge-object I/O from an asyncio event loop.
+
+    Requests keep using the pooled leader sessions; the transport only bounds how many of them
+    are in flight at once and lets the orchestration code await them concurrently.
+    """
+
+    def __init__(self, max_in_flight=None):
+        self.max_in_flight = int(max_in_flight) if max_in_flight else default_pool_size
+        self._executor = None
+        self._semaphore = None
+
+    def run(self, coroutine):
+        self._executor = ThreadPoolExecutor(max_workers=self.max_in_flight, thread_name_prefix="geese-io")
+        try:
+            return asyncio.run(self._main(coroutine))
+        finally:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    async def _main(self, coroutine):
+        self._semaphore = asyncio.Semaphore(self.max_in_flight)
+        return await coroutine
+
+    async def call(self, func, *args, **kwargs):
+        async with self._semaphore:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+
+    async def gather(self, *coroutines):
+        return await asyncio.gather(*coroutines)
+
+
+def size_pools(leaders, max_in_flight=None):
+    """
+    Matches the requests in flight to the leaders' connection pools, so none of them waits for a connection or
+    opens one that is not kept alive. Must be called before the sessions are created.
+
+    :param leaders: Source and destination leader configurations, their `pool_size` is raised when needed
+    :param max_in_flight: Requested bound, defaults to the smallest `pool_size` of the leaders
+    :return: Bound on the requests in flight
+    """
+    sizes = [int(leader.get("pool_size", None) or default_pool_size) for leader in leaders]
+    max_in_flight = int(max_in_flight) if max_in_flight else min(sizes, default=default_pool_size)
+    for leader, size in zip(leaders, sizes):
+        if size < max_in_flight:
+            leader["pool_size"] = max_in_flight
+    return max_in_flight
+
+
+_transport = None
+
+
+def get_transport():
+    return _transport
+
+
+def set_transport(transport):
+    global _transport
+    _transport = transport
+    return _transport
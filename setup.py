@@ -50,6 +50,10 @@ setuptools.setup(
         "requests_html",
         "lxml_html_clean"
     ],
+    extras_require={
+        "fast": ["orjson"],
+        "archive": ["zstandard"]
+    },
     classifiers=[
         "Development Status :: 1 - Alpha",
         "Topic :: Utilities",
@@ -1,5 +1,10 @@
 import sys
 import os
+import json
+import threading
+import time
+
+import pytest
 sys.path.append(os.path.realpath(os.path.dirname(__file__)+"/.."))
 from geese import version
 
@@ -8,3 +13,967 @@ class TestStatic:
 
     def test_version(self):
         assert version.__version__ == '1.1.5'
+
+
+class TestVersioning:
+    # version/files answers with GitFilesResponse items, each holding a tree of GitFile objects.
+    files_response = {"count": 1, "items": [{"commitMessage": {"message": "update"}, "count": 3, "items": [
+        {"name": "groups", "children": [{"name": "g1", "children": [{"name": "local", "children": [
+            {"name": "cribl", "children": [
+                {"name": "pipelines", "children": [{"name": "p1", "children": [{"name": "conf.yml"}]}]},
+                {"name": "outputs.yml", "state": "modified"}]}]}]}]},
+        {"name": "lookups", "children": [{"name": "l1.csv"}]}]}]}
+
+    def test_file_paths(self):
+        from geese.knowledge.versioning import _file_paths
+        tree = self.files_response["items"][0]["items"]
+        assert _file_paths(tree) == ["groups/g1/local/cribl/pipelines/p1/conf.yml",
+                                     "groups/g1/local/cribl/outputs.yml", "lookups/l1.csv"]
+
+    def test_commit_paths(self):
+        from geese.knowledge.versioning import _commit_paths
+        assert len(_commit_paths(self.files_response)) == 3
+        assert _commit_paths({"count": 0, "items": []}) is None
+        assert _commit_paths({"count": 1, "items": [{"commitMessage": {}, "count": 0, "items": []}]}) is None
+        assert _commit_paths({"count": 1, "items": [{"name": "groups"}]}) is None
+        assert _commit_paths([]) is None
+
+    def test_changed_objects(self):
+        from geese.knowledge.versioning import _commit_paths, changed_objects
+        changed, unmapped = changed_objects(_commit_paths(self.files_response), "g1")
+        assert changed == {"pipelines": {"p1"}, "outputs": None, "lookups": None}
+        assert unmapped == []
+        changed, unmapped = changed_objects(_commit_paths(self.files_response), "g2")
+        assert changed == {"lookups": None}
+        changed, unmapped = changed_objects(["groups/g1/local/cribl/unknown.yml"], "g1")
+        assert changed == {} and unmapped == ["groups/g1/local/cribl/unknown.yml"]
+
+
+class FakeResponse:
+
+    def __init__(self, body, status_code=200, headers=None):
+        self.body = body
+        self.status_code = status_code
+        self.headers = headers if headers is not None else {}
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+    def json(self):
+        return self.body
+
+
+class FakeLookupLeader:
+    # Answers lookup content pages the way the leader does: `count` is the number of items in the page.
+
+    def __init__(self, rows, delay=0):
+        self.rows = [[f"{i}", f"value {i}"] for i in range(rows)]
+        self.offsets = []
+        self.delay = delay
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+
+    def _get_lookup_page(self, lookup_id, offset, limit):
+        with self._lock:
+            self.offsets.append(offset)
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        time.sleep(self.delay)
+        with self._lock:
+            self.in_flight -= 1
+        items = self.rows[offset:offset + limit]
+        return FakeResponse({"fields": ["id", "value"], "count": len(items), "items": items})
+
+
+class TestLookupPages:
+
+    def _rows(self, leader, limit, workers):
+        from geese.knowledge.lookups import Lookups
+        rows = []
+        for response, page in Lookups._lookup_pages(leader, "l1.csv", limit, workers):
+            rows.extend(page["items"])
+        return rows
+
+    def test_count_per_page(self):
+        leader = FakeLookupLeader(25)
+        assert self._rows(leader, 10, 4) == leader.rows
+        # Pages past the short one may have been requested before it came back, never more than `workers`.
+        assert sorted(leader.offsets)[:3] == [0, 10, 20] and len(leader.offsets) <= 3 + 4
+
+    def test_full_last_page(self):
+        leader = FakeLookupLeader(20)
+        assert self._rows(leader, 10, 4) == leader.rows
+        assert sorted(leader.offsets)[:3] == [0, 10, 20] and len(leader.offsets) <= 3 + 4
+
+    def test_single_worker(self):
+        leader = FakeLookupLeader(25)
+        assert self._rows(leader, 10, 1) == leader.rows
+        assert leader.offsets == [0, 10, 20]
+
+    def test_full_pages_prefetch(self):
+        leader = FakeLookupLeader(95, delay=0.05)
+        assert self._rows(leader, 10, 4) == leader.rows
+        # Requested in parallel while pages come back full, at most `workers` at a time.
+        assert leader.max_in_flight == 4
+        assert sorted(set(leader.offsets))[:10] == list(range(0, 100, 10))
+        assert len(leader.offsets) == len(set(leader.offsets)) <= 10 + 4
+
+
+class TestRetryPolicy:
+
+    def test_retry_after_seconds(self):
+        from email.utils import formatdate
+        from geese.utils.retry import retry_after_seconds
+        assert retry_after_seconds(None) is None
+        assert retry_after_seconds(FakeResponse({}, 503)) is None
+        assert retry_after_seconds(FakeResponse({}, 503, {"Retry-After": "7"})) == 7.0
+        assert retry_after_seconds(FakeResponse({}, 503, {"Retry-After": "-3"})) == 0.0
+        assert retry_after_seconds(FakeResponse({}, 503, {"Retry-After": "soon"})) is None
+        later = retry_after_seconds(FakeResponse({}, 503, {"Retry-After": formatdate(time.time() + 30, usegmt=True)}))
+        assert 25 <= later <= 30
+
+    def test_next_delay_backoff(self):
+        from geese.utils.retry import RetryPolicy
+        policy = RetryPolicy(total=3, backoff_factor=0.5, max_backoff=1, max_elapsed=60)
+        started = time.monotonic()
+        for attempt, cap in enumerate([0.5, 1, 1]):
+            delay = policy.next_delay("GET", attempt, started, response=FakeResponse({}, 503))
+            assert 0 <= delay <= cap
+        assert policy.next_delay("GET", 3, started, response=FakeResponse({}, 503)) is None
+
+    def test_next_delay_methods(self):
+        import requests
+        from geese.utils.retry import RetryPolicy
+        policy = RetryPolicy(total=3)
+        started = time.monotonic()
+        assert policy.next_delay("GET", 0, started, response=FakeResponse({}, 500)) is None
+        assert policy.next_delay("GET", 0, started, response=FakeResponse({}, 404)) is None
+        assert policy.next_delay("GET", 0, started, error=requests.exceptions.ReadTimeout()) is not None
+        # POST and PATCH are only replayed when the leader cannot have acted on them.
+        assert policy.next_delay("POST", 0, started, response=FakeResponse({}, 502)) is None
+        assert policy.next_delay("POST", 0, started, response=FakeResponse({}, 429)) is not None
+        assert policy.next_delay("POST", 0, started, error=requests.exceptions.ReadTimeout()) is None
+        assert policy.next_delay("PATCH", 0, started, error=requests.exceptions.ConnectTimeout()) is not None
+
+    def test_next_delay_retry_after(self):
+        from geese.utils.retry import RetryPolicy
+        policy = RetryPolicy(total=3, max_elapsed=10)
+        started = time.monotonic()
+        assert policy.next_delay("GET", 0, started, response=FakeResponse({}, 429, {"Retry-After": "4"})) == 4.0
+        # Waiting longer than the time left is giving up.
+        assert policy.next_delay("GET", 0, started, response=FakeResponse({}, 429, {"Retry-After": "20"})) is None
+
+
+class TestCircuitBreaker:
+
+    def test_opens_after_failures(self):
+        from geese.utils.circuit import CircuitBreaker
+        breaker = CircuitBreaker(failures=3, reset=60)
+        breaker.failure()
+        breaker.failure()
+        assert breaker.allow() and not breaker.is_open
+        breaker.failure()
+        assert breaker.is_open and not breaker.allow()
+        assert breaker.stats == {"opened": 1, "short_circuited": 1}
+
+    def test_success_resets_count(self):
+        from geese.utils.circuit import CircuitBreaker
+        breaker = CircuitBreaker(failures=2, reset=60)
+        breaker.failure()
+        breaker.success()
+        breaker.failure()
+        assert not breaker.is_open
+
+    def test_trial_request(self):
+        from geese.utils.circuit import CircuitBreaker
+        breaker = CircuitBreaker(failures=1, reset=0)
+        breaker.failure()
+        # One trial once `reset` has passed, the others wait for its outcome.
+        assert breaker.allow()
+        assert not breaker.allow()
+        breaker.failure()
+        assert breaker.is_open and breaker.stats["opened"] == 1
+        assert breaker.allow()
+        breaker.success()
+        assert not breaker.is_open and breaker.allow() and breaker.allow()
+
+    def test_trial_released(self):
+        from geese.utils.circuit import CircuitBreaker
+        breaker = CircuitBreaker(failures=1, reset=0)
+        breaker.failure()
+        assert breaker.allow()
+        # The trial ended without an outcome: the next request is the new trial.
+        breaker.release_trial()
+        assert breaker.allow() and not breaker.allow()
+
+    def test_trial_non_failure_error(self, monkeypatch):
+        import requests
+        from geese.knowledge.base import BaseKnowledge
+        from geese.utils.circuit import get_breaker
+
+        class Session:
+            def request(self, *args, **kwargs):
+                raise requests.exceptions.TooManyRedirects()
+
+        monkeypatch.setattr("geese.knowledge.base.get_session", lambda *args, **kwargs: Session())
+        leader = {"url": "https://trial.example/api/v1", "retries": {"total": 0},
+                  "circuit_breaker": {"failures": 1, "reset": 0}}
+        knowledge = BaseKnowledge.__new__(BaseKnowledge)
+        knowledge.leader, knowledge.url, knowledge.obj_type, knowledge.verify_ssl = leader, leader["url"], "base", True
+        knowledge._log = lambda *args, **kwargs: None
+        breaker = get_breaker(leader, leader["url"])
+        breaker.failure()
+        # The trial request ends in an error that says nothing about the leader: the breaker must not stay stuck.
+        for i in range(3):
+            with pytest.raises(requests.exceptions.TooManyRedirects):
+                knowledge._send("GET", f"{leader['url']}/system/info")
+        assert not breaker.is_open and breaker.allow()
+
+    def test_disabled(self):
+        from geese.utils.circuit import CircuitBreaker
+        breaker = CircuitBreaker(failures=0)
+        for i in range(10):
+            breaker.failure()
+        assert breaker.allow()
+
+    def test_is_failure(self):
+        import requests
+        from geese.utils.circuit import is_failure
+        assert is_failure(FakeResponse({}, 503))
+        assert is_failure(error=requests.exceptions.ConnectionError())
+        assert is_failure(error=requests.exceptions.ReadTimeout())
+        assert not is_failure(FakeResponse({}, 500))
+        assert not is_failure(FakeResponse({}, 409))
+        assert not is_failure(error=requests.exceptions.InvalidURL())
+
+
+class TestGovernor:
+
+    def test_additive_increase(self):
+        from geese.utils.governor import Governor
+        governor = Governor(initial=4, max_in_flight=5)
+        governor.acquire()
+        governor.release(latency=0.1, status=200)
+        assert governor.limit == 4.25
+        for i in range(20):
+            governor.acquire()
+            governor.release(latency=0.1, status=200)
+        assert governor.limit == 5 and governor.in_flight == 0
+
+    def test_decrease_once_per_round_trip(self):
+        from geese.utils.governor import Governor
+        governor = Governor(initial=16, min_in_flight=2)
+        for status in [429, 503, None]:
+            governor.acquire()
+            governor.release(latency=10, status=status)
+        # The three requests saw the same congestion.
+        assert governor.limit == 8
+        assert governor.stats["decreases"] == 1 and governor.stats["throttled"] == 2
+        for i in range(3):
+            governor._last_decrease = 0.0
+            governor.acquire()
+            governor.release(latency=10, status=503)
+        assert governor.limit == 2
+
+    def test_latency_spike(self):
+        from geese.utils.governor import Governor
+        governor = Governor(initial=8, latency_factor=3.0)
+        for i in range(5):
+            governor.acquire("lookups")
+            governor.release("lookups", latency=0.1, status=200)
+        limit = governor.limit
+        governor.acquire("lookups")
+        governor.release("lookups", latency=1.0, status=200)
+        assert governor.limit == limit / 2
+        # Other profiles have their own baseline.
+        governor.acquire("packs")
+        governor.release("packs", latency=1.0, status=200)
+        assert governor.limit > limit / 2
+
+    def test_caps(self):
+        from geese.utils.governor import Governor
+        governor = Governor(initial=8, caps={"packs": 1})
+        governor.acquire("packs")
+        assert not governor._has_room("packs") and governor._has_room("pipelines")
+        governor.release("packs", latency=0.1, status=200, hold=True)
+        # A streamed download keeps its slot until its response is closed.
+        assert not governor._has_room("packs") and governor.in_flight == 1
+        governor.free("packs")
+        assert governor._has_room("packs") and governor.in_flight == 0
+
+    def test_free_on_close(self):
+        from geese.utils.governor import Governor, free_on_close
+        governor = Governor(initial=8, caps={"packs": 1})
+        response = FakeResponse({})
+        governor.acquire("packs")
+        governor.release("packs", latency=0.1, status=200, hold=True)
+        free_on_close(response, governor, "packs")
+        response.close()
+        response.close()
+        assert response.closed and governor.in_flight == 0
+
+    def test_disabled(self):
+        from geese.utils.governor import Governor
+        governor = Governor(enabled=False, initial=1)
+        governor.acquire()
+        governor.acquire()
+        governor.release(status=503)
+        assert governor.in_flight == 0 and governor.limit == 1
+
+
+class TestExportManifest:
+
+    def _manifest(self, directory, store=None):
+        from geese.utils.export_manifest import ExportManifest
+        manifest = ExportManifest()
+        manifest.configure(str(directory), ".manifest.json", [{"namespace": "ns", "url": "https://leader",
+                                                                "group_versions": {"g1": "c1"}}], store=store)
+        return manifest
+
+    def _write(self, manifest, path, text, meta=None, obj_type="lookups", group="g1"):
+        tmp = f"{path}.tmp"
+        with open(tmp, "w") as f:
+            f.write(text)
+        return manifest.commit(tmp, path, "ns", group, obj_type, meta=meta)
+
+    def test_commit(self, tmp_path):
+        path = str(tmp_path / "l1.csv")
+        manifest = self._manifest(tmp_path)
+        assert self._write(manifest, path, "a,b\n")
+        counts = manifest.close()
+        assert counts["written"] == 1 and counts["unchanged"] == 0
+        mtime = os.stat(path).st_mtime_ns
+        manifest = self._manifest(tmp_path)
+        assert not self._write(manifest, path, "a,b\n")
+        assert os.stat(path).st_mtime_ns == mtime
+        assert self._write(manifest, path, "a,c\n")
+        with open(tmp_path / ".manifest.json") as f:
+            saved = json.load(f)
+        manifest.close()
+        with open(tmp_path / ".manifest.json") as f:
+            entry = json.load(f)["files"]["l1.csv"]
+        assert saved["files"]["l1.csv"]["size"] == 4
+        assert entry["leader"] == "https://leader" and entry["commit"] == "c1" and entry["type"] == "lookups"
+
+    def test_reuse(self, tmp_path):
+        path = str(tmp_path / "l1.csv")
+        manifest = self._manifest(tmp_path)
+        self._write(manifest, path, "a,b\n", meta={"id": "l1.csv", "version": "v1"})
+        manifest.close()
+        manifest = self._manifest(tmp_path)
+        assert manifest.reuse(path, "ns", "g1", "lookups", meta={"id": "l1.csv", "version": "v2"}) is None
+        entry = manifest.reuse(path, "ns", "g1", "lookups", meta={"id": "l1.csv", "version": "v1"})
+        assert entry["size"] == 4
+        assert manifest.close()["reused_bytes"] == {"lookups": 4}
+        # A file changed on disk since is downloaded again.
+        with open(path, "w") as f:
+            f.write("edited\n")
+        manifest = self._manifest(tmp_path)
+        assert manifest.reuse(path, "ns", "g1", "lookups", meta={"id": "l1.csv", "version": "v1"}) is None
+
+    def test_close_prune(self, tmp_path):
+        manifest = self._manifest(tmp_path)
+        for name in ["l1.csv", "l2.csv", "l3.csv"]:
+            self._write(manifest, str(tmp_path / name), name)
+        self._write(manifest, str(tmp_path / "p1.crbl"), "pack", obj_type="packs")
+        manifest.close()
+        manifest = self._manifest(tmp_path)
+        manifest.exported("ns", "g1", "lookups")
+        self._write(manifest, str(tmp_path / "l1.csv"), "l1.csv")
+        # The download of l2.csv failed in this run, l3.csv is gone from the listing.
+        assert manifest.keep(str(tmp_path / "l2.csv"), "ns", "g1", "lookups")["size"] == 6
+        counts = manifest.close(prune=True)
+        assert (counts["unchanged"], counts["kept"], counts["removed"]) == (1, 1, 1)
+        assert sorted(os.listdir(tmp_path)) == [".manifest.json", "l1.csv", "l2.csv", "p1.crbl"]
+
+    def test_close_stale(self, tmp_path):
+        manifest = self._manifest(tmp_path)
+        self._write(manifest, str(tmp_path / "l1.csv"), "l1.csv")
+        manifest.close()
+        manifest = self._manifest(tmp_path)
+        manifest.exported("ns", "g1", "lookups")
+        assert manifest.close()["stale"] == 1
+        assert os.path.exists(tmp_path / "l1.csv")
+
+    def test_artifact_store(self, tmp_path):
+        from geese.utils.artifact_store import ArtifactStore
+        store = ArtifactStore(str(tmp_path / ".geese-artifacts"))
+        paths = {g: str(tmp_path / f"{g}-p1.crbl") for g in ["g1", "g2"]}
+        manifest = self._manifest(tmp_path, store)
+        for group, path in paths.items():
+            self._write(manifest, path, "pack", obj_type="packs", group=group)
+        assert manifest.close()["gc_blobs"] == 0
+        with open(tmp_path / ".manifest.json") as f:
+            blob = store.blob(json.load(f)["files"]["g1-p1.crbl"]["sha256"])
+        # Stored once, linked into both groups.
+        assert os.stat(paths["g1"]).st_ino == os.stat(paths["g2"]).st_ino == os.stat(blob).st_ino
+        assert os.stat(blob).st_nlink == 3
+        # g2 no longer has the pack: its link is pruned, g1 still holds the blob.
+        manifest = self._manifest(tmp_path, store)
+        manifest.exported("ns", "g1", "packs")
+        manifest.exported("ns", "g2", "packs")
+        assert not self._write(manifest, paths["g1"], "pack", obj_type="packs")
+        counts = manifest.close(prune=True)
+        assert (counts["removed"], counts["gc_blobs"]) == (1, 0)
+        assert os.stat(blob).st_nlink == 2
+        # Gone from g1 as well: nothing links to the blob any more and it is collected.
+        manifest = self._manifest(tmp_path, store)
+        manifest.exported("ns", "g1", "packs")
+        counts = manifest.close(prune=True)
+        assert (counts["removed"], counts["gc_blobs"], counts["gc_bytes"]) == (1, 1, 4)
+        assert not os.path.exists(blob) and not os.path.exists(paths["g1"])
+
+
+class TestExportWriter:
+    items = {"g1": {"inputs": [{"id": "in1", "type": "tcp"}], "outputs": [{"id": "out1", "type": "s3"}]},
+             "g2": {"inputs": [{"id": "in2", "type": "http"}], "outputs": []}}
+
+    def _export(self, tmp_path, split, use_namespace, file="objects.yaml"):
+        import argparse
+        from geese.utils.export_writer import ExportWriter
+        args = argparse.Namespace(directory=str(tmp_path), file=file, split=split, use_namespace=use_namespace,
+                                  lookup_only=False, id_lookup=None, dedupe=False)
+        writer = ExportWriter(args, lambda *a, **k: None)
+        for group, types in self.items.items():
+            for obj_type, items in types.items():
+                writer.add("ns", group, obj_type, items)
+        writer.close()
+        assert not any(f.startswith(".geese-spool-") for f in os.listdir(tmp_path))
+
+    @staticmethod
+    def _load(path):
+        from geese.utils.codec import yaml_load
+        with open(path) as f:
+            return json.load(f) if path.endswith(".json") else yaml_load(f)
+
+    def test_split_namespace(self, tmp_path):
+        self._export(tmp_path, split=True, use_namespace=True)
+        assert self._load(str(tmp_path / "ns/g1/configs/inputs.objects.yaml")) == {
+            "namespace": "ns", "group": "g1", "object_type": "inputs", "data": {"in1": {"id": "in1", "type": "tcp"}}}
+        assert self._load(str(tmp_path / "ns/g1/configs/outputs.objects.yaml"))["data"] == {
+            "out1": {"id": "out1", "type": "s3"}}
+        # Object types without items get no file when split.
+        assert sorted(os.listdir(tmp_path / "ns/g2/configs")) == ["inputs.objects.yaml"]
+
+    def test_split(self, tmp_path):
+        self._export(tmp_path, split=True, use_namespace=False)
+        assert self._load(str(tmp_path / "g2/configs/inputs.objects.yaml")) == {
+            "group": "g2", "object_type": "inputs", "data": {"in2": {"id": "in2", "type": "http"}}}
+
+    def test_namespace(self, tmp_path):
+        self._export(tmp_path, split=False, use_namespace=True)
+        assert self._load(str(tmp_path / "ns/configs/objects.yaml")) == {"namespace": "ns", "data": {
+            "g1": {"inputs": {"in1": {"id": "in1", "type": "tcp"}}, "outputs": {"out1": {"id": "out1", "type": "s3"}}},
+            "g2": {"inputs": {"in2": {"id": "in2", "type": "http"}}}}}
+
+    def test_plain(self, tmp_path):
+        self._export(tmp_path, split=False, use_namespace=False)
+        assert self._load(str(tmp_path / "g1/configs/objects.yaml")) == {"group": "g1", "data": {
+            "inputs": {"in1": {"id": "in1", "type": "tcp"}}, "outputs": {"out1": {"id": "out1", "type": "s3"}}}}
+        assert self._load(str(tmp_path / "g2/configs/objects.yaml")) == {"group": "g2", "data": {
+            "inputs": {"in2": {"id": "in2", "type": "http"}}}}
+
+    def test_json(self, tmp_path):
+        self._export(tmp_path, split=False, use_namespace=True, file="objects.json")
+        yaml_dir = tmp_path / "yaml"
+        self._export(yaml_dir, split=False, use_namespace=True)
+        assert (self._load(str(tmp_path / "ns/configs/objects.json"))
+                == self._load(str(yaml_dir / "ns/configs/objects.yaml")))
+
+    def test_discard_twice(self, tmp_path):
+        import argparse
+        from geese.utils.export_writer import ExportWriter
+        args = argparse.Namespace(directory=str(tmp_path), file="objects.yaml", split=False, use_namespace=False,
+                                  lookup_only=False, id_lookup="ids.csv", dedupe=False)
+        writer = ExportWriter(args, lambda *a, **k: None)
+        writer.add("ns", "g1", "inputs", [{"id": "in1"}])
+        writer.discard()
+        assert writer._lookup_file is None
+        writer.discard()
+        assert [f for r, d, files in os.walk(tmp_path) for f in files] == []
+
+
+class FakeListingLeader:
+    # Serves one listing and counts how often it was fetched.
+
+    url = "https://leader.example/api/v1/m/g1/pipelines"
+
+    def __init__(self, items, delay=0.0):
+        self.items = items
+        self.delay = delay
+        self.fetches = 0
+
+    @staticmethod
+    def response(body, status_code=200):
+        import requests
+        response = requests.Response()
+        response.status_code = status_code
+        response._content = json.dumps(body).encode("utf-8")
+        return response
+
+    def get(self):
+        self.fetches += 1
+        time.sleep(self.delay)
+        return self.response({"count": len(self.items), "items": list(self.items)})
+
+
+class TestListingCache:
+
+    def _cache(self):
+        from geese.utils.listing_cache import ListingCache
+        cache = ListingCache()
+        cache.enabled = True
+        return cache
+
+    def _get(self, cache, leader):
+        return cache.fetch(("https://leader.example", "g1", leader.url), leader.get).json()["items"]
+
+    def test_post_patches_listing(self):
+        cache = self._cache()
+        leader = FakeListingLeader([{"id": "p1", "conf": {}}])
+        self._get(cache, leader)
+        item = {"id": "p2", "conf": {"functions": []}}
+        cache.written("https://leader.example", leader.url, "POST", data=json.dumps(item),
+                      response=leader.response({"count": 1, "items": [item]}))
+        assert self._get(cache, leader) == [{"id": "p1", "conf": {}}, item]
+        cache.written("https://leader.example", f"{leader.url}/p1", "PATCH", data=json.dumps({"id": "p1", "x": 1}),
+                      response=leader.response({"count": 0, "items": []}))
+        cache.written("https://leader.example", f"{leader.url}/p2", "DELETE", response=leader.response({}))
+        assert self._get(cache, leader) == [{"id": "p1", "x": 1}]
+        assert leader.fetches == 1
+
+    def test_refused_write_keeps_listing(self):
+        cache = self._cache()
+        leader = FakeListingLeader([{"id": "p1"}])
+        self._get(cache, leader)
+        cache.written("https://leader.example", leader.url, "POST", data=json.dumps({"id": "p1"}),
+                      response=leader.response({"message": "exists"}, 409))
+        self._get(cache, leader)
+        assert leader.fetches == 1
+
+    def test_put_refetches(self):
+        cache = self._cache()
+        leader = FakeListingLeader([{"id": "l1.csv"}])
+        self._get(cache, leader)
+        leader.items.append({"id": "l2.csv"})
+        cache.written("https://leader.example", f"{leader.url}?filename=l2.csv", "PUT", data=b"a,b",
+                      response=leader.response({"filename": "l2.csv.tmp"}))
+        assert [i["id"] for i in self._get(cache, leader)] == ["l1.csv", "l2.csv"]
+        # A write that raised tells nothing of the leader's state either.
+        cache.written("https://leader.example", f"{leader.url}/l1.csv", "DELETE")
+        self._get(cache, leader)
+        assert leader.fetches == 3
+
+    def test_concurrent_fetches_coalesced(self):
+        from concurrent.futures import ThreadPoolExecutor
+        cache = self._cache()
+        leader = FakeListingLeader([{"id": "p1"}], delay=0.2)
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            results = list(executor.map(lambda i: self._get(cache, leader), range(8)))
+        assert leader.fetches == 1 and all(r == [{"id": "p1"}] for r in results)
+        assert cache.stats["misses"] == 1 and cache.stats["coalesced"] + cache.stats["hits"] == 7
+
+    def test_write_during_fetch(self):
+        import threading
+        cache = self._cache()
+        leader = FakeListingLeader([{"id": "p1"}], delay=0.2)
+        loader = threading.Thread(target=self._get, args=(cache, leader))
+        waiter = threading.Thread(target=self._get, args=(cache, leader))
+        loader.start()
+        time.sleep(0.05)
+        waiter.start()
+        time.sleep(0.05)
+        # The listing in flight predates the write: it is not stored, and the waiter fetches it again.
+        cache.written("https://leader.example", leader.url, "POST")
+        loader.join()
+        waiter.join()
+        assert leader.fetches == 2
+        self._get(cache, leader)
+        assert leader.fetches == 2
+
+
+class FakeDownload(FakeResponse):
+    # A streamed download, optionally dropping the connection after `drop_after` bytes.
+
+    def __init__(self, body, status_code=200, headers=None, drop_after=None):
+        super().__init__(None, status_code, headers)
+        self.content = body
+        self.drop_after = drop_after
+
+    def iter_content(self, chunk_size=1):
+        import requests
+        end = len(self.content) if self.drop_after is None else self.drop_after
+        for i in range(0, end, 4):
+            yield self.content[i:min(i + 4, end)]
+        if self.drop_after is not None:
+            raise requests.exceptions.ChunkedEncodingError("Connection broken")
+
+
+class TestDownloadToFile:
+    body = b"0123456789abcdefghij"
+    etag = '"v1"'
+
+    def _full(self, **kwargs):
+        headers = {"ETag": self.etag, "Content-Length": str(len(self.body))}
+        return FakeDownload(self.body, 200, headers, **kwargs)
+
+    def _range(self, start):
+        headers = {"ETag": self.etag, "Content-Length": str(len(self.body) - start),
+                   "Content-Range": f"bytes {start}-{len(self.body) - 1}/{len(self.body)}"}
+        return FakeDownload(self.body[start:], 206, headers)
+
+    def _part(self, path, data, validator=None):
+        from geese.utils.codec import json_dumps
+        with open(f"{path}.part", "wb") as f:
+            f.write(data)
+        with open(f"{path}.part.json", "w") as f:
+            f.write(json_dumps({"validator": validator or self.etag, "total": len(self.body)}))
+
+    @staticmethod
+    def _read(path):
+        with open(path, "rb") as f:
+            return f.read()
+
+    def test_plain_download(self, tmp_path):
+        from geese.utils.files import download_to_file
+        path = str(tmp_path / "p1.crbl")
+        response = self._full()
+        size, sha256 = download_to_file(response, path)
+        assert (size, self._read(path)) == (len(self.body), self.body)
+        assert sha256 == __import__("hashlib").sha256(self.body).hexdigest()
+        # The final rename leaves neither the partial file nor its validator behind.
+        assert sorted(os.listdir(tmp_path)) == ["p1.crbl"] and response.closed
+
+    def test_resume_dropped_connection(self, tmp_path):
+        from geese.utils.files import download_to_file
+        path = str(tmp_path / "p1.crbl")
+        requested = []
+
+        def resume(headers):
+            requested.append(headers)
+            return self._range(int(headers["Range"][6:-1]))
+
+        download_to_file(self._full(drop_after=8), path, resume=resume)
+        assert self._read(path) == self.body
+        assert requested == [{"Range": "bytes=8-", "If-Range": self.etag}]
+
+    def test_reuse_part_file(self, tmp_path):
+        from geese.utils.files import download_to_file
+        path = str(tmp_path / "p1.crbl")
+        self._part(path, self.body[:12])
+        response = self._full()
+        download_to_file(response, path, resume=lambda headers: self._range(12))
+        # The full response is closed unread, the 206 is appended to the 12 bytes kept from the earlier run.
+        assert response.closed and self._read(path) == self.body
+        assert sorted(os.listdir(tmp_path)) == ["p1.crbl"]
+
+    def test_part_file_of_other_version(self, tmp_path):
+        from geese.utils.files import download_to_file
+        path = str(tmp_path / "p1.crbl")
+        self._part(path, b"XXXXXXXXXXXX", validator='"v0"')
+        # Left by a download of another version of the file: not resumed.
+        download_to_file(self._full(), path, resume=lambda headers: pytest.fail("resumed"))
+        assert self._read(path) == self.body
+
+    def test_range_answered_in_full(self, tmp_path):
+        from geese.utils.files import download_to_file
+        path = str(tmp_path / "p1.crbl")
+        self._part(path, b"XXXXXXXX")
+        # The server ignores the Range header: the partial file is truncated and the download starts over.
+        download_to_file(self._full(), path, resume=lambda headers: self._full())
+        assert self._read(path) == self.body
+
+    def test_commit(self, tmp_path):
+        from geese.utils.files import download_to_file
+        path = str(tmp_path / "p1.crbl")
+        committed = []
+
+        def commit(part, target, sha256):
+            committed.append((os.path.basename(part), target))
+            os.replace(part, target)
+
+        download_to_file(self._full(), path, commit=commit)
+        assert committed == [("p1.crbl.part", path)] and self._read(path) == self.body
+
+    def test_verification(self, tmp_path):
+        from geese.utils.files import download_to_file
+        path = str(tmp_path / "p1.crbl")
+        headers = {"Content-Length": str(len(self.body)), "Digest": "sha-256=" + "A" * 43 + "="}
+        with pytest.raises(IOError):
+            download_to_file(FakeDownload(self.body, 200, headers), path)
+        assert not os.path.exists(path) and not os.path.exists(f"{path}.part")
+
+
+class TestDedupe:
+
+    def _export(self, tmp_path, groups):
+        import argparse
+        from geese.utils.codec import yaml_load
+        from geese.utils.export_writer import ExportWriter
+        args = argparse.Namespace(directory=str(tmp_path), file="objects.yaml", split=False, use_namespace=False,
+                                  lookup_only=False, id_lookup=None, dedupe=True)
+        writer = ExportWriter(args, lambda *a, **k: None)
+        for group, items in groups.items():
+            writer.add("ns", group, "inputs", items)
+        writer.close()
+        exported = {}
+        for group in os.listdir(tmp_path):
+            with open(tmp_path / group / "configs" / "objects.yaml") as f:
+                exported[group] = yaml_load(f)["data"].get("inputs", {})
+        return exported
+
+    def test_identical_items_shared(self, tmp_path):
+        exported = self._export(tmp_path, {"g1": [{"id": "in1", "port": 1}], "g2": [{"id": "in1", "port": 1}],
+                                           "g3": [{"id": "in2", "port": 2}]})
+        assert exported["_shared"] == {"in1": {"id": "in1", "port": 1, "worker_groups": ["g1", "g2"]}}
+        assert exported["g1"] == {} and exported["g2"] == {}
+        # Found in one group only: stays there.
+        assert exported["g3"] == {"in2": {"id": "in2", "port": 2}}
+
+    def test_differing_definitions(self, tmp_path):
+        exported = self._export(tmp_path, {"g1": [{"id": "in1", "port": 1}], "g2": [{"id": "in1", "port": 1}],
+                                           "g3": [{"id": "in1", "port": 3}]})
+        assert exported["_shared"]["in1"]["worker_groups"] == ["g1", "g2"]
+        assert exported["g3"] == {"in1": {"id": "in1", "port": 3}}
+        exported = self._export(tmp_path / "two", {"g1": [{"id": "in1", "port": 1}],
+                                                   "g2": [{"id": "in1", "port": 2}]})
+        assert "_shared" not in exported
+        assert exported["g1"]["in1"]["port"] == 1 and exported["g2"]["in1"]["port"] == 2
+
+    def test_same_id_twice_in_group(self, tmp_path):
+        exported = self._export(tmp_path, {"g1": [{"id": "in1", "port": 1}, {"id": "in1", "port": 5}],
+                                           "g2": [{"id": "in1", "port": 1}]})
+        assert exported["_shared"]["in1"]["worker_groups"] == ["g1", "g2"]
+        # The second item with the same id cannot be shared, it is kept in its group.
+        assert list(exported["g1"].values()) == [{"id": "in1", "port": 5}]
+
+    def test_import_order(self):
+        import importlib
+        import_command = importlib.import_module("geese.commands.import")
+        assert import_command._import_order(["default", "g2", "_shared", "g1"]) == ["_shared", "default", "g2", "g1"]
+
+
+class TestExportArchive:
+
+    def _export(self, tmp_path):
+        export = tmp_path / "export"
+        (export / "g1" / "configs").mkdir(parents=True)
+        (export / "g1" / "lookups").mkdir()
+        (export / "g1" / "configs" / "objects.yaml").write_text("data: {}\n")
+        (export / "g1" / "lookups" / "l1.csv").write_bytes(b"a,b\n" * 1000)
+        (export / "g1" / "lookups" / "l2.csv").write_bytes(b"c,d\n")
+        (export / "g1" / "lookups" / "l1.csv.part").write_bytes(b"partial")
+        return export
+
+    @pytest.mark.parametrize("suffix", [".tar.gz", ".tar.zst", ".tar"])
+    def test_round_trip(self, tmp_path, suffix):
+        from geese.utils import archive
+        if suffix == ".tar.zst" and archive.zstandard is None:
+            pytest.skip("zstandard is not installed")
+        export = self._export(tmp_path)
+        path, count, size = archive.write_archive(str(export), str(tmp_path / f"export{suffix}"))
+        assert path.endswith(suffix) and count == 3 and size == os.path.getsize(path)
+        files = archive.ArchiveFiles()
+        files.configure(path)
+        try:
+            exported = files.archive
+            assert sorted(exported.members) == ["g1/configs/objects.yaml", "g1/lookups/l1.csv", "g1/lookups/l2.csv"]
+            assert exported.index["files"]["g1/lookups/l2.csv"]["size"] == 4
+            names = exported.configuration_files("objects.yaml")
+            assert [(n, f.read()) for n, f in exported.read(names)] == [("g1/configs/objects.yaml", b"data: {}\n")]
+            lookup = str(export / "g1" / "lookups" / "l1.csv")
+            assert files.size(lookup) == 4000
+            with files.open(lookup) as f:
+                assert f.read() == b"a,b\n" * 1000
+            with files.open(str(export / "g1" / "lookups" / "l2.csv")) as f:
+                assert f.read() == b"c,d\n"
+            # Not archived: read from disk.
+            assert files.size(str(export / "g1" / "lookups" / "l1.csv.part")) == 7
+        finally:
+            files.close()
+
+    def test_members_extracted_once(self, tmp_path, monkeypatch):
+        from geese.utils import archive
+        export = self._export(tmp_path)
+        path, _, _ = archive.write_archive(str(export), str(tmp_path / "export.tar.gz"))
+        exported = archive.ExportArchive(path)
+        passes = []
+        raw = exported._raw
+        monkeypatch.setattr(exported, "_raw", lambda: passes.append(1) or raw())
+        for name in ["g1/lookups/l2.csv", "g1/lookups/l1.csv", "g1/lookups/l2.csv"]:
+            with exported.open(name) as f:
+                f.read()
+        assert len(passes) == 1
+        spool = exported._spool
+        exported.close()
+        assert not os.path.exists(spool)
+
+    def test_member_replayable(self, tmp_path):
+        from geese.utils import archive
+        export = self._export(tmp_path)
+        path, _, _ = archive.write_archive(str(export), str(tmp_path / "export.tar.gz"))
+        exported = archive.ExportArchive(path)
+        try:
+            # Upload bodies are rewound for retries and the 401 refresh.
+            with exported.open("g1/lookups/l1.csv") as f:
+                assert f.read(4) == b"a,b\n"
+                f.seek(0)
+                assert len(f.read()) == 4000
+        finally:
+            exported.close()
+
+
+class TestAsyncTransport:
+
+    def test_run_order(self):
+        from geese.utils.transport import AsyncTransport
+        transport = AsyncTransport(4)
+        running = []
+
+        def work(i):
+            running.append(i)
+            # Later calls finish first.
+            time.sleep(0.01 * (8 - i))
+            return i * 10
+
+        async def main():
+            return await transport.gather(*[transport.call(work, i) for i in range(8)])
+        assert transport.run(main()) == [i * 10 for i in range(8)]
+        assert sorted(running) == list(range(8)) and transport._executor is None
+
+    def test_run_exception(self):
+        from geese.utils.transport import AsyncTransport
+        transport = AsyncTransport(2)
+
+        def work(i):
+            if i == 2:
+                raise ValueError("page 2")
+            return i
+
+        async def main():
+            return await transport.gather(*[transport.call(work, i) for i in range(4)])
+        with pytest.raises(ValueError, match="page 2"):
+            transport.run(main())
+        assert transport._executor is None
+
+    def test_size_pools(self):
+        from geese.utils.transport import AsyncTransport, size_pools
+        leaders = [{"pool_size": 10}, {"pool_size": 20}, {}]
+        assert size_pools(leaders) == 10
+        assert leaders == [{"pool_size": 10}, {"pool_size": 20}, {}]
+        assert size_pools(leaders, 16) == 16
+        assert leaders == [{"pool_size": 16}, {"pool_size": 20}, {"pool_size": 16}]
+        assert AsyncTransport().max_in_flight == 10
+
+
+class TestResponseCache:
+    url = "https://leader/api/v1/system/outputs"
+
+    @staticmethod
+    def _response(status_code, body=b"", headers=None):
+        from requests.models import Response
+        from requests.structures import CaseInsensitiveDict
+        response = Response()
+        response.status_code = status_code
+        response._content = body
+        response._content_consumed = True
+        response.headers = CaseInsensitiveDict(headers or {})
+        response.encoding = "utf-8"
+        return response
+
+    def _cache(self, tmp_path):
+        from geese.utils.response_cache import ResponseCache
+        cache = ResponseCache()
+        cache.configure(str(tmp_path / "cache"))
+        body = b'{"count": 1, "items": [{"id": "out1"}]}'
+        cache.resolve(self.url, self._response(200, body, {"ETag": '"v1"', "Content-Type": "application/json"}))
+        return cache, body
+
+    def test_not_modified_from_disk(self, tmp_path):
+        cache, body = self._cache(tmp_path)
+        assert cache.conditional_headers(self.url, {"Accept": "*/*"}) == {"Accept": "*/*", "If-None-Match": '"v1"'}
+        cached = cache.resolve(self.url, self._response(304))
+        assert cached.status_code == 200 and cached.content == body and cached.json()["items"][0]["id"] == "out1"
+        assert cached.headers["ETag"] == '"v1"'
+        assert cache.stats["revalidated"] == 1 and cache.stats["bytes_saved"] == len(body)
+
+    def test_not_modified_miss(self, tmp_path, monkeypatch):
+        import geese.knowledge.base as base
+        cache, body = self._cache(tmp_path)
+        os.remove(cache._paths(self.url)[1])
+        assert cache.resolve(self.url, self._response(304)) is None
+        # Removed while the conditional GET was in flight: the GET is sent again without validators.
+        cache.resolve(self.url, self._response(200, body, {"ETag": '"v1"'}))
+        sent = []
+
+        class Leader:
+            def _request(self, method, url, headers=None):
+                sent.append(headers)
+                if "If-None-Match" in headers:
+                    os.remove(cache._paths(url)[1])
+                    return TestResponseCache._response(304)
+                return TestResponseCache._response(200, body, {"ETag": '"v1"'})
+        monkeypatch.setattr(base, "response_cache", cache)
+        response = base.BaseKnowledge._conditional_get(Leader(), self.url, {"Accept": "*/*"})
+        assert response.status_code == 200 and response.content == body
+        assert sent == [{"Accept": "*/*", "If-None-Match": '"v1"'}, {"Accept": "*/*"}]
+        assert os.path.exists(cache._paths(self.url)[1])
+
+
+class TestTokenCache:
+
+    @staticmethod
+    def _jwt(claims):
+        import base64
+        payload = base64.urlsafe_b64encode(json.dumps(claims).encode("utf-8")).decode("ascii").rstrip("=")
+        return f"eyJhbGciOiJIUzI1NiJ9.{payload}.c2lnbmF0dXJl"
+
+    def _cache(self, tmp_path):
+        from geese.utils.token_cache import TokenCache
+        cache = TokenCache()
+        cache.configure(str(tmp_path / "cache" / "tokens.json"))
+        return cache
+
+    def test_token_expiry(self):
+        from geese.utils.token_cache import token_expiry
+        assert token_expiry(self._jwt({"sub": "admin", "exp": 1900000000})) == 1900000000.0
+        # The claim wins over the login response.
+        assert token_expiry(self._jwt({"exp": 1900000000}), {"expires_in": 10}) == 1900000000.0
+        later = token_expiry(self._jwt({"sub": "admin"}), {"expires_in": 3600})
+        assert time.time() + 3590 < later <= time.time() + 3600
+        assert token_expiry("opaque-token", {"expires_in": "soon"}) is None
+        assert token_expiry("a.!!!.c") is None and token_expiry(None) is None
+
+    def test_expiry_margin(self, tmp_path):
+        from geese.utils.token_cache import expiry_margin
+        cache = self._cache(tmp_path)
+        cache.put("k1", "t1", time.time() + expiry_margin + 30)
+        cache.put("k2", "t2", time.time() + expiry_margin - 30)
+        assert cache.get("k1") == "t1"
+        # Still valid, but too close to its expiry to be used for a run.
+        assert cache.get("k2") is None
+        assert oct(os.stat(cache.path).st_mode & 0o777) == oct(0o600)
+
+    def test_expired_not_reused(self, tmp_path):
+        cache = self._cache(tmp_path)
+        cache.put("k1", self._jwt({"exp": 1}), 1)
+        cache.put("k2", "t2", time.time() + 3600)
+        assert cache.get("k1") is None
+        # Expired entries are dropped on the next update.
+        with open(cache.path) as f:
+            assert list(json.load(f)) == ["k2"]
+        cache.drop("k2")
+        assert cache.get("k2") is None
+
+    def test_concurrent_updates(self, tmp_path):
+        # Two caches on the same file stand in for two runs: only the lock file orders their updates.
+        caches = [self._cache(tmp_path), self._cache(tmp_path)]
+        threads = [threading.Thread(target=caches[i % 2].put, args=(f"k{i}", f"t{i}", time.time() + 3600))
+                   for i in range(40)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert all(caches[0].get(f"k{i}") == f"t{i}" for i in range(40))